@@ -22,7 +22,6 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.sites',  # required for allauth
-    'django_cleanup.apps.CleanupConfig',  # for automatic file cleanup
     
     # allauth
     'allauth',
@@ -61,6 +60,8 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.request',  # required for allauth
+                'core.context_processors.unread_messages',
+                'core.context_processors.realtime_events',
             ],
         },
     },
@@ -69,13 +70,34 @@ TEMPLATES = [
 WSGI_APPLICATION = 'config.wsgi.application'
 
 # DATABASE
+# DATABASE_URL when set (render.yaml points the web and worker services at the same
+# PostgreSQL database); SQLite for local dev otherwise
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',   # SQLite engine for local dev
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    'default': dj_database_url.config(
+        default=f"sqlite:///{os.path.join(BASE_DIR, 'db.sqlite3')}",
+    )
 }
 
+# CACHE
+# Facet and city versions, cached counts, unread badges and similar-profile lists
+# (see core/facets.py, core/similar.py, core/conversations.py) must be seen by every
+# server process and by the job worker. REDIS_URL, set by render.yaml, gives them one
+# shared in-memory store. Without it (local dev, tests) each process keeps its own,
+# which is enough for a single runserver process.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # PASSWORD VALIDATION
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -110,13 +132,35 @@ LOGOUT_REDIRECT_URL = '/'
 # Use WhiteNoise for serving static files
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Uploaded photos are stored under the hash of their contents (see core/storage.py).
+# Django 5.1+ reads only STORAGES, so the staticfiles entry keeps today's behaviour.
+STORAGES = {
+    'default': {
+        'BACKEND': 'core.storage.ContentAddressedStorage',
+        'OPTIONS': {'addressed_dirs': ['room_images', 'profile_photos']},
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # DEFAULT AUTO FIELD
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# REAL-TIME EVENTS (see core/realtime.py); one process unless swapped for a shared broker
+REALTIME_BROKER = 'core.realtime.InProcessBroker'
+
 # MEDIA FILES
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Hand media files to a front proxy instead of streaming them from Python (see core/media.py):
+# 'x-accel-redirect' for nginx, with MEDIA_SENDFILE_PREFIX an internal location aliased to
+# MEDIA_ROOT, or 'x-sendfile' for Apache/lighttpd. Empty serves them from Django, as on
+# Render, where no such proxy sits in front of the app.
+MEDIA_SENDFILE = os.getenv('MEDIA_SENDFILE', '')
+MEDIA_SENDFILE_PREFIX = os.getenv('MEDIA_SENDFILE_PREFIX', '/protected-media/')
+
 # ALLAUTH CONFIGURATION
 SITE_ID = 1
 
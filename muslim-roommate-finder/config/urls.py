@@ -1,8 +1,9 @@
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from core import views
 from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -37,6 +38,12 @@ urlpatterns = [
     
     # Messages
     path('inbox/', views.inbox, name='inbox'),
+    path('inbox/<int:conversation_id>/', views.conversation_detail, name='conversation_detail'),
+    path('inbox/<int:conversation_id>/read/', views.conversation_read, name='conversation_read'),
+    path('api/unread-count/', views.unread_count, name='unread_count'),
+    path('api/recipients/', views.recipient_search, name='recipient_search'),
+    path('api/events/', views.event_stream, name='event_stream'),
+    path('api/events/poll/', views.poll_events, name='poll_events'),
     path('compose/', views.compose_message, name='compose_message'),
     path('compose/<int:profile_id>/', views.compose_message, name='compose_message_to'),
     path('rooms/<int:room_id>/messages/', views.message_list_create, name='message_list_create'),
@@ -46,6 +53,8 @@ urlpatterns = [
     path('create-test-account/', views.create_test_account, name='create_test_account'),
 ]
 
-# Serve media files in both development and production
-# Note: For production, consider using a CDN or cloud storage
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Serve media files in both development and production (see core/media.py);
+# static() would serve nothing with DEBUG off
+urlpatterns += [
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), views.serve_media, name='serve_media'),
+]
@@ -1,13 +1,13 @@
 from django.contrib import admin
 from core.models import (
     Profile, RoommateProfile, Contact, Message, Room, RoomType, 
-    Amenity, RoomImage, RoomReview, RoomFavorite, RoomVerification
+    Amenity, RoomImage, RoomReview, RoomFavorite, RoomVerification, City
 )
 
 # Import admin classes
 from .profile_admin import ProfileAdmin
 from .room_admin import RoomAdmin, RoomTypeAdmin, AmenityAdmin, RoomImageAdmin
-from .messaging_admin import MessageAdmin
+from .messaging_admin import MessageAdmin, ConversationAdmin
 from .reviews_admin import RoomReviewAdmin
 
 # Register additional models that don't have custom admin classes
@@ -36,3 +36,10 @@ class RoomVerificationAdmin(admin.ModelAdmin):
     list_display = ("room", "is_verified")
     list_filter = ("is_verified",)
     list_editable = ("is_verified",)
+
+@admin.register(City)
+class CityAdmin(admin.ModelAdmin):
+    list_display = ("name", "state", "aliases")
+    search_fields = ("name", "aliases")
+    list_filter = ("state",)
+    readonly_fields = ("key",)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from core.models import Message
+from core.models import Conversation, Message
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
@@ -7,3 +7,10 @@ class MessageAdmin(admin.ModelAdmin):
     search_fields = ("sender__name", "recipient__name", "content")
     list_filter = ("timestamp",)
     readonly_fields = ("timestamp",)
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ("first_profile", "second_profile", "room", "last_activity")
+    search_fields = ("first_profile__name", "second_profile__name", "room__title")
+    list_filter = ("last_activity",)
+    readonly_fields = ("last_message", "last_activity")
@@ -47,10 +47,6 @@ class RoomAdmin(admin.ModelAdmin):
     def get_price_display(self, obj):
         return obj.get_price_display()
     get_price_display.short_description = "Price"
-    
-    def image_count(self, obj):
-        return obj.image_count
-    image_count.short_description = "Images"
 
 @admin.register(RoomType)
 class RoomTypeAdmin(admin.ModelAdmin):
@@ -3,7 +3,8 @@ from django.db.models.signals import post_migrate
 from django.utils.text import slugify
 
 def seed_data(sender, **kwargs):
-    from core.models import RoomType, Amenity
+    from core import cities, geo
+    from core.models import RoomType, Amenity, City
 
     roomtypes = ["Entire place", "Private room", "Shared room"]
     amenities = ["Wifi", "Parking", "Furnished", "Laundry", "Utilities included"]
@@ -19,6 +20,10 @@ def seed_data(sender, **kwargs):
             defaults={'slug': slugify(name)}
     )
 
+    # Seed canonical cities
+    cities.seed(City)
+    geo.seed_coordinates(City)
+
 class CoreConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "core"
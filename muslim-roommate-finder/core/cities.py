@@ -0,0 +1,431 @@
+"""
+Canonical cities for Room and Profile.
+
+City is still typed as free text, but each Room and Profile also points at a
+City row through ``canonical_city``. Spelling variants ("st. louis",
+"Saint Louis") and aliases ("NYC") resolve to the same row, so the views can
+filter with ``canonical_city__in=[...]`` (an index seek) instead of
+``city__icontains`` (a full scan).
+
+Only the seeded cities and those an admin adds are canonical. A name that
+matches no City or alias stays as typed, with ``canonical_city`` empty, so
+typos never grow the table or invalidate the index. unresolved() lists
+those names for review; once a City or alias covers one, ``backfill_cities
+--missing-only`` attaches its rows.
+
+Name lookups go through an in-process index of normalized keys. It is rebuilt
+when the version token in the cache changes, the same way as core/facets.py.
+"""
+import functools
+import re
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+VERSION_KEY = 'cities:version'
+
+# Reload the in-process index at least this often
+MAX_AGE = 300
+
+# Seed rows: (name, state code, aliases). When a name exists in several states
+# and nothing says which one is meant, the first listed wins.
+CITY_DATA = [
+    ("New York", "NY", ("NYC", "New York City", "Manhattan", "Brooklyn", "Queens", "Bronx")),
+    ("Los Angeles", "CA", ("LA",)),
+    ("Chicago", "IL", ()),
+    ("Houston", "TX", ()),
+    ("Phoenix", "AZ", ()),
+    ("Philadelphia", "PA", ("Philly",)),
+    ("San Antonio", "TX", ()),
+    ("San Diego", "CA", ()),
+    ("Dallas", "TX", ()),
+    ("San Jose", "CA", ()),
+    ("Austin", "TX", ()),
+    ("Jacksonville", "FL", ()),
+    ("Fort Worth", "TX", ()),
+    ("Columbus", "OH", ()),
+    ("Columbus", "GA", ()),
+    ("Charleston", "SC", ("West Ashley", "James Island", "Daniel Island")),
+    ("Charleston", "WV", ()),
+    ("Charlotte", "NC", ()),
+    ("San Francisco", "CA", ("SF", "San Fran")),
+    ("Indianapolis", "IN", ("Indy",)),
+    ("Seattle", "WA", ()),
+    ("Denver", "CO", ()),
+    ("Washington", "DC", ("Washington DC", "DC", "D.C.")),
+    ("Boston", "MA", ()),
+    ("El Paso", "TX", ()),
+    ("Nashville", "TN", ()),
+    ("Detroit", "MI", ()),
+    ("Oklahoma City", "OK", ("OKC",)),
+    ("Portland", "OR", ()),
+    ("Portland", "ME", ()),
+    ("Las Vegas", "NV", ("Vegas",)),
+    ("Memphis", "TN", ()),
+    ("Louisville", "KY", ()),
+    ("Baltimore", "MD", ()),
+    ("Milwaukee", "WI", ()),
+    ("Albuquerque", "NM", ()),
+    ("Tucson", "AZ", ()),
+    ("Fresno", "CA", ()),
+    ("Sacramento", "CA", ()),
+    ("Kansas City", "MO", ("KC",)),
+    ("Kansas City", "KS", ()),
+    ("Mesa", "AZ", ()),
+    ("Atlanta", "GA", ("ATL",)),
+    ("Omaha", "NE", ()),
+    ("Colorado Springs", "CO", ()),
+    ("Raleigh", "NC", ()),
+    ("Miami", "FL", ()),
+    ("Long Beach", "CA", ()),
+    ("Virginia Beach", "VA", ()),
+    ("Minneapolis", "MN", ()),
+    ("Tampa", "FL", ()),
+    ("Oakland", "CA", ()),
+    ("New Orleans", "LA", ("NOLA",)),
+    ("Wichita", "KS", ()),
+    ("Arlington", "TX", ()),
+    ("Arlington", "VA", ()),
+    ("Cleveland", "OH", ()),
+    ("Bakersfield", "CA", ()),
+    ("Honolulu", "HI", ()),
+    ("Anaheim", "CA", ()),
+    ("Santa Ana", "CA", ()),
+    ("Riverside", "CA", ()),
+    ("Corpus Christi", "TX", ()),
+    ("Lexington", "KY", ()),
+    ("Stockton", "CA", ()),
+    ("Henderson", "NV", ()),
+    ("Saint Paul", "MN", ()),
+    ("St. Louis", "MO", ("STL",)),
+    ("Cincinnati", "OH", ()),
+    ("Pittsburgh", "PA", ()),
+    ("Greensboro", "NC", ()),
+    ("Anchorage", "AK", ()),
+    ("Plano", "TX", ()),
+    ("Lincoln", "NE", ()),
+    ("Orlando", "FL", ()),
+    ("Irvine", "CA", ()),
+    ("Newark", "NJ", ()),
+    ("Durham", "NC", ()),
+    ("Chula Vista", "CA", ()),
+    ("Toledo", "OH", ()),
+    ("Fort Wayne", "IN", ()),
+    ("St. Petersburg", "FL", ()),
+    ("Laredo", "TX", ()),
+    ("Jersey City", "NJ", ()),
+    ("Chandler", "AZ", ()),
+    ("Madison", "WI", ()),
+    ("Lubbock", "TX", ()),
+    ("Scottsdale", "AZ", ()),
+    ("Reno", "NV", ()),
+    ("Buffalo", "NY", ()),
+    ("Gilbert", "AZ", ()),
+    ("Glendale", "AZ", ()),
+    ("Glendale", "CA", ()),
+    ("North Las Vegas", "NV", ()),
+    ("Winston-Salem", "NC", ()),
+    ("Chesapeake", "VA", ()),
+    ("Norfolk", "VA", ()),
+    ("Fremont", "CA", ()),
+    ("Garland", "TX", ()),
+    ("Irving", "TX", ()),
+    ("Hialeah", "FL", ()),
+    ("Richmond", "VA", ()),
+    ("Boise", "ID", ()),
+    ("Spokane", "WA", ()),
+    ("Baton Rouge", "LA", ()),
+    ("Tacoma", "WA", ()),
+    ("San Bernardino", "CA", ()),
+    ("Modesto", "CA", ()),
+    ("Fontana", "CA", ()),
+    ("Des Moines", "IA", ()),
+    ("Moreno Valley", "CA", ()),
+    ("Santa Clarita", "CA", ()),
+    ("Fayetteville", "NC", ()),
+    ("Fayetteville", "AR", ()),
+    ("Birmingham", "AL", ()),
+    ("Oxnard", "CA", ()),
+    ("Rochester", "NY", ()),
+    ("Port St. Lucie", "FL", ()),
+    ("Grand Rapids", "MI", ()),
+    ("Huntsville", "AL", ()),
+    ("Salt Lake City", "UT", ("SLC",)),
+    ("Frisco", "TX", ()),
+    ("Yonkers", "NY", ()),
+    ("Amarillo", "TX", ()),
+    ("Huntington Beach", "CA", ()),
+    ("McKinney", "TX", ()),
+    ("Montgomery", "AL", ()),
+    ("Augusta", "GA", ()),
+    ("Aurora", "CO", ()),
+    ("Aurora", "IL", ()),
+    ("Akron", "OH", ()),
+    ("Little Rock", "AR", ()),
+    ("Tempe", "AZ", ()),
+    ("Overland Park", "KS", ()),
+    ("Mount Pleasant", "SC", ("Mt Pleasant",)),
+    ("North Charleston", "SC", ()),
+    ("Summerville", "SC", ()),
+]
+
+# Metro areas with more than one seeded city. Any other city is a metro of its own.
+METRO_AREAS = {
+    "New York": [("New York", "NY"), ("Newark", "NJ"), ("Jersey City", "NJ"), ("Yonkers", "NY")],
+    "Los Angeles": [
+        ("Los Angeles", "CA"), ("Long Beach", "CA"), ("Anaheim", "CA"), ("Santa Ana", "CA"),
+        ("Irvine", "CA"), ("Glendale", "CA"), ("Huntington Beach", "CA"), ("Santa Clarita", "CA"),
+    ],
+    "Inland Empire": [("Riverside", "CA"), ("San Bernardino", "CA"), ("Fontana", "CA"), ("Moreno Valley", "CA")],
+    "San Francisco Bay Area": [("San Francisco", "CA"), ("Oakland", "CA"), ("Fremont", "CA"), ("San Jose", "CA")],
+    "San Diego": [("San Diego", "CA"), ("Chula Vista", "CA")],
+    "Chicago": [("Chicago", "IL"), ("Aurora", "IL")],
+    "Dallas-Fort Worth": [
+        ("Dallas", "TX"), ("Fort Worth", "TX"), ("Arlington", "TX"), ("Plano", "TX"),
+        ("Irving", "TX"), ("Garland", "TX"), ("Frisco", "TX"), ("McKinney", "TX"),
+    ],
+    "Phoenix": [
+        ("Phoenix", "AZ"), ("Mesa", "AZ"), ("Chandler", "AZ"), ("Scottsdale", "AZ"),
+        ("Gilbert", "AZ"), ("Glendale", "AZ"), ("Tempe", "AZ"),
+    ],
+    "Washington": [("Washington", "DC"), ("Arlington", "VA")],
+    "Miami": [("Miami", "FL"), ("Hialeah", "FL")],
+    "Tampa Bay": [("Tampa", "FL"), ("St. Petersburg", "FL")],
+    "Minneapolis-Saint Paul": [("Minneapolis", "MN"), ("Saint Paul", "MN")],
+    "Las Vegas": [("Las Vegas", "NV"), ("Henderson", "NV"), ("North Las Vegas", "NV")],
+    "Kansas City": [("Kansas City", "MO"), ("Kansas City", "KS"), ("Overland Park", "KS")],
+    "Denver": [("Denver", "CO"), ("Aurora", "CO")],
+    "Hampton Roads": [("Virginia Beach", "VA"), ("Norfolk", "VA"), ("Chesapeake", "VA")],
+    "Raleigh-Durham": [("Raleigh", "NC"), ("Durham", "NC")],
+    "Piedmont Triad": [("Greensboro", "NC"), ("Winston-Salem", "NC")],
+    "Seattle": [("Seattle", "WA"), ("Tacoma", "WA")],
+    "Charleston": [("Charleston", "SC"), ("Mount Pleasant", "SC"), ("North Charleston", "SC"), ("Summerville", "SC")],
+}
+
+_memo = {'version': None, 'loaded_at': 0, 'index': {}, 'keys': {}}
+
+
+def normalize(name):
+    """Lookup key for a city name: lowercase, no punctuation, "St." spelled "saint"."""
+    key = (name or '').lower()
+    key = re.sub(r'\bst\b\.?', 'saint', key)
+    key = re.sub(r'\bft\b\.?', 'fort', key)
+    key = re.sub(r'[^\w\s]', ' ', key)
+    return ' '.join(key.split())
+
+
+@functools.lru_cache(maxsize=1)
+def _state_codes():
+    from .models import US_STATES
+
+    codes = {'DC': 'DC', 'DISTRICT OF COLUMBIA': 'DC'}
+    for code, name in US_STATES.items():
+        codes[code] = code
+        codes[name.upper()] = code
+    return codes
+
+
+def normalize_state(value):
+    """Two-letter code for a state code or full state name, or '' if unknown."""
+    return _state_codes().get(' '.join((value or '').upper().split()), '')
+
+
+@functools.lru_cache(maxsize=1)
+def _metro_map():
+    return {
+        (normalize(name), state): metro
+        for metro, members in METRO_AREAS.items()
+        for name, state in members
+    }
+
+
+def metro_for(name, state):
+    """Metro area name for a city; cities outside METRO_AREAS are their own metro."""
+    metro = _metro_map().get((normalize(name), state))
+    if metro:
+        return metro
+    return f"{name.strip()}, {state}" if state else name.strip()
+
+
+def alias_keys(city):
+    """Normalized keys for a City's comma-separated aliases."""
+    return [normalize(alias) for alias in (city.aliases or '').split(',') if normalize(alias)]
+
+
+# --- Index ---
+def build_index(city_model):
+    """
+    Map each normalized name or alias to [(city id, state), ...], seed order first.
+
+    Takes the model class so migrations can pass their historical model.
+    """
+    index = {}
+    for city in city_model.objects.order_by('pk'):
+        for key in [city.key] + alias_keys(city):
+            entries = index.setdefault(key, [])
+            if (city.pk, city.state) not in entries:
+                entries.append((city.pk, city.state))
+    return index
+
+
+def _bump_version():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate():
+    """Drop the index here and, once the transaction commits, everywhere else."""
+    _memo['version'] = None
+    transaction.on_commit(_bump_version)
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_index():
+    from .models import City
+
+    version = _current_version()
+    if _memo['version'] != version or time.monotonic() - _memo['loaded_at'] > MAX_AGE:
+        index = build_index(City)
+        # City id -> every key that resolves to it
+        keys = {}
+        for key, entries in index.items():
+            for pk, _ in entries:
+                keys.setdefault(pk, set()).add(key)
+        _memo.update(index=index, keys=keys, version=version, loaded_at=time.monotonic())
+    return _memo['index']
+
+
+def _pick(entries, state):
+    if state:
+        entries = [entry for entry in entries if entry[1] == state]
+    return entries[0][0] if entries else None
+
+
+def _partial_entries(index, key):
+    """Entries of the keys starting with ``key`` or, failing that, containing it, seed order first."""
+    for matches in (lambda other: other.startswith(key), lambda other: key in other):
+        found = {entry for other, entries in index.items() if matches(other) for entry in entries}
+        if found:
+            return sorted(found)
+    return []
+
+
+# --- Lookups ---
+def lookup(name, state='', partial=True):
+    """
+    Ids of every City the text could mean, for ``canonical_city__in`` filters.
+
+    "Columbus" gives both Columbus rows; "Columbus" with state "GA" gives one.
+    Text that is no city's name or alias falls back to the cities whose name
+    or an alias starts with it, then to those containing it, as the old
+    ``city__icontains`` filters did: "Charl" gives both Charlestons and
+    Charlotte. ``partial=False`` skips the fallback.
+    """
+    key = normalize(name)
+    if not key:
+        return []
+    index = get_index()
+    entries = index.get(key)
+    if entries is None and partial:
+        entries = _partial_entries(index, key)
+    state = normalize_state(state)
+    return [pk for pk, city_state in entries or () if not state or city_state == state]
+
+
+def equivalent_keys(names, state=''):
+    """
+    Every normalized key meaning the same city as one of ``names``: the names
+    themselves plus the names and aliases of the cities they resolve to.
+    "NYC" gives {"nyc", "new york", "new york city", "manhattan", ...}.
+    """
+    keys = {normalize(name) for name in names} - {''}
+    ids = {pk for name in names for pk in lookup(name, state, partial=False)}
+    for pk in ids:
+        keys |= _memo['keys'].get(pk, set())
+    return keys
+
+
+def resolve(name, state='', index=None):
+    """
+    The id of the known City a typed name refers to, or None.
+
+    ``state`` narrows names that exist in several states. Names no City or
+    alias matches give None and are kept only as typed; see unresolved().
+    ``index`` lets a backfill resolve many rows against one index.
+    """
+    key = normalize(name)
+    if not key:
+        return None
+    entries = (get_index() if index is None else index).get(key, [])
+    return _pick(entries, normalize_state(state))
+
+
+def city_filter(text):
+    """
+    Q for the rows in the city ``text`` means: those pointing at a City it
+    may name (see lookup()), and those whose typed city matched no City but
+    reads the same.
+    """
+    return Q(canonical_city__in=lookup(text)) | Q(canonical_city__isnull=True, city__iexact=text.strip())
+
+
+def unresolved(model):
+    """Typed city names of ``model`` rows that match no City, most used first, for review."""
+    return (
+        model.objects.filter(canonical_city__isnull=True).exclude(city__isnull=True).exclude(city='')
+        .values('city').annotate(rows=Count('pk')).order_by('-rows', 'city')
+    )
+
+
+# --- Seeding and backfill ---
+def seed(city_model):
+    """Insert the CITY_DATA rows that are missing."""
+    existing = set(city_model.objects.values_list('key', 'state'))
+    city_model.objects.bulk_create(
+        city_model(
+            name=name, state=state, key=normalize(name), aliases=', '.join(aliases),
+            metro=metro_for(name, state),
+        )
+        for name, state, aliases in CITY_DATA
+        if (normalize(name), state) not in existing
+    )
+    # Aliases added to CITY_DATA after a row was seeded
+    for name, state, aliases in CITY_DATA:
+        if aliases and (normalize(name), state) in existing:
+            city_model.objects.filter(key=normalize(name), state=state, aliases='').update(aliases=', '.join(aliases))
+
+
+def backfill(model, city_model, state_field, batch_size=1000, only_missing=False):
+    """
+    Point ``canonical_city`` at the right City for every row of ``model``.
+
+    Rows are read in primary-key batches and updated with one UPDATE per city
+    per batch. ``state_field`` is the lookup that holds the state hint, e.g.
+    'state' for Profile or 'user__state' for Room. Returns the rows updated.
+    """
+    index = build_index(city_model)
+    rows = model.objects.order_by('pk')
+    if only_missing:
+        rows = rows.filter(canonical_city__isnull=True)
+    updated = 0
+    last_pk = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_pk).values_list('pk', 'city', state_field)[:batch_size])
+        if not batch:
+            break
+        by_city = {}
+        for pk, city, state in batch:
+            by_city.setdefault(resolve(city, state, index=index), []).append(pk)
+        for city_id, pks in by_city.items():
+            updated += model.objects.filter(pk__in=pks).update(canonical_city=city_id)
+        last_pk = batch[-1][0]
+    return updated
@@ -0,0 +1,21 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import conversations, realtime
+
+
+def unread_messages(request):
+    """
+    ``unread_message_count`` for the navbar badge.
+
+    Lazy, so pages that do not show the badge never look it up, and read from
+    the cache, so pages that do show it usually add no database query.
+    """
+    def count():
+        user = request.user
+        return conversations.unread_total(user.pk) if user.is_authenticated else 0
+    return {'unread_message_count': SimpleLazyObject(count)}
+
+
+def realtime_events(request):
+    """Where templates connect for realtime events (see core/realtime.py)."""
+    return {'realtime_socket_path': realtime.WEBSOCKET_PATH}
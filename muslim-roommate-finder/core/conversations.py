@@ -0,0 +1,277 @@
+"""
+Conversation threads between two profiles.
+
+A Conversation holds the messages exchanged by two profiles, optionally about
+one Room. It stores its last message and when that was sent. Each side also
+has a ConversationParticipant row with its own unread count and a copy of
+``last_activity``, so one indexed query lists a page of someone's inbox.
+
+Read state is a cursor per participant rather than a flag per message: the
+id of the newest message they have read (``last_read_id``) and when. The
+messages they received with a higher id are unread. Marking a thread read
+moves the cursor, which writes one row however long the thread is.
+
+Message.save() starts the conversation if needed and calls record_message()
+in the same transaction as the insert, so the counters never drift from the
+messages. Deleting a message goes through remove_message().
+
+A pair has at most one conversation without a room. Deleting a room would
+otherwise leave its conversations room-less next to that one, so
+close_room() first merges them into it.
+
+Each user's total unread count, for the navbar badge, is cached under
+badge_key(). The functions here adjust it with incr/decr once their
+transaction commits, and unread_total() rebuilds it from the participant
+rows on a miss. The entry expires after BADGE_TIMEOUT, so it can only drift
+briefly.
+
+Marking messages read publishes a 'read' event (see core/realtime.py) to the
+reader and to the other side of each conversation.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (
+    BigIntegerField, Case, DateTimeField, F, OuterRef, PositiveIntegerField, Subquery, Sum, When,
+)
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import realtime
+
+# Conversations per inbox page, and messages per page of a thread
+INBOX_PAGE_SIZE = 20
+THREAD_PAGE_SIZE = 30
+
+# Seconds a cached unread total may live
+BADGE_TIMEOUT = 60 * 5
+
+
+def _pair(profile_id, other_id):
+    return (profile_id, other_id) if profile_id < other_id else (other_id, profile_id)
+
+
+# --- Unread badge ---
+def badge_key(user_id):
+    return f'unread:{user_id}'
+
+
+def unread_total(user_id):
+    """Unread messages across all of a user's conversations, from the cache when possible."""
+    from .models import ConversationParticipant
+
+    total = cache.get(badge_key(user_id))
+    if total is None:
+        total = ConversationParticipant.objects.filter(profile__user=user_id).aggregate(
+            total=Sum('unread_count')
+        )['total'] or 0
+        cache.add(badge_key(user_id), total, BADGE_TIMEOUT)
+    return max(total, 0)
+
+
+def adjust_badge(user_id, delta):
+    """Add ``delta`` to a cached unread total once the transaction commits; misses are left to rebuild."""
+    def apply():
+        try:
+            cache.incr(badge_key(user_id), delta)
+        except ValueError:
+            pass
+    if delta:
+        transaction.on_commit(apply)
+
+
+def reset_badge(user_id):
+    """Drop a cached unread total once the transaction commits."""
+    transaction.on_commit(lambda: cache.delete(badge_key(user_id)))
+
+
+# --- Conversations ---
+def find(profile_id, other_id, room_id=None):
+    """The conversation between two profiles (about ``room_id``), or None."""
+    from .models import Conversation
+
+    first, second = _pair(profile_id, other_id)
+    return Conversation.objects.filter(first_profile=first, second_profile=second, room=room_id).first()
+
+
+def get_or_start(profile_id, other_id, room_id=None):
+    """The conversation between two profiles (about ``room_id``), created with its participants if new."""
+    from .models import Conversation, ConversationParticipant
+
+    first, second = _pair(profile_id, other_id)
+    with transaction.atomic():
+        conversation, created = Conversation.objects.get_or_create(
+            first_profile_id=first, second_profile_id=second, room_id=room_id
+        )
+        if created:
+            ConversationParticipant.objects.bulk_create([
+                ConversationParticipant(conversation=conversation, profile_id=first, other_id=second,
+                                        last_activity=conversation.last_activity),
+                ConversationParticipant(conversation=conversation, profile_id=second, other_id=first,
+                                        last_activity=conversation.last_activity),
+            ])
+    return conversation
+
+
+def merge(conversation_id, into_id):
+    """
+    Move a conversation's messages into another one between the same two
+    profiles, and drop it. Each participant's cursor is set just before their
+    earliest unread message in either, so nothing unread is lost.
+    """
+    from .models import Conversation, ConversationParticipant, Message
+
+    with transaction.atomic():
+        cursors = {}
+        for conversation, profile_id, last_read_id in ConversationParticipant.objects.filter(
+            conversation__in=(conversation_id, into_id)
+        ).values_list('conversation', 'profile', 'last_read_id'):
+            first_unread = (
+                unread_after(Message, conversation, profile_id, last_read_id)
+                .order_by('pk').values_list('pk', flat=True).first()
+            )
+            read_up_to = last_read_id if first_unread is None else first_unread - 1
+            cursors[profile_id] = min(cursors.get(profile_id, read_up_to), read_up_to)
+        Message.objects.filter(conversation=conversation_id).update(conversation=into_id)
+        Conversation.objects.filter(pk=conversation_id).delete()
+        latest = (
+            Message.objects.filter(conversation=into_id)
+            .order_by('-id').values_list('pk', 'timestamp').first()
+        )
+        if latest is None:
+            return
+        last_id, last_activity = latest
+        Conversation.objects.filter(pk=into_id).update(last_message=last_id, last_activity=last_activity)
+        for participant in ConversationParticipant.objects.filter(conversation=into_id).select_related('profile'):
+            participant.last_read_id = cursors[participant.profile_id]
+            participant.unread_count = unread_after(
+                Message, into_id, participant.profile_id, participant.last_read_id
+            ).count()
+            participant.last_activity = last_activity
+            participant.save(update_fields=['last_read_id', 'unread_count', 'last_activity'])
+            reset_badge(participant.profile.user_id)
+
+
+def close_room(room_id):
+    """Before a room is deleted, merge its conversations into their pair's conversation without a room."""
+    from .models import Conversation
+
+    for conversation in Conversation.objects.filter(room=room_id):
+        general = find(conversation.first_profile_id, conversation.second_profile_id)
+        if general is not None:
+            merge(conversation.pk, general.pk)
+
+
+def record_message(message):
+    """
+    Make ``message`` its conversation's last message and count it as unread
+    for the recipient. Replying counts as reading, so the sender's cursor
+    moves up to the message and the sender's badge is rebuilt.
+    """
+    from .models import Conversation, ConversationParticipant
+
+    Conversation.objects.filter(pk=message.conversation_id).update(
+        last_message=message, last_activity=message.timestamp
+    )
+    ConversationParticipant.objects.filter(conversation=message.conversation_id).update(
+        last_activity=message.timestamp,
+        unread_count=Case(
+            When(profile=message.sender_id, then=0),
+            default=F('unread_count') + 1,
+            output_field=PositiveIntegerField(),
+        ),
+        last_read_id=Case(
+            When(profile=message.sender_id, then=message.pk),
+            default=F('last_read_id'),
+            output_field=BigIntegerField(),
+        ),
+        last_read_at=Case(
+            When(profile=message.sender_id, then=message.timestamp),
+            default=F('last_read_at'),
+            output_field=DateTimeField(),
+        ),
+    )
+    adjust_badge(message.recipient.user_id, 1)
+    reset_badge(message.sender.user_id)
+
+
+def remove_message(message):
+    """Undo record_message() for a deleted message; drops the conversation once it is empty."""
+    from .models import Conversation, ConversationParticipant, Message
+
+    participants = ConversationParticipant.objects.filter(conversation=message.conversation_id)
+    # Only a message past the recipient's cursor was counted as unread
+    if participants.filter(profile=message.recipient_id, last_read_id__lt=message.pk).update(
+        unread_count=Greatest(F('unread_count') - 1, 0, output_field=PositiveIntegerField())
+    ):
+        adjust_badge(message.recipient.user_id, -1)
+
+    latest = (
+        Message.objects.filter(conversation=message.conversation_id)
+        .order_by('-id').values_list('pk', 'timestamp').first()
+    )
+    if latest is None:
+        Conversation.objects.filter(pk=message.conversation_id).delete()
+        return
+    last_id, last_activity = latest
+    Conversation.objects.filter(pk=message.conversation_id).update(
+        last_message=last_id, last_activity=last_activity
+    )
+    participants.update(last_activity=last_activity)
+
+
+def unread_after(message_model, conversation, profile, last_read_id):
+    """
+    Messages ``profile`` received in ``conversation`` after ``last_read_id``;
+    a range scan of the (conversation, id) index. Takes the Message class so
+    migrations can pass theirs.
+    """
+    return message_model.objects.filter(conversation=conversation, recipient=profile, pk__gt=last_read_id)
+
+
+def mark_read(conversation_id, profile, up_to_id):
+    """
+    Move ``profile``'s cursor in a conversation up to message ``up_to_id``.
+
+    Cursors only move forward. The unread count is recounted past the new
+    cursor, so messages that arrived after ``up_to_id`` stay unread.
+    Returns the number of messages that became read.
+    """
+    from .models import ConversationParticipant, Message
+
+    with transaction.atomic():
+        # Lock the row so a message arriving meanwhile is not lost from the count
+        row = (
+            ConversationParticipant.objects.select_for_update(of=('self',))
+            .filter(conversation=conversation_id, profile=profile, last_read_id__lt=up_to_id)
+            .values_list('pk', 'unread_count', 'other__user').first()
+        )
+        if row is None:
+            return 0
+        pk, before, other_user_id = row
+        remaining = unread_after(Message, conversation_id, profile, up_to_id).count()
+        ConversationParticipant.objects.filter(pk=pk).update(
+            last_read_id=up_to_id, last_read_at=timezone.now(), unread_count=remaining
+        )
+        adjust_badge(profile.user_id, remaining - before)
+        realtime.publish_read(profile, {conversation_id: (other_user_id, up_to_id)})
+    return before - remaining
+
+
+def mark_all_read(profile):
+    """Move every cursor of a profile with unread messages to its conversation's last message."""
+    from .models import Conversation, ConversationParticipant
+
+    last_message = Conversation.objects.filter(pk=OuterRef('conversation')).values('last_message')[:1]
+    with transaction.atomic():
+        unread = ConversationParticipant.objects.filter(profile=profile, unread_count__gt=0)
+        rows = list(unread.select_for_update(of=('self',)).values_list(
+            'conversation', 'unread_count', 'other__user', 'conversation__last_message'
+        ))
+        unread.update(last_read_id=Subquery(last_message), last_read_at=timezone.now(), unread_count=0)
+        before = sum(row[1] for row in rows)
+        adjust_badge(profile.user_id, -before)
+        realtime.publish_read(profile, {
+            conversation_id: (other_user_id, last_message_id)
+            for conversation_id, _, other_user_id, last_message_id in rows
+        })
+    return before
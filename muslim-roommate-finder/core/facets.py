@@ -0,0 +1,119 @@
+"""
+Registry of distinct profile cities/states and room cities, with counts.
+
+The filter dropdowns used to run a DISTINCT sort over the whole table on every
+page view. LocationFacet rows are adjusted one at a time by the save/delete
+signals in core/models.py instead. Readers keep an in-process copy that is
+reloaded only when the shared version key in the cache changes.
+"""
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+
+VERSION_KEY = 'facets:version'
+
+# Reload the in-process copy at least this often, in case the cache is not
+# shared between worker processes.
+MAX_AGE = 300
+
+# Facet kind -> model field, per model
+FACET_FIELDS = {
+    'profile': {'profile_city': 'city', 'profile_state': 'state'},
+    'room': {'room_city': 'city'},
+}
+
+_memo = {'version': None, 'loaded_at': 0, 'values': {}}
+
+
+def _bump_version():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _normalize(value):
+    return (value or '').strip()
+
+
+def adjust(kind, value, delta):
+    """Add ``delta`` to the count for one facet value, creating or dropping the row."""
+    from .models import LocationFacet
+
+    value = _normalize(value)
+    if not value or not delta:
+        return
+    rows = LocationFacet.objects.filter(kind=kind, value=value)
+    if not rows.update(count=F('count') + delta) and delta > 0:
+        facet, created = LocationFacet.objects.get_or_create(kind=kind, value=value, defaults={'count': delta})
+        if not created:
+            rows.update(count=F('count') + delta)
+    rows.filter(count__lte=0).delete()
+    transaction.on_commit(_bump_version)
+
+
+def snapshot(instance):
+    """Facet values an instance currently has, keyed by facet kind."""
+    fields = FACET_FIELDS[instance._meta.model_name]
+    return {kind: _normalize(getattr(instance, field)) for kind, field in fields.items()}
+
+
+def record_change(before, after):
+    """Apply the difference between two snapshots (either may be None)."""
+    for kind in (after or before or {}):
+        old = (before or {}).get(kind, '')
+        new = (after or {}).get(kind, '')
+        if old != new:
+            adjust(kind, old, -1)
+            adjust(kind, new, 1)
+
+
+def rebuild():
+    """Recount every facet from scratch."""
+    from .models import LocationFacet, Profile, Room
+
+    models = {'profile': Profile, 'room': Room}
+    with transaction.atomic():
+        LocationFacet.objects.all().delete()
+        for model_name, fields in FACET_FIELDS.items():
+            for kind, field in fields.items():
+                totals = {}
+                rows = models[model_name].objects.order_by().values(field).annotate(total=Count('pk'))
+                for row in rows:
+                    value = _normalize(row[field])
+                    if value:
+                        totals[value] = totals.get(value, 0) + row['total']
+                LocationFacet.objects.bulk_create(
+                    LocationFacet(kind=kind, value=value, count=total) for value, total in totals.items()
+                )
+        transaction.on_commit(_bump_version)
+
+
+def _load():
+    from .models import LocationFacet
+
+    values = {}
+    for kind, value, count in LocationFacet.objects.order_by('kind', 'value').values_list('kind', 'value', 'count'):
+        values.setdefault(kind, []).append((value, count))
+    return values
+
+
+def get_facet(kind):
+    """Return [(value, count), ...] for a facet kind, sorted by value."""
+    version = _current_version()
+    if _memo['version'] != version or time.monotonic() - _memo['loaded_at'] > MAX_AGE:
+        _memo.update(values=_load(), version=version, loaded_at=time.monotonic())
+    return _memo['values'].get(kind, [])
+
+
+def values(kind):
+    """Just the distinct values for a facet kind, for filter dropdowns."""
+    return [value for value, count in get_facet(kind)]
@@ -0,0 +1,210 @@
+"""
+Offline geocoding and "within N miles" search.
+
+Coordinates come from core/data/us_city_centroids.csv, which lists the center of
+each seeded City and the three-digit ZIP prefixes that map to it. A Profile is
+placed at its ZIP prefix if known, otherwise at its canonical city. A Room is
+placed at its canonical city. Both also store ``geo_cell``, a grid square of
+CELL_DEGREES on each side.
+
+apply_radius() works entirely in SQL: the grid cells and lat/lon bounding box
+around the origin narrow the rows through their indexes, and the exact
+great-circle distance is computed, filtered and sorted on in the same query so
+views can page through every match. haversine_miles() is the NumPy version for
+code that already holds the coordinates.
+"""
+import csv
+import functools
+import math
+from pathlib import Path
+
+import numpy as np
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+DATA_FILE = Path(__file__).resolve().parent / 'data' / 'us_city_centroids.csv'
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LAT = 69.0
+
+# Grid square size; 0.5 degrees is about 35 miles north to south
+CELL_DEGREES = 0.5
+
+# Past this many cells the IN list costs more than it saves; use the box alone
+MAX_CELLS = 200
+
+# Choices for the "within" dropdowns
+RADIUS_CHOICES = [5, 10, 25, 50, 100]
+
+
+# --- Dataset ---
+@functools.lru_cache(maxsize=1)
+def load_centroids():
+    """Rows of the bundled dataset: (name, state, latitude, longitude, [zip prefixes])."""
+    with open(DATA_FILE, newline='') as handle:
+        return [
+            (row['name'], row['state'], float(row['latitude']), float(row['longitude']),
+             row['zip_prefixes'].split())
+            for row in csv.DictReader(handle)
+        ]
+
+
+@functools.lru_cache(maxsize=1)
+def _zip_prefixes():
+    return {
+        prefix: (latitude, longitude)
+        for _, _, latitude, longitude, prefixes in load_centroids()
+        for prefix in prefixes
+    }
+
+
+def zip_centroid(zip_code):
+    """(lat, lon) for a ZIP code's three-digit prefix, or None."""
+    digits = ''.join(ch for ch in (zip_code or '') if ch.isdigit())
+    if len(digits) < 3:
+        return None
+    return _zip_prefixes().get(digits[:3])
+
+
+def seed_coordinates(city_model):
+    """Fill in latitude/longitude for City rows that are in the dataset but have none."""
+    from .cities import normalize
+
+    centroids = {(normalize(name), state): (lat, lon) for name, state, lat, lon, _ in load_centroids()}
+    missing = []
+    for city in city_model.objects.filter(latitude__isnull=True):
+        coords = centroids.get((city.key, city.state))
+        if coords:
+            city.latitude, city.longitude = coords
+            missing.append(city)
+    city_model.objects.bulk_update(missing, ['latitude', 'longitude'])
+
+
+# --- Grid ---
+def grid_cell(latitude, longitude):
+    """Integer id of the grid square containing a point, or None."""
+    if latitude is None or longitude is None:
+        return None
+    row = int((latitude + 90) // CELL_DEGREES)
+    col = int((longitude + 180) // CELL_DEGREES)
+    return row * 1000 + col
+
+
+def bounding_box(latitude, longitude, miles):
+    """(min_lat, max_lat, min_lon, max_lon) enclosing a circle of ``miles``."""
+    dlat = miles / MILES_PER_DEGREE_LAT
+    dlon = miles / max(MILES_PER_DEGREE_LAT * math.cos(math.radians(latitude)), 1e-6)
+    return latitude - dlat, latitude + dlat, longitude - dlon, longitude + dlon
+
+
+def cells_for_box(min_lat, max_lat, min_lon, max_lon):
+    """Every grid cell overlapping the box, or None if there are more than MAX_CELLS."""
+    rows = range(int((min_lat + 90) // CELL_DEGREES), int((max_lat + 90) // CELL_DEGREES) + 1)
+    cols = range(int((min_lon + 180) // CELL_DEGREES), int((max_lon + 180) // CELL_DEGREES) + 1)
+    if len(rows) * len(cols) > MAX_CELLS:
+        return None
+    return [row * 1000 + col for row in rows for col in cols]
+
+
+def haversine_miles(latitude, longitude, latitudes, longitudes):
+    """Great-circle distance in miles from one point to arrays of points."""
+    lat1 = np.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlon = np.radians(longitudes) - np.radians(longitude)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+# --- Locating ---
+def city_centroid(city_id):
+    from .models import City
+
+    if not city_id:
+        return None
+    coords = City.objects.filter(pk=city_id).values_list('latitude', 'longitude').first()
+    return coords if coords and coords[0] is not None else None
+
+
+def locate(zip_code=None, city_id=None):
+    """(lat, lon) from a ZIP code, else from a City id; (None, None) if neither is known."""
+    return zip_centroid(zip_code) or city_centroid(city_id) or (None, None)
+
+
+def locate_text(text):
+    """(lat, lon) for what a user typed in a "near" box: a ZIP code or a city name."""
+    from . import cities
+
+    text = (text or '').strip()
+    if not text:
+        return None, None
+    if text[:3].isdigit():
+        return locate(zip_code=text)
+    ids = cities.lookup(text)
+    return locate(city_id=ids[0] if ids else None)
+
+
+def backfill(model, city_model, zip_field=None, batch_size=1000):
+    """
+    Recompute latitude, longitude and geo_cell for every row of ``model``.
+
+    Takes the City model class so migrations can pass their historical model.
+    Returns the number of rows written.
+    """
+    coords = {
+        pk: (lat, lon)
+        for pk, lat, lon in city_model.objects.filter(latitude__isnull=False)
+        .values_list('pk', 'latitude', 'longitude')
+    }
+    fields = ['pk', 'canonical_city'] + ([zip_field] if zip_field else [])
+    updated = 0
+    last_pk = 0
+    while True:
+        batch = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list(*fields)[:batch_size])
+        if not batch:
+            break
+        rows = []
+        for pk, city_id, *zip_code in batch:
+            latitude, longitude = (zip_centroid(zip_code[0]) if zip_code else None) or coords.get(city_id, (None, None))
+            rows.append(model(pk=pk, latitude=latitude, longitude=longitude,
+                              geo_cell=grid_cell(latitude, longitude)))
+        updated += model.objects.bulk_update(rows, ['latitude', 'longitude', 'geo_cell'])
+        last_pk = batch[-1][0]
+    return updated
+
+
+# --- Querying ---
+def distance_expression(latitude, longitude):
+    """Haversine distance in miles from a point to each row's latitude/longitude, as SQL."""
+    lat1 = math.radians(latitude)
+    lat2 = Radians(F('latitude'))
+    half_dlat = (lat2 - Value(lat1)) / 2
+    half_dlon = (Radians(F('longitude')) - Value(math.radians(longitude))) / 2
+    a = Power(Sin(half_dlat), 2) + Value(math.cos(lat1)) * Cos(lat2) * Power(Sin(half_dlon), 2)
+    return Value(2 * EARTH_RADIUS_MILES) * ASin(Sqrt(Least(a, Value(1.0))))
+
+
+def apply_radius(queryset, latitude, longitude, miles):
+    """
+    Restrict a Room or Profile queryset to rows within ``miles`` of a point.
+
+    Matches are annotated with ``distance_miles`` and ordered nearest first,
+    with the primary key breaking ties, so views page through them with the
+    keyset ordering ('distance_miles', 'id'). Rows without coordinates are
+    dropped.
+    """
+    if latitude is None or longitude is None or miles <= 0:
+        return queryset.annotate(distance_miles=Value(0.0, output_field=FloatField())).none()
+
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, miles)
+    candidates = queryset.filter(
+        latitude__range=(min_lat, max_lat), longitude__range=(min_lon, max_lon)
+    )
+    cells = cells_for_box(min_lat, max_lat, min_lon, max_lon)
+    if cells is not None:
+        candidates = candidates.filter(geo_cell__in=cells)
+    return (
+        candidates.annotate(distance_miles=distance_expression(latitude, longitude))
+        .filter(distance_miles__lte=miles)
+        .order_by('distance_miles', 'pk')
+    )
@@ -0,0 +1,176 @@
+"""
+A small background job queue kept in the database.
+
+Decorate a function with @job and enqueue() it instead of calling it. The Job
+row is written inside the caller's transaction, so nothing runs for a request
+that rolls back. ``python manage.py runworker`` claims queued jobs, highest
+priority first and then oldest, and runs them.
+
+While a worker runs a job, the job is hidden from other workers for
+VISIBILITY_TIMEOUT seconds. If the worker dies, the job becomes visible again
+and is retried. A job that raises is retried after a delay that doubles each
+time, until it has been tried ``max_attempts`` times. After that it is kept,
+marked failed, with its traceback. Jobs that succeed are deleted.
+
+Where the database supports SELECT ... FOR UPDATE SKIP LOCKED (PostgreSQL),
+workers claim through it and never wait on rows another worker holds. On
+every database, including SQLite, which has no row locks, the claim itself is
+a conditional UPDATE that only one worker can win.
+
+Arguments must be JSON-serializable: pass primary keys, not model instances.
+"""
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Priorities; higher runs first
+LOW = -10
+NORMAL = 0
+HIGH = 10
+
+MAX_ATTEMPTS = 5
+
+# Seconds a claimed job stays hidden from other workers
+VISIBILITY_TIMEOUT = 300
+
+# Retry n waits RETRY_DELAY * 2 ** (n - 1) seconds, at most MAX_RETRY_DELAY
+RETRY_DELAY = 10
+MAX_RETRY_DELAY = 3600
+
+
+def job(func=None, *, priority=NORMAL, max_attempts=MAX_ATTEMPTS):
+    """Mark a module-level function as runnable by the worker."""
+    def decorate(func):
+        func.job_options = {'priority': priority, 'max_attempts': max_attempts}
+        return func
+    return decorate(func) if func is not None else decorate
+
+
+def _name(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, *args, priority=None, delay=0, **kwargs):
+    """Queue ``func(*args, **kwargs)`` to run in a worker, after ``delay`` seconds."""
+    from .models import Job
+
+    options = getattr(func, 'job_options', None)
+    if options is None:
+        raise ValueError(f"{func.__qualname__} is not a job; decorate it with @jobs.job")
+    return Job.objects.create(
+        name=_name(func),
+        args=list(args),
+        kwargs=kwargs,
+        priority=options['priority'] if priority is None else priority,
+        max_attempts=options['max_attempts'],
+        available_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def enqueue_once(func, *args, **kwargs):
+    """
+    Like enqueue(), unless ``func`` is already waiting to run; for sweeps
+    that pick up whatever work is pending when they start.
+    """
+    from .models import Job
+
+    if Job.objects.filter(name=_name(func), status=Job.QUEUED).exists():
+        return None
+    return enqueue(func, *args, **kwargs)
+
+
+def _resolve(name):
+    func = import_string(name)
+    if not hasattr(func, 'job_options'):
+        raise ImportError(f"{name} is not a job")
+    return func
+
+
+def _take(candidates, worker, now):
+    from .models import Job
+
+    for job in candidates[:1]:
+        won = Job.objects.filter(pk=job.pk, status=job.status, attempts=job.attempts).update(
+            status=Job.RUNNING,
+            attempts=F('attempts') + 1,
+            worker=worker,
+            available_at=now + timedelta(seconds=VISIBILITY_TIMEOUT),
+        )
+        if won:
+            job.status, job.attempts, job.worker = Job.RUNNING, job.attempts + 1, worker
+            return job
+    return None
+
+
+def claim(worker):
+    """Take the next job that is due, or one whose worker went away; None if there is none."""
+    from .models import Job
+
+    now = timezone.now()
+    candidates = Job.objects.filter(
+        status__in=(Job.QUEUED, Job.RUNNING), available_at__lte=now,
+    ).order_by('-priority', 'available_at', 'pk')
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            return _take(candidates.select_for_update(skip_locked=True), worker, now)
+    # Losing the conditional UPDATE to another worker just means trying again
+    return _take(candidates, worker, now)
+
+
+def run(job):
+    """Run a claimed job and record the outcome. Returns whether it succeeded."""
+    from .models import Job
+
+    # Only while the claim is still ours, in case it timed out and was taken over
+    mine = Job.objects.filter(pk=job.pk, worker=job.worker, attempts=job.attempts)
+    if job.attempts > job.max_attempts:
+        mine.update(status=Job.FAILED, last_error='Gave up: the worker running it stopped every time')
+        return False
+    try:
+        _resolve(job.name)(*job.args, **job.kwargs)
+    except Exception:
+        logger.exception('Job %s (%s) failed', job.pk, job.name)
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            mine.update(status=Job.FAILED, last_error=error)
+        else:
+            delay = min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (job.attempts - 1))
+            mine.update(
+                status=Job.QUEUED, last_error=error,
+                available_at=timezone.now() + timedelta(seconds=delay),
+            )
+        return False
+    mine.delete()
+    return True
+
+
+def work(worker=None, burst=False, poll_interval=1.0, should_stop=lambda: False):
+    """
+    Claim and run jobs until ``should_stop()``, or until the queue is empty
+    when ``burst`` is set. Returns (succeeded, failed).
+    """
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    succeeded = failed = 0
+    while not should_stop():
+        close_old_connections()
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        if run(job):
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
@@ -0,0 +1,34 @@
+"""
+Point every Room and Profile at its canonical City.
+Usage: python manage.py backfill_cities [--batch-size 1000] [--missing-only]
+"""
+from django.core.management.base import BaseCommand
+from core import cities
+from core.models import City, Profile, Room
+
+# Unresolved names listed per model
+UNRESOLVED_SHOWN = 20
+
+
+class Command(BaseCommand):
+    help = 'Seeds the City table and backfills canonical_city on rooms and profiles in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows read per batch')
+        parser.add_argument('--missing-only', action='store_true', help='Skip rows that already have a city')
+
+    def handle(self, *args, **options):
+        cities.seed(City)
+        for model, state_field in ((Profile, 'state'), (Room, 'user__state')):
+            updated = cities.backfill(
+                model, City, state_field,
+                batch_size=options['batch_size'],
+                only_missing=options['missing_only'],
+            )
+            self.stdout.write(f'  {updated} {model._meta.verbose_name_plural.lower()} updated')
+        cities.invalidate()
+        self.stdout.write(self.style.SUCCESS(f'{City.objects.count()} cities in the table'))
+        # Typed names left without a City, for an admin to add as cities or aliases
+        for model in (Profile, Room):
+            for row in cities.unresolved(model)[:UNRESOLVED_SHOWN]:
+                self.stdout.write(f"  unresolved {model._meta.model_name} city: {row['city']!r} ({row['rows']})")
@@ -0,0 +1,23 @@
+"""
+Recompute latitude, longitude and grid cell for every Room and Profile.
+Usage: python manage.py backfill_locations [--batch-size 1000]
+"""
+from django.core.management.base import BaseCommand
+from core import geo
+from core.models import City, Profile, Room
+
+
+class Command(BaseCommand):
+    help = 'Geocodes rooms and profiles from the bundled ZIP/city centroid dataset in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per batch')
+
+    def handle(self, *args, **options):
+        geo.seed_coordinates(City)
+        batch_size = options['batch_size']
+        profiles = geo.backfill(Profile, City, zip_field='zip_code', batch_size=batch_size)
+        rooms = geo.backfill(Room, City, batch_size=batch_size)
+        located = Profile.objects.filter(latitude__isnull=False).count()
+        self.stdout.write(f'  {profiles} profiles and {rooms} rooms processed, {located} profiles located')
+        self.stdout.write(self.style.SUCCESS('Location backfill complete'))
@@ -0,0 +1,28 @@
+"""
+Recompute the denormalized Room.primary_image and Room.image_count columns.
+Usage: python manage.py backfill_room_images [--batch-size 1000]
+"""
+from django.core.management.base import BaseCommand
+from core.models import Room
+
+
+class Command(BaseCommand):
+    help = 'Backfills primary_image and image_count on every room in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rooms updated per statement')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        last_pk = 0
+        while True:
+            ids = list(
+                Room.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            updated += Room.objects.filter(pk__in=ids).refresh_image_stats()
+            last_pk = ids[-1]
+            self.stdout.write(f'  {updated} rooms updated')
+        self.stdout.write(self.style.SUCCESS(f'Backfilled image stats for {updated} rooms'))
@@ -0,0 +1,63 @@
+"""
+Render the resized copies and placeholders of uploaded photos across a pool of worker processes.
+Usage: python manage.py build_renditions [--workers 4] [--force]
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+from core import renditions
+from core.models import Profile, RoomImage
+
+
+def _init_worker():
+    # Needed when the pool spawns rather than forks; harmless otherwise
+    django.setup()
+
+
+def _render(task):
+    _, _, source_name, kinds = task
+    try:
+        return renditions.render(source_name, kinds)
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Renders card, detail and avatar renditions and placeholders for room images and profile photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+        parser.add_argument('--force', action='store_true', help='Re-render images that already have renditions')
+
+    def handle(self, *args, **options):
+        tasks = []
+        for model in (RoomImage, Profile):
+            source = renditions.SOURCES[model._meta.model_name]
+            images = model.objects.exclude(**{source.field: ''}).exclude(**{f'{source.field}__isnull': True})
+            if not options['force']:
+                images = images.filter(Q(**{source.flag: False}) | Q(**{source.placeholder: ''}))
+            tasks += [
+                (model, pk, name, source.kinds)
+                for pk, name in images.order_by('pk').values_list('pk', source.field)
+            ]
+
+        # Workers only write files; rows are recorded here so SQLite never
+        # sees concurrent writers. Forked workers must not share our
+        # database connection.
+        connections.close_all()
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            for (model, pk, name, _), result in zip(tasks, pool.map(_render, tasks, chunksize=8)):
+                if result is None:
+                    failed += 1
+                    self.stderr.write(f'  could not read {name}')
+                    continue
+                renditions.record(model, pk, name, *result)
+                done += 1
+                if done % 100 == 0:
+                    self.stdout.write(f'  {done}/{len(tasks)} images')
+        self.stdout.write(self.style.SUCCESS(f'Rendered {done} images ({failed} unreadable)'))
@@ -0,0 +1,16 @@
+"""
+Recount the city/state filter facets from the Profile and Room tables.
+Usage: python manage.py rebuild_facets
+"""
+from django.core.management.base import BaseCommand
+from core import facets
+from core.models import LocationFacet
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the LocationFacet counts used by the city/state filter dropdowns'
+
+    def handle(self, *args, **options):
+        facets.rebuild()
+        total = LocationFacet.objects.count()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} location facets'))
@@ -0,0 +1,42 @@
+"""
+Recompute every profile's stored top matches across a pool of worker processes.
+Usage: python manage.py rebuild_matches [--workers 4] [--chunk-size 200]
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from core import matching
+from core.models import Profile
+
+
+def _init_worker():
+    # Needed when the pool spawns rather than forks; harmless otherwise
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the ProfileMatch table, scoring chunks of profiles in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Profiles scored per task')
+
+    def handle(self, *args, **options):
+        ids = list(Profile.objects.order_by('pk').values_list('pk', flat=True))
+        size = options['chunk_size']
+        chunks = [ids[i:i + size] for i in range(0, len(ids), size)]
+
+        # Workers only read and score; results are written here so SQLite
+        # never sees concurrent writers. Forked workers must not share our
+        # database connection.
+        connections.close_all()
+        done = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+            for chunk, (rows, counts) in zip(chunks, pool.map(matching.compute_matches, chunks)):
+                matching.store_matches(chunk, rows, counts)
+                done += len(chunk)
+                self.stdout.write(f'  {done}/{len(ids)} profiles')
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt matches for {done} profiles'))
@@ -0,0 +1,44 @@
+"""
+Rebuild the full-text search index for rooms and profiles.
+Usage: python manage.py rebuild_search_index [--batch-size 500] [--model room|profile]
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import Profile, Room
+from core import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows indexed per transaction')
+        parser.add_argument('--model', choices=['room', 'profile'], help='Only rebuild one index')
+
+    def handle(self, *args, **options):
+        if search.search_backend() is None:
+            self.stdout.write(self.style.WARNING('This database has no full-text index; nothing to do.'))
+            return
+
+        batch_size = options['batch_size']
+        models = {'room': Room, 'profile': Profile}
+        if options['model']:
+            models = {options['model']: models[options['model']]}
+
+        for model_name, model in models.items():
+            fields = search.SEARCH_INDEXES[model_name]['fields']
+            search.clear_index(model_name)
+            indexed = 0
+            last_pk = 0
+            while True:
+                batch = list(
+                    model.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', *fields)[:batch_size]
+                )
+                if not batch:
+                    break
+                with transaction.atomic():
+                    search.index_instances(model_name, batch)
+                indexed += len(batch)
+                last_pk = batch[-1].pk
+                self.stdout.write(f'  {model_name}: {indexed} indexed')
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {model_name} index ({indexed} rows)'))
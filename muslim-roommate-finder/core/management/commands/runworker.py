@@ -0,0 +1,35 @@
+"""
+Run queued background jobs (see core/jobs.py) until stopped.
+Usage: python manage.py runworker [--burst] [--poll-interval 1.0]
+"""
+import signal
+
+from django.core.management.base import BaseCommand
+from core import jobs
+
+
+class Command(BaseCommand):
+    help = 'Claims and runs background jobs from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        stopping = []
+
+        def stop(signum, frame):
+            # Finish the job in hand, then exit
+            self.stdout.write('Stopping after the current job...')
+            stopping.append(signum)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write('Worker started')
+        succeeded, failed = jobs.work(
+            burst=options['burst'],
+            poll_interval=options['poll_interval'],
+            should_stop=lambda: bool(stopping),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Ran {succeeded} jobs ({failed} failed)'))
@@ -0,0 +1,313 @@
+"""
+Roommate compatibility scoring and the stored top matches per profile.
+
+Candidate profiles and rooms are loaded as NumPy columns with one
+values_list() query each, and every candidate is scored against a profile at
+once. Scores run from 0 to 100 and are the weighted sum of the component
+scores below, each between 0 and 1. A different gender scores 0 overall.
+
+Views do not score anything. The best TOP_K profiles and rooms for each
+profile are kept in ProfileMatch, and how many profiles reach
+MIN_MATCH_SCORE in Profile.match_count. When a save changes a field that is
+scored (SCORED_FIELDS), the signals in core/models.py queue a job that
+refreshes the profiles near the change (same gender and city, see
+core/jobs.py). rebuild_matches recomputes everything.
+"""
+import math
+
+import numpy as np
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+
+from . import geo, jobs
+
+# Weight of each component; they add up to 100
+WEIGHTS = {
+    'location': 30,
+    'age': 20,
+    'zabihah': 15,
+    'prayer': 15,
+    'guests': 10,
+    'budget': 10,
+}
+
+# Room weights; price is compared with the profile's budget
+ROOM_WEIGHTS = {
+    'location': 40,
+    'zabihah': 15,
+    'prayer': 15,
+    'guests': 10,
+    'budget': 20,
+}
+
+# Candidates scoring at least this count as matches
+MIN_MATCH_SCORE = 60
+
+# Profiles and rooms stored per profile
+TOP_K = 50
+
+# Same city scores 1; other cities score less the further away they are, 0 past this
+MAX_MATCH_DISTANCE = 100
+
+# Ages this many years apart still score 1; the score reaches 0 at AGE_CUTOFF years
+AGE_WINDOW = 5
+AGE_CUTOFF = 15
+
+# Score given to a component when either side left it blank
+UNKNOWN_SCORE = 0.5
+
+PROFILE_COLUMNS = (
+    'pk', 'gender', 'canonical_city', 'latitude', 'longitude', 'age',
+    'only_eats_zabihah', 'prayer_friendly', 'guests_allowed', 'roommate_profile__budget',
+)
+
+ROOM_COLUMNS = (
+    'pk', 'user__gender', 'user', 'canonical_city', 'latitude', 'longitude',
+    'only_eats_zabihah', 'prayer_friendly', 'guests_allowed', 'price',
+)
+
+# Model fields the scores depend on; saving a row without changing any of them
+# (e.g. the profile re-save on every login) leaves stored matches alone
+SCORED_FIELDS = {
+    'profile': (
+        'gender', 'canonical_city', 'latitude', 'longitude', 'age',
+        'only_eats_zabihah', 'prayer_friendly', 'guests_allowed',
+    ),
+    'room': (
+        'user', 'canonical_city', 'latitude', 'longitude', 'is_active',
+        'only_eats_zabihah', 'prayer_friendly', 'guests_allowed', 'price',
+    ),
+}
+
+
+def _fetch(queryset, names):
+    rows = list(queryset.order_by().values_list(*names))
+    return dict(zip(names, zip(*rows) if rows else [()] * len(names)))
+
+
+def load_columns(queryset):
+    """Load the scoring columns of a Profile queryset as NumPy arrays."""
+    data = _fetch(queryset, PROFILE_COLUMNS)
+    return {
+        'pk': np.array(data['pk'], dtype=np.int64),
+        'gender': np.array(data['gender'], dtype=object),
+        'city': np.array([c or 0 for c in data['canonical_city']], dtype=np.int64),
+        'latitude': np.array(data['latitude'], dtype=np.float64),
+        'longitude': np.array(data['longitude'], dtype=np.float64),
+        'age': np.array(data['age'], dtype=np.float64),
+        'zabihah': np.array(data['only_eats_zabihah'], dtype=bool),
+        'prayer': np.array(data['prayer_friendly'], dtype=bool),
+        'guests': np.array(data['guests_allowed'], dtype=bool),
+        'budget': np.array(data['roommate_profile__budget'], dtype=np.float64),
+    }
+
+
+def load_room_columns(queryset):
+    """Load the scoring columns of a Room queryset as NumPy arrays."""
+    data = _fetch(queryset, ROOM_COLUMNS)
+    return {
+        'pk': np.array(data['pk'], dtype=np.int64),
+        'gender': np.array(data['user__gender'], dtype=object),
+        'owner': np.array(data['user'], dtype=np.int64),
+        'city': np.array([c or 0 for c in data['canonical_city']], dtype=np.int64),
+        'latitude': np.array(data['latitude'], dtype=np.float64),
+        'longitude': np.array(data['longitude'], dtype=np.float64),
+        'zabihah': np.array(data['only_eats_zabihah'], dtype=bool),
+        'prayer': np.array(data['prayer_friendly'], dtype=bool),
+        'guests': np.array(data['guests_allowed'], dtype=bool),
+        'price': np.array(data['price'], dtype=np.float64),
+    }
+
+
+def location_scores(profile, cities, latitudes, longitudes):
+    """1 for the same city, falling to 0 at MAX_MATCH_DISTANCE miles; 0 if unknown."""
+    scores = np.zeros(len(cities))
+    if profile.latitude is not None and profile.longitude is not None:
+        distances = geo.haversine_miles(profile.latitude, profile.longitude, latitudes, longitudes)
+        scores = np.nan_to_num(np.clip(1 - distances / MAX_MATCH_DISTANCE, 0, 1))
+    if profile.canonical_city_id:
+        scores[cities == profile.canonical_city_id] = 1.0
+    return scores
+
+
+def _closeness(mine, theirs, window, cutoff):
+    """1 within ``window`` of each other, 0 at ``cutoff``; UNKNOWN_SCORE if either is missing."""
+    if mine is None:
+        return np.full(len(theirs), UNKNOWN_SCORE)
+    gap = np.abs(theirs - mine)
+    scores = np.clip((cutoff - gap) / (cutoff - window), 0, 1)
+    return np.where(np.isnan(theirs), UNKNOWN_SCORE, scores)
+
+
+def score_columns(profile, columns, budget=None):
+    """Score every candidate in ``columns`` against ``profile``; returns an array of 0-100."""
+    components = {
+        'location': location_scores(profile, columns['city'], columns['latitude'], columns['longitude']),
+        'age': _closeness(profile.age, columns['age'], AGE_WINDOW, AGE_CUTOFF),
+        'zabihah': (columns['zabihah'] == profile.only_eats_zabihah).astype(float),
+        'prayer': (columns['prayer'] == profile.prayer_friendly).astype(float),
+        'guests': (columns['guests'] == profile.guests_allowed).astype(float),
+        'budget': _closeness(budget, columns['budget'], 0, max(budget or 0, 1)),
+    }
+    total = sum(WEIGHTS[name] * values for name, values in components.items())
+    return np.where((columns['gender'] == profile.gender) & (columns['pk'] != profile.pk), total, 0.0)
+
+
+def score_room_columns(profile, columns, budget=None):
+    """Score every room in ``columns`` for ``profile``; the profile's own rooms score 0."""
+    if budget is None:
+        affordability = np.full(len(columns['pk']), UNKNOWN_SCORE)
+    else:
+        # At or under budget scores 1, falling to 0 at 50% over
+        affordability = np.clip(1 - (columns['price'] - budget) / (0.5 * max(budget, 1)), 0, 1)
+    components = {
+        'location': location_scores(profile, columns['city'], columns['latitude'], columns['longitude']),
+        'zabihah': (columns['zabihah'] == profile.only_eats_zabihah).astype(float),
+        'prayer': (columns['prayer'] == profile.prayer_friendly).astype(float),
+        'guests': (columns['guests'] == profile.guests_allowed).astype(float),
+        'budget': affordability,
+    }
+    total = sum(ROOM_WEIGHTS[name] * values for name, values in components.items())
+    return np.where((columns['gender'] == profile.gender) & (columns['owner'] != profile.pk), total, 0.0)
+
+
+def _top(pks, scores, k=TOP_K):
+    """[(pk, score), ...] for the ``k`` best positive scores."""
+    keep = np.flatnonzero(scores > 0)
+    if len(keep) > k:
+        keep = keep[np.argpartition(-scores[keep], k - 1)[:k]]
+    return [(int(pks[i]), round(float(scores[i]), 1)) for i in keep]
+
+
+# --- Stored matches ---
+def compute_matches(profile_ids):
+    """
+    Score candidates for each profile in ``profile_ids``.
+
+    Returns ([(profile_id, matched_profile_id, room_id, score), ...], counts):
+    the rows cover the TOP_K profiles and TOP_K rooms of each, and counts maps
+    each profile to how many profiles score MIN_MATCH_SCORE or more for it.
+    Candidate columns are loaded once for the whole batch.
+    """
+    from .models import Profile, Room
+
+    profiles = list(Profile.objects.filter(pk__in=profile_ids))
+    genders = {profile.gender for profile in profiles}
+    columns = load_columns(Profile.objects.filter(gender__in=genders))
+    rooms = load_room_columns(Room.objects.filter(is_active=True, user__gender__in=genders))
+    budgets = dict(zip(columns['pk'].tolist(), columns['budget'].tolist()))
+
+    rows, counts = [], {}
+    for profile in profiles:
+        budget = budgets.get(profile.pk)
+        budget = None if budget is None or math.isnan(budget) else budget
+        scores = score_columns(profile, columns, budget)
+        counts[profile.pk] = int(np.count_nonzero(scores >= MIN_MATCH_SCORE))
+        rows += [(profile.pk, pk, None, score) for pk, score in _top(columns['pk'], scores)]
+        scores = score_room_columns(profile, rooms, budget)
+        rows += [(profile.pk, None, pk, score) for pk, score in _top(rooms['pk'], scores)]
+    return rows, counts
+
+
+def store_matches(profile_ids, rows, counts):
+    """Replace the stored matches of ``profile_ids`` with what compute_matches() returned."""
+    from .models import Profile, ProfileMatch
+
+    with transaction.atomic():
+        ProfileMatch.objects.filter(profile__in=profile_ids).delete()
+        ProfileMatch.objects.bulk_create(
+            [
+                ProfileMatch(profile_id=profile_id, matched_profile_id=matched_id, room_id=room_id, score=score)
+                for profile_id, matched_id, room_id, score in rows
+            ],
+            batch_size=1000,
+        )
+        for profile_id, count in counts.items():
+            Profile.objects.filter(pk=profile_id).update(match_count=count)
+
+
+def refresh_matches(profile_ids):
+    """Recompute and store the matches of ``profile_ids``."""
+    profile_ids = list(profile_ids)
+    if profile_ids:
+        store_matches(profile_ids, *compute_matches(profile_ids))
+
+
+@jobs.job
+def refresh_stored(profile_ids):
+    """Job: refresh_matches() for profiles queued by schedule_refresh()."""
+    refresh_matches(profile_ids)
+
+
+def ensure_matches(profile):
+    """
+    A profile's match count, computing its matches first if they never were
+    (e.g. before a full rebuild).
+    """
+    from .models import Profile
+
+    count = Profile.objects.filter(pk=profile.pk).values_list('match_count', flat=True).first()
+    if count is None:
+        refresh_matches([profile.pk])
+        count = Profile.objects.filter(pk=profile.pk).values_list('match_count', flat=True).first()
+    return count
+
+
+# --- Invalidation ---
+def snapshot(instance):
+    """The SCORED_FIELDS values of a Profile or Room, to compare before and after a save."""
+    opts = instance._meta
+    return tuple(getattr(instance, opts.get_field(name).attname) for name in SCORED_FIELDS[opts.model_name])
+
+
+def neighbourhood(gender, city_id):
+    """Ids of the profiles a change in this gender and city can reorder."""
+    from .models import Profile
+
+    if not gender or not city_id:
+        return set()
+    return set(Profile.objects.filter(gender=gender, canonical_city=city_id).values_list('pk', flat=True))
+
+
+def _holding(condition):
+    from .models import ProfileMatch
+
+    return set(ProfileMatch.objects.filter(condition).values_list('profile', flat=True))
+
+
+def affected_by_profile(profile):
+    """The profile itself, its neighbourhood, and whoever has it or its rooms stored."""
+    return (
+        {profile.pk}
+        | neighbourhood(profile.gender, profile.canonical_city_id)
+        | _holding(Q(matched_profile=profile) | Q(room__user=profile))
+    )
+
+
+def affected_by_room(room):
+    """The neighbourhood of a room's owner in the room's city, and whoever has it stored."""
+    from .models import Profile
+
+    gender = Profile.objects.filter(pk=room.user_id).values_list('gender', flat=True).first()
+    return neighbourhood(gender, room.canonical_city_id) | _holding(Q(room=room))
+
+
+def schedule_refresh(profile_ids):
+    """Queue a refresh of the given profiles' matches for a worker, once the current transaction commits."""
+    profile_ids = sorted(set(profile_ids))
+    if profile_ids:
+        jobs.enqueue(refresh_stored, profile_ids)
+
+
+# --- Querying ---
+def annotate_stored(queryset, profile):
+    """
+    Annotate a Profile queryset with ``match_score`` from ``profile``'s stored
+    matches. Profiles outside the top TOP_K get NULL, which sorts last.
+    """
+    from .models import ProfileMatch
+
+    stored = ProfileMatch.objects.filter(profile=profile, matched_profile=OuterRef('pk'))
+    return queryset.annotate(match_score=Subquery(stored.values('score')[:1]))
+
+
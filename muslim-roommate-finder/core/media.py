@@ -0,0 +1,184 @@
+"""
+Serving uploaded files (MEDIA_ROOT).
+
+serve() answers a request for a file with as little work in Python as it can:
+
+- Conditional requests (If-None-Match, If-Modified-Since) are answered from a
+  stat() alone, with 304 Not Modified.
+- When MEDIA_SENDFILE names a front proxy, the response is only a header
+  telling the proxy which file to send: X-Accel-Redirect for nginx, whose
+  internal location MEDIA_SENDFILE_PREFIX maps to MEDIA_ROOT, or X-Sendfile
+  for Apache and lighttpd. The proxy then handles ranges itself and the
+  worker is free at once.
+- Otherwise Python sends the file itself. A single byte range (Range:
+  bytes=...) gets a 206 with just those bytes, so video players and resumed
+  downloads work. Under WSGI the response is a FileResponse, which servers
+  such as gunicorn's sync workers hand to sendfile(). Under ASGI there is no
+  sendfile(): the file is read BLOCK_SIZE bytes at a time in a thread and
+  streamed, since Django would otherwise read it whole into memory first.
+
+The Render deployment runs ASGI (gunicorn with UvicornWorker) and has no
+proxy in front, so MEDIA_SENDFILE is unset there and nothing offloads media:
+every file is streamed by the app.
+
+Content-addressed files (see core/storage.py) never change, so they are
+marked to be cached for a year.
+"""
+import mimetypes
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from . import storage
+
+SENDFILE_HEADERS = {
+    'x-accel-redirect': 'X-Accel-Redirect',
+    'x-sendfile': 'X-Sendfile',
+}
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Bytes read at a time when Python has to stream the file itself
+BLOCK_SIZE = 64 * 1024
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class _FileRange:
+    """Reads at most ``length`` bytes of ``file`` from its current position."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        # Lets the WSGI server sendfile() from the current offset, up to Content-Length
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+async def _stream(file):
+    """Yield ``file`` BLOCK_SIZE bytes at a time, reading in a thread."""
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        while chunk := await read(BLOCK_SIZE):
+            yield chunk
+    finally:
+        file.close()
+
+
+def byte_range(header, size):
+    """
+    The (first, last) byte positions asked for by a Range header, None to
+    send the whole file, or False if the range lies past its end. Only a
+    single range is honoured; a list of ranges gets the whole file.
+    """
+    match = _RANGE.match(header.strip())
+    if not match or not size:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # bytes=-500: the last 500 bytes
+        length = int(last)
+        return (max(0, size - length), size - 1) if length else False
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        return False
+    if last < first:
+        return None
+    return first, last
+
+
+def _range_applies(request, etag, last_modified):
+    """Whether If-Range, if sent, still matches the file."""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def serve(request, path):
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(fullpath)
+    except (OSError, ValueError):
+        raise Http404('File not found')
+    if not os.path.isfile(fullpath):
+        raise Http404('File not found')
+
+    last_modified = int(stat.st_mtime)
+    etag = '"%x-%x"' % (stat.st_size, stat.st_mtime_ns)
+    headers = {'ETag': etag, 'Last-Modified': http_date(last_modified)}
+    if storage.is_cacheable_forever(path):
+        headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+    sendfile = SENDFILE_HEADERS.get(getattr(settings, 'MEDIA_SENDFILE', '').lower())
+    if sendfile == 'X-Accel-Redirect':
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, 'MEDIA_SENDFILE_PREFIX', '/protected-media/')
+        response[sendfile] = prefix.rstrip('/') + '/' + path.lstrip('/')
+    elif sendfile:
+        response = HttpResponse(content_type=content_type)
+        response[sendfile] = fullpath
+    else:
+        response = _file_response(request, fullpath, stat.st_size, content_type, etag, last_modified)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def _file_response(request, fullpath, size, content_type, etag, last_modified):
+    span = None
+    if 'Range' in request.headers and _range_applies(request, etag, last_modified):
+        span = byte_range(request.headers['Range'], size)
+    if span is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    file = open(fullpath, 'rb')
+    status, length = 200, size
+    if span is not None:
+        first, last = span
+        file.seek(first)
+        status, length = 206, last - first + 1
+        file = _FileRange(file, length)
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(_stream(file), content_type=content_type, status=status)
+    else:
+        response = FileResponse(file, content_type=content_type, status=status)
+        response.block_size = BLOCK_SIZE
+    if span is not None:
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    response['Content-Length'] = length
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,77 @@
+from django.db import migrations
+
+# Frozen copy of core/search.py as of this migration; later changes there must not alter it
+SEARCH_INDEXES = {
+    'room': {
+        'table': 'core_room_search',
+        'fields': ('title', 'description', 'city'),
+    },
+    'profile': {
+        'table': 'core_profile_search',
+        'fields': ('name', 'city', 'state', 'bio', 'neighborhood'),
+    },
+}
+
+
+def search_backend(connection):
+    return {'sqlite': 'fts5', 'postgresql': 'postgres'}.get(connection.vendor)
+
+
+def create_index(apps, schema_editor):
+    backend = search_backend(schema_editor.connection)
+    if backend is None:
+        return
+    for model_name, index in SEARCH_INDEXES.items():
+        table, fields = index['table'], index['fields']
+        if backend == 'fts5':
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5("
+                f"{', '.join(fields)}, tokenize='porter unicode61')"
+            )
+        else:
+            schema_editor.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                f"(id bigint PRIMARY KEY, document tsvector NOT NULL)"
+            )
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_document_gin ON {table} USING GIN (document)"
+            )
+
+        rows = [
+            [pk] + [str(value or '') for value in values]
+            for pk, *values in apps.get_model('core', model_name).objects.values_list('pk', *fields)
+        ]
+        if not rows:
+            continue
+        with schema_editor.connection.cursor() as cursor:
+            if backend == 'fts5':
+                placeholders = ', '.join(['%s'] * len(rows[0]))
+                cursor.executemany(
+                    f"INSERT INTO {table} (rowid, {', '.join(fields)}) VALUES ({placeholders})", rows,
+                )
+            else:
+                # Weight the first column 'A' and the rest 'B'.
+                cursor.executemany(
+                    f"INSERT INTO {table} (id, document) VALUES ("
+                    f"%s, setweight(to_tsvector('english', %s), 'A') || to_tsvector('english', %s)) "
+                    f"ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document",
+                    [[row[0], row[1], ' '.join(row[2:])] for row in rows],
+                )
+
+
+def drop_index(apps, schema_editor):
+    if search_backend(schema_editor.connection) is None:
+        return
+    for index in SEARCH_INDEXES.values():
+        schema_editor.execute(f"DROP TABLE IF EXISTS {index['table']}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_profile_profile_photo'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_image_stats(apps, schema_editor):
+    Room = apps.get_model('core', 'Room')
+    RoomImage = apps.get_model('core', 'RoomImage')
+    images = RoomImage.objects.filter(room=models.OuterRef('pk'))
+    Room.objects.update(
+        primary_image=models.Subquery(images.order_by('-is_primary', 'created_at', 'pk').values('pk')[:1]),
+        image_count=models.functions.Coalesce(
+            models.Subquery(images.order_by().values('room').annotate(total=models.Count('pk')).values('total')),
+            0,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Images'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='primary_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.roomimage', verbose_name='Primary Image'),
+        ),
+        migrations.RunPython(backfill_image_stats, migrations.RunPython.noop),
+    ]
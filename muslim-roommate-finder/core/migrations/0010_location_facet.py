@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:19
+
+from django.db import migrations, models
+
+
+def count_facets(apps, schema_editor):
+    LocationFacet = apps.get_model('core', 'LocationFacet')
+    sources = [
+        ('profile_city', apps.get_model('core', 'Profile'), 'city'),
+        ('profile_state', apps.get_model('core', 'Profile'), 'state'),
+        ('room_city', apps.get_model('core', 'Room'), 'city'),
+    ]
+    for kind, model, field in sources:
+        totals = {}
+        for row in model.objects.order_by().values(field).annotate(total=models.Count('pk')):
+            value = (row[field] or '').strip()
+            if value:
+                totals[value] = totals.get(value, 0) + row['total']
+        LocationFacet.objects.bulk_create(
+            LocationFacet(kind=kind, value=value, count=total) for value, total in totals.items()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_room_image_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('profile_city', 'Profile City'), ('profile_state', 'Profile State'), ('room_city', 'Room City')], max_length=20, verbose_name='Kind')),
+                ('value', models.CharField(max_length=100, verbose_name='Value')),
+                ('count', models.IntegerField(default=0, verbose_name='Count')),
+            ],
+            options={
+                'verbose_name': 'Location Facet',
+                'verbose_name_plural': 'Location Facets',
+                'ordering': ['kind', 'value'],
+                'unique_together': {('kind', 'value')},
+            },
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
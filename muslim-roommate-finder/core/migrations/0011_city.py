@@ -0,0 +1,273 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:21
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copies of core/cities.py and models.US_STATES as of this migration;
+# later changes there must not alter it
+
+CITY_DATA = [
+    ("New York", "NY", ("NYC", "New York City", "Manhattan", "Brooklyn", "Queens", "Bronx")),
+    ("Los Angeles", "CA", ("LA",)),
+    ("Chicago", "IL", ()),
+    ("Houston", "TX", ()),
+    ("Phoenix", "AZ", ()),
+    ("Philadelphia", "PA", ("Philly",)),
+    ("San Antonio", "TX", ()),
+    ("San Diego", "CA", ()),
+    ("Dallas", "TX", ()),
+    ("San Jose", "CA", ()),
+    ("Austin", "TX", ()),
+    ("Jacksonville", "FL", ()),
+    ("Fort Worth", "TX", ()),
+    ("Columbus", "OH", ()),
+    ("Columbus", "GA", ()),
+    ("Charleston", "SC", ()),
+    ("Charleston", "WV", ()),
+    ("Charlotte", "NC", ()),
+    ("San Francisco", "CA", ("SF", "San Fran")),
+    ("Indianapolis", "IN", ("Indy",)),
+    ("Seattle", "WA", ()),
+    ("Denver", "CO", ()),
+    ("Washington", "DC", ("Washington DC", "DC", "D.C.")),
+    ("Boston", "MA", ()),
+    ("El Paso", "TX", ()),
+    ("Nashville", "TN", ()),
+    ("Detroit", "MI", ()),
+    ("Oklahoma City", "OK", ("OKC",)),
+    ("Portland", "OR", ()),
+    ("Portland", "ME", ()),
+    ("Las Vegas", "NV", ("Vegas",)),
+    ("Memphis", "TN", ()),
+    ("Louisville", "KY", ()),
+    ("Baltimore", "MD", ()),
+    ("Milwaukee", "WI", ()),
+    ("Albuquerque", "NM", ()),
+    ("Tucson", "AZ", ()),
+    ("Fresno", "CA", ()),
+    ("Sacramento", "CA", ()),
+    ("Kansas City", "MO", ("KC",)),
+    ("Kansas City", "KS", ()),
+    ("Mesa", "AZ", ()),
+    ("Atlanta", "GA", ("ATL",)),
+    ("Omaha", "NE", ()),
+    ("Colorado Springs", "CO", ()),
+    ("Raleigh", "NC", ()),
+    ("Miami", "FL", ()),
+    ("Long Beach", "CA", ()),
+    ("Virginia Beach", "VA", ()),
+    ("Minneapolis", "MN", ()),
+    ("Tampa", "FL", ()),
+    ("Oakland", "CA", ()),
+    ("New Orleans", "LA", ("NOLA",)),
+    ("Wichita", "KS", ()),
+    ("Arlington", "TX", ()),
+    ("Arlington", "VA", ()),
+    ("Cleveland", "OH", ()),
+    ("Bakersfield", "CA", ()),
+    ("Honolulu", "HI", ()),
+    ("Anaheim", "CA", ()),
+    ("Santa Ana", "CA", ()),
+    ("Riverside", "CA", ()),
+    ("Corpus Christi", "TX", ()),
+    ("Lexington", "KY", ()),
+    ("Stockton", "CA", ()),
+    ("Henderson", "NV", ()),
+    ("Saint Paul", "MN", ()),
+    ("St. Louis", "MO", ("STL",)),
+    ("Cincinnati", "OH", ()),
+    ("Pittsburgh", "PA", ()),
+    ("Greensboro", "NC", ()),
+    ("Anchorage", "AK", ()),
+    ("Plano", "TX", ()),
+    ("Lincoln", "NE", ()),
+    ("Orlando", "FL", ()),
+    ("Irvine", "CA", ()),
+    ("Newark", "NJ", ()),
+    ("Durham", "NC", ()),
+    ("Chula Vista", "CA", ()),
+    ("Toledo", "OH", ()),
+    ("Fort Wayne", "IN", ()),
+    ("St. Petersburg", "FL", ()),
+    ("Laredo", "TX", ()),
+    ("Jersey City", "NJ", ()),
+    ("Chandler", "AZ", ()),
+    ("Madison", "WI", ()),
+    ("Lubbock", "TX", ()),
+    ("Scottsdale", "AZ", ()),
+    ("Reno", "NV", ()),
+    ("Buffalo", "NY", ()),
+    ("Gilbert", "AZ", ()),
+    ("Glendale", "AZ", ()),
+    ("Glendale", "CA", ()),
+    ("North Las Vegas", "NV", ()),
+    ("Winston-Salem", "NC", ()),
+    ("Chesapeake", "VA", ()),
+    ("Norfolk", "VA", ()),
+    ("Fremont", "CA", ()),
+    ("Garland", "TX", ()),
+    ("Irving", "TX", ()),
+    ("Hialeah", "FL", ()),
+    ("Richmond", "VA", ()),
+    ("Boise", "ID", ()),
+    ("Spokane", "WA", ()),
+    ("Baton Rouge", "LA", ()),
+    ("Tacoma", "WA", ()),
+    ("San Bernardino", "CA", ()),
+    ("Modesto", "CA", ()),
+    ("Fontana", "CA", ()),
+    ("Des Moines", "IA", ()),
+    ("Moreno Valley", "CA", ()),
+    ("Santa Clarita", "CA", ()),
+    ("Fayetteville", "NC", ()),
+    ("Fayetteville", "AR", ()),
+    ("Birmingham", "AL", ()),
+    ("Oxnard", "CA", ()),
+    ("Rochester", "NY", ()),
+    ("Port St. Lucie", "FL", ()),
+    ("Grand Rapids", "MI", ()),
+    ("Huntsville", "AL", ()),
+    ("Salt Lake City", "UT", ("SLC",)),
+    ("Frisco", "TX", ()),
+    ("Yonkers", "NY", ()),
+    ("Amarillo", "TX", ()),
+    ("Huntington Beach", "CA", ()),
+    ("McKinney", "TX", ()),
+    ("Montgomery", "AL", ()),
+    ("Augusta", "GA", ()),
+    ("Aurora", "CO", ()),
+    ("Aurora", "IL", ()),
+    ("Akron", "OH", ()),
+    ("Little Rock", "AR", ()),
+    ("Tempe", "AZ", ()),
+    ("Overland Park", "KS", ()),
+]
+
+US_STATES = {
+    "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas",
+    "CA": "California", "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware",
+    "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho",
+    "IL": "Illinois", "IN": "Indiana", "IA": "Iowa", "KS": "Kansas",
+    "KY": "Kentucky", "LA": "Louisiana", "ME": "Maine", "MD": "Maryland",
+    "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota", "MS": "Mississippi",
+    "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+    "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+    "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma",
+    "OR": "Oregon", "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina",
+    "SD": "South Dakota", "TN": "Tennessee", "TX": "Texas", "UT": "Utah",
+    "VT": "Vermont", "VA": "Virginia", "WA": "Washington", "WV": "West Virginia",
+    "WI": "Wisconsin", "WY": "Wyoming",
+}
+
+
+def normalize(name):
+    key = (name or '').lower()
+    key = re.sub(r'\bst\b\.?', 'saint', key)
+    key = re.sub(r'\bft\b\.?', 'fort', key)
+    key = re.sub(r'[^\w\s]', ' ', key)
+    return ' '.join(key.split())
+
+
+def normalize_state(value):
+    value = (value or '').strip().upper()
+    if value in US_STATES or value == 'DC':
+        return value
+    for code, name in US_STATES.items():
+        if name.upper() == value:
+            return code
+    return ''
+
+
+def build_index(City):
+    """Each normalized name or alias -> [(city id, state), ...], seed order first."""
+    index = {}
+    for city in City.objects.order_by('pk'):
+        aliases = [normalize(alias) for alias in city.aliases.split(',') if normalize(alias)]
+        for key in [city.key] + aliases:
+            entries = index.setdefault(key, [])
+            if (city.pk, city.state) not in entries:
+                entries.append((city.pk, city.state))
+    return index
+
+
+def resolve(City, index, name, state):
+    key = normalize(name)
+    if not key:
+        return None
+    state = normalize_state(state)
+    entries = index.get(key, [])
+    if state:
+        entries = [entry for entry in entries if entry[1] == state]
+    if entries:
+        return entries[0][0]
+    city, _ = City.objects.get_or_create(key=key, state=state, defaults={'name': name.strip()})
+    index.setdefault(key, []).append((city.pk, state))
+    return city.pk
+
+
+def backfill(model, City, state_field):
+    index = build_index(City)
+    last_pk = 0
+    while True:
+        batch = list(
+            model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'city', state_field)[:1000]
+        )
+        if not batch:
+            break
+        by_city = {}
+        for pk, city, state in batch:
+            by_city.setdefault(resolve(City, index, city, state), []).append(pk)
+        for city_id, pks in by_city.items():
+            model.objects.filter(pk__in=pks).update(canonical_city=city_id)
+        last_pk = batch[-1][0]
+
+
+def seed_and_backfill(apps, schema_editor):
+    City = apps.get_model('core', 'City')
+    existing = set(City.objects.values_list('key', 'state'))
+    City.objects.bulk_create(
+        City(name=name, state=state, key=normalize(name), aliases=', '.join(aliases))
+        for name, state, aliases in CITY_DATA
+        if (normalize(name), state) not in existing
+    )
+    backfill(apps.get_model('core', 'Profile'), City, 'state')
+    backfill(apps.get_model('core', 'Room'), City, 'user__state')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_location_facet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='City',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='City')),
+                ('state', models.CharField(blank=True, max_length=2, verbose_name='State Code')),
+                ('key', models.CharField(db_index=True, max_length=100, verbose_name='Lookup Key')),
+                ('aliases', models.CharField(blank=True, help_text='Comma-separated other names for this city, e.g. NYC', max_length=255, verbose_name='Aliases')),
+            ],
+            options={
+                'verbose_name': 'City',
+                'verbose_name_plural': 'Cities',
+                'ordering': ['name', 'state'],
+                'unique_together': {('key', 'state')},
+            },
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='canonical_city',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='profiles', to='core.city', verbose_name='Canonical City'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='canonical_city',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rooms', to='core.city', verbose_name='Canonical City'),
+        ),
+        migrations.RunPython(seed_and_backfill, migrations.RunPython.noop),
+    ]
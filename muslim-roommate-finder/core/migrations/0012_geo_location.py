@@ -0,0 +1,260 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:24
+
+import re
+
+from django.db import migrations, models
+
+# Frozen copies of core/data/us_city_centroids.csv and core/geo.py as of this
+# migration; later changes there must not alter it
+
+# (name, state, latitude, longitude, three-digit ZIP prefixes)
+CENTROIDS = [
+    ("New York", "NY", 40.7128, -74.0060, "100 101 102 103 104 110 111 112 113 114 116"),
+    ("Los Angeles", "CA", 34.0522, -118.2437, "900 901"),
+    ("Chicago", "IL", 41.8781, -87.6298, "606 607 608"),
+    ("Houston", "TX", 29.7604, -95.3698, "770 772"),
+    ("Phoenix", "AZ", 33.4484, -112.0740, "850"),
+    ("Philadelphia", "PA", 39.9526, -75.1652, "191"),
+    ("San Antonio", "TX", 29.4241, -98.4936, "782"),
+    ("San Diego", "CA", 32.7157, -117.1611, "921"),
+    ("Dallas", "TX", 32.7767, -96.7970, "752 753"),
+    ("San Jose", "CA", 37.3382, -121.8863, "951"),
+    ("Austin", "TX", 30.2672, -97.7431, "787"),
+    ("Jacksonville", "FL", 30.3322, -81.6557, "322"),
+    ("Fort Worth", "TX", 32.7555, -97.3308, "761"),
+    ("Columbus", "OH", 39.9612, -82.9988, "432"),
+    ("Columbus", "GA", 32.4610, -84.9877, "318"),
+    ("Charleston", "SC", 32.7765, -79.9311, "294"),
+    ("Charleston", "WV", 38.3498, -81.6326, "253"),
+    ("Charlotte", "NC", 35.2271, -80.8431, "282"),
+    ("San Francisco", "CA", 37.7749, -122.4194, "941"),
+    ("Indianapolis", "IN", 39.7684, -86.1581, "462"),
+    ("Seattle", "WA", 47.6062, -122.3321, "981"),
+    ("Denver", "CO", 39.7392, -104.9903, "802"),
+    ("Washington", "DC", 38.9072, -77.0369, "200 202 203 204 205"),
+    ("Boston", "MA", 42.3601, -71.0589, "021 022"),
+    ("El Paso", "TX", 31.7619, -106.4850, "799"),
+    ("Nashville", "TN", 36.1627, -86.7816, "372"),
+    ("Detroit", "MI", 42.3314, -83.0458, "482"),
+    ("Oklahoma City", "OK", 35.4676, -97.5164, "731"),
+    ("Portland", "OR", 45.5152, -122.6784, "972"),
+    ("Portland", "ME", 43.6591, -70.2568, "041"),
+    ("Las Vegas", "NV", 36.1699, -115.1398, "891"),
+    ("Memphis", "TN", 35.1495, -90.0490, "381"),
+    ("Louisville", "KY", 38.2527, -85.7585, "402"),
+    ("Baltimore", "MD", 39.2904, -76.6122, "212"),
+    ("Milwaukee", "WI", 43.0389, -87.9065, "532"),
+    ("Albuquerque", "NM", 35.0844, -106.6504, "871"),
+    ("Tucson", "AZ", 32.2226, -110.9747, "857"),
+    ("Fresno", "CA", 36.7378, -119.7871, "937"),
+    ("Sacramento", "CA", 38.5816, -121.4944, "958"),
+    ("Kansas City", "MO", 39.0997, -94.5786, "641"),
+    ("Kansas City", "KS", 39.1142, -94.6275, "661"),
+    ("Mesa", "AZ", 33.4152, -111.8315, "852"),
+    ("Atlanta", "GA", 33.7490, -84.3880, "303"),
+    ("Omaha", "NE", 41.2565, -95.9345, "681"),
+    ("Colorado Springs", "CO", 38.8339, -104.8214, "809"),
+    ("Raleigh", "NC", 35.7796, -78.6382, "276"),
+    ("Miami", "FL", 25.7617, -80.1918, "331"),
+    ("Long Beach", "CA", 33.7701, -118.1937, "908"),
+    ("Virginia Beach", "VA", 36.8529, -75.9780, "234"),
+    ("Minneapolis", "MN", 44.9778, -93.2650, "554"),
+    ("Tampa", "FL", 27.9506, -82.4572, "336"),
+    ("Oakland", "CA", 37.8044, -122.2712, "946"),
+    ("New Orleans", "LA", 29.9511, -90.0715, "701"),
+    ("Wichita", "KS", 37.6872, -97.3301, "672"),
+    ("Arlington", "TX", 32.7357, -97.1081, "760"),
+    ("Arlington", "VA", 38.8816, -77.0910, "222"),
+    ("Cleveland", "OH", 41.4993, -81.6944, "441"),
+    ("Bakersfield", "CA", 35.3733, -119.0187, "933"),
+    ("Honolulu", "HI", 21.3069, -157.8583, "968"),
+    ("Anaheim", "CA", 33.8366, -117.9143, "928"),
+    ("Santa Ana", "CA", 33.7455, -117.8677, "927"),
+    ("Riverside", "CA", 33.9533, -117.3962, "925"),
+    ("Corpus Christi", "TX", 27.8006, -97.3964, "784"),
+    ("Lexington", "KY", 38.0406, -84.5037, "405"),
+    ("Stockton", "CA", 37.9577, -121.2908, "952"),
+    ("Henderson", "NV", 36.0395, -114.9817, "890"),
+    ("Saint Paul", "MN", 44.9537, -93.0900, "551"),
+    ("St. Louis", "MO", 38.6270, -90.1994, "631"),
+    ("Cincinnati", "OH", 39.1031, -84.5120, "452"),
+    ("Pittsburgh", "PA", 40.4406, -79.9959, "152"),
+    ("Greensboro", "NC", 36.0726, -79.7920, "274"),
+    ("Anchorage", "AK", 61.2181, -149.9003, "995"),
+    ("Plano", "TX", 33.0198, -96.6989, "750"),
+    ("Lincoln", "NE", 40.8136, -96.7026, "685"),
+    ("Orlando", "FL", 28.5383, -81.3792, "328"),
+    ("Irvine", "CA", 33.6846, -117.8265, "926"),
+    ("Newark", "NJ", 40.7357, -74.1724, "071"),
+    ("Durham", "NC", 35.9940, -78.8986, "277"),
+    ("Chula Vista", "CA", 32.6401, -117.0842, "919"),
+    ("Toledo", "OH", 41.6528, -83.5379, "436"),
+    ("Fort Wayne", "IN", 41.0793, -85.1394, "468"),
+    ("St. Petersburg", "FL", 27.7676, -82.6403, "337"),
+    ("Laredo", "TX", 27.5306, -99.4803, "780"),
+    ("Jersey City", "NJ", 40.7178, -74.0431, "073"),
+    ("Chandler", "AZ", 33.3062, -111.8413, ""),
+    ("Madison", "WI", 43.0731, -89.4012, "537"),
+    ("Lubbock", "TX", 33.5779, -101.8552, "794"),
+    ("Scottsdale", "AZ", 33.4942, -111.9261, ""),
+    ("Reno", "NV", 39.5296, -119.8138, "895"),
+    ("Buffalo", "NY", 42.8864, -78.8784, "142"),
+    ("Gilbert", "AZ", 33.3528, -111.7890, ""),
+    ("Glendale", "AZ", 33.5387, -112.1860, "853"),
+    ("Glendale", "CA", 34.1425, -118.2551, "912"),
+    ("North Las Vegas", "NV", 36.1989, -115.1175, ""),
+    ("Winston-Salem", "NC", 36.0999, -80.2442, "271"),
+    ("Chesapeake", "VA", 36.7682, -76.2875, "233"),
+    ("Norfolk", "VA", 36.8508, -76.2859, "235"),
+    ("Fremont", "CA", 37.5485, -121.9886, "945"),
+    ("Garland", "TX", 32.9126, -96.6389, ""),
+    ("Irving", "TX", 32.8140, -96.9489, ""),
+    ("Hialeah", "FL", 25.8576, -80.2781, "330"),
+    ("Richmond", "VA", 37.5407, -77.4360, "232"),
+    ("Boise", "ID", 43.6150, -116.2023, "837"),
+    ("Spokane", "WA", 47.6588, -117.4260, "992"),
+    ("Baton Rouge", "LA", 30.4515, -91.1871, "708"),
+    ("Tacoma", "WA", 47.2529, -122.4443, "984"),
+    ("San Bernardino", "CA", 34.1083, -117.2898, "924"),
+    ("Modesto", "CA", 37.6391, -120.9969, "953"),
+    ("Fontana", "CA", 34.0922, -117.4350, "923"),
+    ("Des Moines", "IA", 41.5868, -93.6250, "503"),
+    ("Moreno Valley", "CA", 33.9425, -117.2297, ""),
+    ("Santa Clarita", "CA", 34.3917, -118.5426, "913"),
+    ("Fayetteville", "NC", 35.0527, -78.8784, "283"),
+    ("Fayetteville", "AR", 36.0822, -94.1719, "727"),
+    ("Birmingham", "AL", 33.5186, -86.8104, "352"),
+    ("Oxnard", "CA", 34.1975, -119.1771, "930"),
+    ("Rochester", "NY", 43.1566, -77.6088, "146"),
+    ("Port St. Lucie", "FL", 27.2730, -80.3582, "349"),
+    ("Grand Rapids", "MI", 42.9634, -85.6681, "495"),
+    ("Huntsville", "AL", 34.7304, -86.5861, "358"),
+    ("Salt Lake City", "UT", 40.7608, -111.8910, "841"),
+    ("Frisco", "TX", 33.1507, -96.8236, ""),
+    ("Yonkers", "NY", 40.9312, -73.8988, "107"),
+    ("Amarillo", "TX", 35.2220, -101.8313, "791"),
+    ("Huntington Beach", "CA", 33.6603, -117.9992, ""),
+    ("McKinney", "TX", 33.1972, -96.6398, ""),
+    ("Montgomery", "AL", 32.3792, -86.3077, "361"),
+    ("Augusta", "GA", 33.4735, -82.0105, "309"),
+    ("Aurora", "CO", 39.7294, -104.8319, "800"),
+    ("Aurora", "IL", 41.7606, -88.3201, "605"),
+    ("Akron", "OH", 41.0814, -81.5190, "443"),
+    ("Little Rock", "AR", 34.7465, -92.2896, "722"),
+    ("Tempe", "AZ", 33.4255, -111.9400, ""),
+    ("Overland Park", "KS", 38.9822, -94.6708, "662"),
+]
+
+CELL_DEGREES = 0.5
+
+
+def normalize(name):
+    key = (name or '').lower()
+    key = re.sub(r'\bst\b\.?', 'saint', key)
+    key = re.sub(r'\bft\b\.?', 'fort', key)
+    key = re.sub(r'[^\w\s]', ' ', key)
+    return ' '.join(key.split())
+
+
+def grid_cell(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    return int((latitude + 90) // CELL_DEGREES) * 1000 + int((longitude + 180) // CELL_DEGREES)
+
+
+def backfill(model, City, zip_prefixes, zip_field=None):
+    """Set latitude, longitude and geo_cell from the ZIP prefix, else the canonical city."""
+    coords = {
+        pk: (lat, lon)
+        for pk, lat, lon in City.objects.filter(latitude__isnull=False).values_list('pk', 'latitude', 'longitude')
+    }
+    fields = ['pk', 'canonical_city'] + ([zip_field] if zip_field else [])
+    last_pk = 0
+    while True:
+        batch = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list(*fields)[:1000])
+        if not batch:
+            break
+        rows = []
+        for pk, city_id, *zip_code in batch:
+            digits = ''.join(ch for ch in (zip_code[0] if zip_code else None) or '' if ch.isdigit())
+            zip_coords = zip_prefixes.get(digits[:3]) if len(digits) >= 3 else None
+            latitude, longitude = zip_coords or coords.get(city_id, (None, None))
+            rows.append(model(pk=pk, latitude=latitude, longitude=longitude, geo_cell=grid_cell(latitude, longitude)))
+        model.objects.bulk_update(rows, ['latitude', 'longitude', 'geo_cell'])
+        last_pk = batch[-1][0]
+
+
+def locate_rows(apps, schema_editor):
+    City = apps.get_model('core', 'City')
+    centroids = {(normalize(name), state): (lat, lon) for name, state, lat, lon, _ in CENTROIDS}
+    cities = []
+    for city in City.objects.filter(latitude__isnull=True):
+        if (city.key, city.state) in centroids:
+            city.latitude, city.longitude = centroids[city.key, city.state]
+            cities.append(city)
+    City.objects.bulk_update(cities, ['latitude', 'longitude'])
+
+    zip_prefixes = {
+        prefix: (lat, lon) for _, _, lat, lon, prefixes in CENTROIDS for prefix in prefixes.split()
+    }
+    backfill(apps.get_model('core', 'Profile'), City, zip_prefixes, zip_field='zip_code')
+    backfill(apps.get_model('core', 'Room'), City, zip_prefixes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_city'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='Latitude'),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='Longitude'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='geo_cell',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True, verbose_name='Grid Cell'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Latitude'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Longitude'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='geo_cell',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True, verbose_name='Grid Cell'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='latitude',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Latitude'),
+        ),
+        migrations.AddField(
+            model_name='room',
+            name='longitude',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Longitude'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['latitude', 'longitude'], name='core_profil_latitud_4176fa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['latitude', 'longitude'], name='core_room_latitud_b5ba53_idx'),
+        ),
+        migrations.RunPython(locate_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_geo_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileMatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Compatibility Score')),
+                ('matched_profile', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.profile', verbose_name='Matched Profile')),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='matches', to='core.profile', verbose_name='Profile')),
+                ('room', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.room', verbose_name='Room')),
+            ],
+            options={
+                'verbose_name': 'Profile Match',
+                'verbose_name_plural': 'Profile Matches',
+                'ordering': ['-score'],
+                'indexes': [models.Index(fields=['profile', '-score'], name='core_profil_profile_b6b5f7_idx')],
+                'constraints': [models.UniqueConstraint(fields=('profile', 'matched_profile'), name='unique_profile_match'), models.UniqueConstraint(fields=('profile', 'room'), name='unique_room_match')],
+            },
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:29
+
+import re
+
+from django.db import migrations, models
+
+# Frozen copies of core/cities.py and core/data/us_city_centroids.csv as of this
+# migration; later changes there must not alter it
+
+# Cities seeded from here on: (name, state, aliases, latitude, longitude)
+NEW_CITIES = [
+    ("Mount Pleasant", "SC", ("Mt Pleasant",), 32.7941, -79.8626),
+    ("North Charleston", "SC", (), 32.8546, -79.9748),
+    ("Summerville", "SC", (), 33.0185, -80.1756),
+]
+
+# Aliases for cities seeded before, if they have none yet
+NEW_ALIASES = [
+    ("Charleston", "SC", ("West Ashley", "James Island", "Daniel Island")),
+]
+
+# Metro areas with more than one seeded city. Any other city is a metro of its own.
+METRO_AREAS = {
+    "New York": [("New York", "NY"), ("Newark", "NJ"), ("Jersey City", "NJ"), ("Yonkers", "NY")],
+    "Los Angeles": [
+        ("Los Angeles", "CA"), ("Long Beach", "CA"), ("Anaheim", "CA"), ("Santa Ana", "CA"),
+        ("Irvine", "CA"), ("Glendale", "CA"), ("Huntington Beach", "CA"), ("Santa Clarita", "CA"),
+    ],
+    "Inland Empire": [("Riverside", "CA"), ("San Bernardino", "CA"), ("Fontana", "CA"), ("Moreno Valley", "CA")],
+    "San Francisco Bay Area": [("San Francisco", "CA"), ("Oakland", "CA"), ("Fremont", "CA"), ("San Jose", "CA")],
+    "San Diego": [("San Diego", "CA"), ("Chula Vista", "CA")],
+    "Chicago": [("Chicago", "IL"), ("Aurora", "IL")],
+    "Dallas-Fort Worth": [
+        ("Dallas", "TX"), ("Fort Worth", "TX"), ("Arlington", "TX"), ("Plano", "TX"),
+        ("Irving", "TX"), ("Garland", "TX"), ("Frisco", "TX"), ("McKinney", "TX"),
+    ],
+    "Phoenix": [
+        ("Phoenix", "AZ"), ("Mesa", "AZ"), ("Chandler", "AZ"), ("Scottsdale", "AZ"),
+        ("Gilbert", "AZ"), ("Glendale", "AZ"), ("Tempe", "AZ"),
+    ],
+    "Washington": [("Washington", "DC"), ("Arlington", "VA")],
+    "Miami": [("Miami", "FL"), ("Hialeah", "FL")],
+    "Tampa Bay": [("Tampa", "FL"), ("St. Petersburg", "FL")],
+    "Minneapolis-Saint Paul": [("Minneapolis", "MN"), ("Saint Paul", "MN")],
+    "Las Vegas": [("Las Vegas", "NV"), ("Henderson", "NV"), ("North Las Vegas", "NV")],
+    "Kansas City": [("Kansas City", "MO"), ("Kansas City", "KS"), ("Overland Park", "KS")],
+    "Denver": [("Denver", "CO"), ("Aurora", "CO")],
+    "Hampton Roads": [("Virginia Beach", "VA"), ("Norfolk", "VA"), ("Chesapeake", "VA")],
+    "Raleigh-Durham": [("Raleigh", "NC"), ("Durham", "NC")],
+    "Piedmont Triad": [("Greensboro", "NC"), ("Winston-Salem", "NC")],
+    "Seattle": [("Seattle", "WA"), ("Tacoma", "WA")],
+    "Charleston": [("Charleston", "SC"), ("Mount Pleasant", "SC"), ("North Charleston", "SC"), ("Summerville", "SC")],
+}
+
+
+def normalize(name):
+    key = (name or '').lower()
+    key = re.sub(r'\bst\b\.?', 'saint', key)
+    key = re.sub(r'\bft\b\.?', 'fort', key)
+    key = re.sub(r'[^\w\s]', ' ', key)
+    return ' '.join(key.split())
+
+
+def assign_metros(apps, schema_editor):
+    City = apps.get_model('core', 'City')
+    existing = set(City.objects.values_list('key', 'state'))
+    City.objects.bulk_create(
+        City(name=name, state=state, key=normalize(name), aliases=', '.join(aliases), latitude=lat, longitude=lon)
+        for name, state, aliases, lat, lon in NEW_CITIES
+        if (normalize(name), state) not in existing
+    )
+    # Typed in before they were seeded, so created without coordinates
+    for name, state, _, lat, lon in NEW_CITIES:
+        City.objects.filter(key=normalize(name), state=state, latitude__isnull=True).update(latitude=lat, longitude=lon)
+    for name, state, aliases in NEW_ALIASES:
+        City.objects.filter(key=normalize(name), state=state, aliases='').update(aliases=', '.join(aliases))
+
+    metros = {
+        (normalize(name), state): metro
+        for metro, members in METRO_AREAS.items()
+        for name, state in members
+    }
+    cities = list(City.objects.filter(metro=''))
+    for city in cities:
+        default = f"{city.name.strip()}, {city.state}" if city.state else city.name.strip()
+        city.metro = metros.get((city.key, city.state), default)
+    City.objects.bulk_update(cities, ['metro'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_profile_match'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='metro',
+            field=models.CharField(blank=True, db_index=True, max_length=100, verbose_name='Metro Area'),
+        ),
+        migrations.RunPython(assign_metros, migrations.RunPython.noop),
+    ]
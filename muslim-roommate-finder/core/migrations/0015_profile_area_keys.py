@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:31
+
+import re
+
+from django.db import migrations, models
+
+# Frozen copies of core/cities.py and models.US_STATES as of this migration;
+# later changes there must not alter it
+
+US_STATES = {
+    "AL": "Alabama", "AK": "Alaska", "AZ": "Arizona", "AR": "Arkansas",
+    "CA": "California", "CO": "Colorado", "CT": "Connecticut", "DE": "Delaware",
+    "FL": "Florida", "GA": "Georgia", "HI": "Hawaii", "ID": "Idaho",
+    "IL": "Illinois", "IN": "Indiana", "IA": "Iowa", "KS": "Kansas",
+    "KY": "Kentucky", "LA": "Louisiana", "ME": "Maine", "MD": "Maryland",
+    "MA": "Massachusetts", "MI": "Michigan", "MN": "Minnesota", "MS": "Mississippi",
+    "MO": "Missouri", "MT": "Montana", "NE": "Nebraska", "NV": "Nevada",
+    "NH": "New Hampshire", "NJ": "New Jersey", "NM": "New Mexico", "NY": "New York",
+    "NC": "North Carolina", "ND": "North Dakota", "OH": "Ohio", "OK": "Oklahoma",
+    "OR": "Oregon", "PA": "Pennsylvania", "RI": "Rhode Island", "SC": "South Carolina",
+    "SD": "South Dakota", "TN": "Tennessee", "TX": "Texas", "UT": "Utah",
+    "VT": "Vermont", "VA": "Virginia", "WA": "Washington", "WV": "West Virginia",
+    "WI": "Wisconsin", "WY": "Wyoming",
+}
+
+# State code or upper-case full name -> state code
+STATE_CODES = {
+    'DC': 'DC', 'DISTRICT OF COLUMBIA': 'DC',
+    **{code: code for code in US_STATES},
+    **{name.upper(): code for code, name in US_STATES.items()},
+}
+
+
+def normalize(name):
+    key = (name or '').lower()
+    key = re.sub(r'\bst\b\.?', 'saint', key)
+    key = re.sub(r'\bft\b\.?', 'fort', key)
+    key = re.sub(r'[^\w\s]', ' ', key)
+    return ' '.join(key.split())
+
+
+def normalize_state(value):
+    return STATE_CODES.get(' '.join((value or '').upper().split()), '')
+
+
+def fill_area_keys(apps, schema_editor):
+    Profile = apps.get_model('core', 'Profile')
+    last_pk = 0
+    while True:
+        batch = list(Profile.objects.filter(pk__gt=last_pk).order_by('pk').only('city', 'state')[:1000])
+        if not batch:
+            break
+        for profile in batch:
+            profile.city_key = normalize(profile.city)
+            profile.state_code = normalize_state(profile.state)
+        Profile.objects.bulk_update(batch, ['city_key', 'state_code'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_city_metro'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='city_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='City Key'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='state_code',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=2, verbose_name='State Code'),
+        ),
+        migrations.RunPython(fill_area_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,129 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+# Frozen copy of backfill() from core/conversations.py as of this migration; later changes
+# there must not alter it. The read cursors that replace is_read are set up by 0017.
+def _pair(profile_id, other_id):
+    return (profile_id, other_id) if profile_id < other_id else (other_id, profile_id)
+
+
+def group_messages(apps, schema_editor):
+    """Put existing messages in one conversation per pair, without a room."""
+    Message = apps.get_model('core', 'Message')
+    Conversation = apps.get_model('core', 'Conversation')
+    ConversationParticipant = apps.get_model('core', 'ConversationParticipant')
+
+    # One pass over the messages: last message, last activity and unread counts per pair
+    pairs = {}
+    last_pk = 0
+    while True:
+        batch = list(
+            Message.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'sender', 'recipient', 'timestamp', 'is_read')[:1000]
+        )
+        if not batch:
+            break
+        for pk, sender_id, recipient_id, timestamp, is_read in batch:
+            # Messages a profile sent to itself are left out
+            if sender_id == recipient_id:
+                continue
+            stats = pairs.setdefault(_pair(sender_id, recipient_id), {'unread': {}})
+            stats['last'] = (pk, timestamp)
+            if not is_read:
+                stats['unread'][recipient_id] = stats['unread'].get(recipient_id, 0) + 1
+        last_pk = batch[-1][0]
+
+    for (first, second), stats in pairs.items():
+        last_id, last_activity = stats['last']
+        conversation = Conversation.objects.create(
+            first_profile_id=first, second_profile_id=second,
+            last_message_id=last_id, last_activity=last_activity,
+        )
+        ConversationParticipant.objects.bulk_create([
+            ConversationParticipant(conversation=conversation, profile_id=profile_id, other_id=other_id,
+                                    last_activity=last_activity, unread_count=stats['unread'].get(profile_id, 0))
+            for profile_id, other_id in ((first, second), (second, first))
+        ])
+        Message.objects.filter(
+            sender__in=(first, second), recipient__in=(first, second), conversation__isnull=True
+        ).exclude(sender=F('recipient')).update(conversation=conversation)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_profile_area_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0, verbose_name='Unread Messages')),
+                ('last_activity', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Last Activity')),
+            ],
+            options={
+                'verbose_name': 'Conversation Participant',
+                'verbose_name_plural': 'Conversation Participants',
+            },
+        ),
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_activity', models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Last Activity')),
+                ('first_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.profile', verbose_name='First Profile')),
+                ('last_message', models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.message', verbose_name='Last Message')),
+                ('room', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='conversations', to='core.room', verbose_name='Room')),
+                ('second_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.profile', verbose_name='Second Profile')),
+            ],
+            options={
+                'verbose_name': 'Conversation',
+                'verbose_name_plural': 'Conversations',
+                'ordering': ['-last_activity'],
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='conversation',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='core.conversation', verbose_name='Conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'id'], name='core_messag_convers_5c17c7_idx'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='conversation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='core.conversation', verbose_name='Conversation'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='other',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.profile', verbose_name='Other Profile'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='profile',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='core.profile', verbose_name='Profile'),
+        ),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('first_profile', 'second_profile', 'room'), name='unique_conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='conversationparticipant',
+            index=models.Index(fields=['profile', '-last_activity', '-id'], name='core_conver_profile_2cdc27_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='conversationparticipant',
+            unique_together={('conversation', 'profile')},
+        ),
+        migrations.RunPython(group_messages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:37
+
+from django.db import migrations, models
+
+
+def set_read_cursors(apps, schema_editor):
+    """Place each cursor just before the participant's first unread message, then recount."""
+    Message = apps.get_model('core', 'Message')
+    ConversationParticipant = apps.get_model('core', 'ConversationParticipant')
+    last_pk = 0
+    while True:
+        batch = list(
+            ConversationParticipant.objects.filter(pk__gt=last_pk).order_by('pk')
+            .select_related('conversation')[:1000]
+        )
+        if not batch:
+            break
+        for participant in batch:
+            thread = Message.objects.filter(conversation=participant.conversation_id)
+            first_unread = (
+                thread.filter(recipient=participant.profile_id, is_read=False)
+                .order_by('pk').values_list('pk', flat=True).first()
+            )
+            if first_unread is None:
+                cursor = participant.conversation.last_message_id or 0
+            else:
+                cursor = thread.filter(pk__lt=first_unread).order_by('-pk').values_list('pk', flat=True).first() or 0
+            participant.last_read_id = cursor
+            participant.unread_count = thread.filter(recipient=participant.profile_id, pk__gt=cursor).count()
+        ConversationParticipant.objects.bulk_update(batch, ['last_read_id', 'unread_count'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_conversations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last Read At'),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='last_read_id',
+            field=models.BigIntegerField(default=0, verbose_name='Last Read Message ID'),
+        ),
+        migrations.RunPython(set_read_cursors, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
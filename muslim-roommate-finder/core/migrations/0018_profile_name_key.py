@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:41
+
+import re
+
+from django.db import migrations, models
+
+
+# Frozen copy of name_key() from core/search.py as of this migration; later changes there
+# must not alter it
+def name_key(name):
+    return ' '.join(re.findall(r'\w+', (name or '').lower()))
+
+
+def fill_name_keys(apps, schema_editor):
+    Profile = apps.get_model('core', 'Profile')
+    last_pk = 0
+    while True:
+        batch = list(Profile.objects.filter(pk__gt=last_pk).order_by('pk').only('name')[:1000])
+        if not batch:
+            break
+        for profile in batch:
+            profile.name_key = name_key(profile.name)
+        Profile.objects.bulk_update(batch, ['name_key'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_read_cursors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='name_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='Name Key'),
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['gender', 'name_key'], name='core_profil_gender_26bf55_idx'),
+        ),
+        migrations.RunPython(fill_name_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_profile_name_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='photo_renditions_ready',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Photo Renditions Ready'),
+        ),
+        migrations.AddField(
+            model_name='roomimage',
+            name='renditions_ready',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Renditions Ready'),
+        ),
+        migrations.CreateModel(
+            name='ImageRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(db_index=True, max_length=255, verbose_name='Original File')),
+                ('kind', models.CharField(max_length=20, verbose_name='Kind')),
+                ('width', models.PositiveIntegerField(verbose_name='Width')),
+                ('format', models.CharField(max_length=10, verbose_name='Format')),
+                ('file', models.FileField(max_length=255, upload_to='', verbose_name='File')),
+                ('pixel_width', models.PositiveIntegerField(verbose_name='Pixel Width')),
+                ('pixel_height', models.PositiveIntegerField(verbose_name='Pixel Height')),
+                ('bytes', models.PositiveIntegerField(verbose_name='Size (bytes)')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+            ],
+            options={
+                'verbose_name': 'Image Rendition',
+                'verbose_name_plural': 'Image Renditions',
+                'constraints': [models.UniqueConstraint(fields=('source', 'kind', 'width', 'format'), name='unique_image_rendition')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:54
+
+import core.uploads
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='profile_photo',
+            field=models.ImageField(blank=True, help_text='Upload your profile photo (max 3MB, JPEG/PNG/WEBP). Required for profile completion.', null=True, upload_to='profile_photos/', validators=[core.uploads.ImageUploadValidator(3145728, label='Profile image')], verbose_name='Profile Photo'),
+        ),
+        migrations.AlterField(
+            model_name='roomimage',
+            name='image',
+            field=models.ImageField(help_text='Upload an image (max 5MB, JPEG/PNG/WEBP)', upload_to='room_images/', validators=[core.uploads.ImageUploadValidator(5242880)], verbose_name='Image'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_upload_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='photo_placeholder',
+            field=models.TextField(blank=True, editable=False, verbose_name='Photo Placeholder'),
+        ),
+        migrations.AddField(
+            model_name='roomimage',
+            name='placeholder',
+            field=models.TextField(blank=True, editable=False, verbose_name='Placeholder'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_media_deletions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='match_count',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Match Count'),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:26
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Fold every pair's conversations without a room into its oldest one, so the
+    constraint below can be added. Each cursor lands just before the
+    participant's earliest unread message in any of them.
+    """
+    Conversation = apps.get_model('core', 'Conversation')
+    ConversationParticipant = apps.get_model('core', 'ConversationParticipant')
+    Message = apps.get_model('core', 'Message')
+
+    duplicates = (
+        Conversation.objects.filter(room__isnull=True)
+        .values('first_profile', 'second_profile')
+        .annotate(n=Count('pk'), keep=Min('pk')).filter(n__gt=1)
+    )
+    for pair in duplicates:
+        keep = pair['keep']
+        others = list(
+            Conversation.objects.filter(
+                room__isnull=True, first_profile=pair['first_profile'], second_profile=pair['second_profile'],
+            ).exclude(pk=keep).values_list('pk', flat=True)
+        )
+        cursors = {}
+        for conversation, profile_id, last_read_id in ConversationParticipant.objects.filter(
+            conversation__in=[keep, *others]
+        ).values_list('conversation', 'profile', 'last_read_id'):
+            first_unread = (
+                Message.objects.filter(conversation=conversation, recipient=profile_id, pk__gt=last_read_id)
+                .order_by('pk').values_list('pk', flat=True).first()
+            )
+            read_up_to = last_read_id if first_unread is None else first_unread - 1
+            cursors[profile_id] = min(cursors.get(profile_id, read_up_to), read_up_to)
+        Message.objects.filter(conversation__in=others).update(conversation=keep)
+        Conversation.objects.filter(pk__in=others).delete()
+
+        latest = Message.objects.filter(conversation=keep).order_by('-id').values_list('pk', 'timestamp').first()
+        if latest is None:
+            continue
+        last_id, last_activity = latest
+        Conversation.objects.filter(pk=keep).update(last_message=last_id, last_activity=last_activity)
+        for participant in ConversationParticipant.objects.filter(conversation=keep):
+            participant.last_read_id = cursors[participant.profile_id]
+            participant.unread_count = Message.objects.filter(
+                conversation=keep, recipient=participant.profile_id, pk__gt=participant.last_read_id
+            ).count()
+            participant.last_activity = last_activity
+            participant.save(update_fields=['last_read_id', 'unread_count', 'last_activity'])
+
+
+def delete_self_sent(apps, schema_editor):
+    """
+    0016 left messages a profile sent to itself out of every conversation, so
+    no page can show them, and the views refuse to send such messages.
+    """
+    Message = apps.get_model('core', 'Message')
+    Message.objects.filter(conversation__isnull=True, sender=F('recipient')).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_profile_match_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.RunPython(delete_self_sent, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(condition=models.Q(('room__isnull', True)), fields=('first_profile', 'second_profile'), name='unique_conversation_without_room'),
+        ),
+    ]
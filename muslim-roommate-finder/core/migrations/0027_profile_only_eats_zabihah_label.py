@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_conversation_without_room'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='only_eats_zabihah',
+            field=models.BooleanField(default=False, verbose_name='Only Eats Zabihah'),
+        ),
+    ]
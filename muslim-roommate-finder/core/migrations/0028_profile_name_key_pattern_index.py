@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_profile_only_eats_zabihah_label'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='profile',
+            name='core_profil_gender_26bf55_idx',
+        ),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['gender', 'name_key'], name='profile_gender_name_key_like', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']),
+        ),
+    ]
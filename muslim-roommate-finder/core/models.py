@@ -1,14 +1,15 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils.text import slugify
 from django.urls import reverse
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.dispatch import receiver
-from django.core.exceptions import ValidationError
-from PIL import Image
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 import os
 from django.core.files.base import ContentFile
 from io import BytesIO
+from . import cities, conversations, facets, geo, matching, realtime, renditions, search, similar, storage, uploads
 
 # --- Define U.S. states as a dictionary (outside the class) ---
 US_STATES = {
@@ -48,41 +49,117 @@ US_MAJOR_CITIES = [
     "Richmond", "Boise", "Spokane", "Baton Rouge", "Tacoma", "San Bernardino", "Modesto",
     "Fontana", "Des Moines", "Moreno Valley", "Santa Clarita", "Fayetteville", "Birmingham",
     "Oxnard", "Rochester", "Port St. Lucie", "Grand Rapids", "Huntsville", "Salt Lake City",
-    "Frisco", "Yonkers", "Amarillo", "Glendale", "Huntington Beach", "McKinney", "Montgomery",
-    "Augusta", "Aurora", "Akron", "Little Rock", "Tempe", "Columbus", "Overland Park"
+    "Frisco", "Yonkers", "Amarillo", "Huntington Beach", "McKinney", "Montgomery",
+    "Augusta", "Aurora", "Akron", "Little Rock", "Tempe", "Overland Park"
 ]
 
+# --- Cities ---
+class City(models.Model):
+    """Canonical city that Room and Profile point at (see core/cities.py)."""
+    name = models.CharField(max_length=100, verbose_name="City")
+    state = models.CharField(max_length=2, blank=True, verbose_name="State Code")
+    key = models.CharField(max_length=100, db_index=True, verbose_name="Lookup Key")
+    aliases = models.CharField(
+        max_length=255, blank=True, verbose_name="Aliases",
+        help_text="Comma-separated other names for this city, e.g. NYC"
+    )
+    latitude = models.FloatField(null=True, blank=True, verbose_name="Latitude")
+    longitude = models.FloatField(null=True, blank=True, verbose_name="Longitude")
+    metro = models.CharField(max_length=100, blank=True, db_index=True, verbose_name="Metro Area")
+
+    class Meta:
+        verbose_name = "City"
+        verbose_name_plural = "Cities"
+        unique_together = ("key", "state")
+        ordering = ['name', 'state']
+
+    def __str__(self):
+        return f"{self.name}, {self.state}" if self.state else self.name
+
+    def save(self, *args, **kwargs):
+        self.key = cities.normalize(self.name)
+        if not self.metro:
+            self.metro = cities.metro_for(self.name, self.state)
+        super().save(*args, **kwargs)
+
 # --- Profiles ---
-def validate_profile_image_size(image):
-    """Validate profile image file size (max 3MB)"""
-    if image.size > 3 * 1024 * 1024:  # 3MB
-        raise ValidationError("Profile image file too large ( > 3MB )")
-
-def validate_profile_image_format(image):
-    """Validate profile image format"""
-    allowed_formats = ['JPEG', 'JPG', 'PNG', 'WEBP']
-    try:
-        with Image.open(image) as img:
-            if img.format not in allowed_formats:
-                raise ValidationError(f"Unsupported image format. Allowed: {', '.join(allowed_formats)}")
-    except Exception as e:
-        raise ValidationError("Invalid image file")
+validate_profile_photo = uploads.ImageUploadValidator(3 * 1024 * 1024, label="Profile image")  # 3MB
+# Names imported by old migrations
+validate_profile_image_size = validate_profile_image_format = validate_profile_photo
+
+class ProfileQuerySet(models.QuerySet):
+    def for_cards(self):
+        """Profiles for list pages, with the relations a profile card reads loaded up front."""
+        return self.select_related('user')
+
+    def in_area(self, cities=None, state=None, zip_codes=None):
+        """
+        Profiles in any of ``cities``, in ``state`` (code or full name) and in
+        any of ``zip_codes``; each criterion is skipped when not given. Runs as
+        index lookups on city_key, state_code and zip_code.
+        """
+        from . import cities as city_lookup
+
+        no_location = models.Q(city_key='', state_code='') & (
+            models.Q(zip_code__isnull=True) | models.Q(zip_code='')
+        )
+        queryset = self.exclude(no_location)
+        if cities:
+            queryset = queryset.filter(city_key__in=city_lookup.equivalent_keys(cities, state))
+        if state:
+            state_code = city_lookup.normalize_state(state)
+            if not state_code:
+                return queryset.none()
+            queryset = queryset.filter(state_code=state_code)
+        if zip_codes:
+            queryset = queryset.filter(zip_code__in=[str(z).strip() for z in zip_codes])
+        return queryset
+
+    def name_starts_with(self, prefix):
+        """
+        Profiles whose name starts with ``prefix``, ignoring case and
+        punctuation. On PostgreSQL the LIKE 'key%' this becomes is served by
+        a pattern_ops index, which unlike a plain one ignores the collation.
+        """
+        key = search.name_key(prefix)
+        if not key:
+            return self.none()
+        return self.filter(name_key__startswith=key)
+
+    def messageable_by(self, sender):
+        """Profiles ``sender`` may write to: anyone else of the same gender."""
+        queryset = self.exclude(pk=sender.pk)
+        if sender.gender:
+            queryset = queryset.filter(gender=sender.gender)
+        return queryset
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name="User Account")
     name = models.CharField(max_length=100, verbose_name="Full Name")
+    # Normalized copy of name for name_starts_with() (see core/search.py)
+    name_key = models.CharField(max_length=100, blank=True, editable=False, db_index=True, verbose_name="Name Key")
     age = models.PositiveIntegerField(null=True, blank=True, verbose_name="Age")
     gender = models.CharField(max_length=20, choices=[("male", "Male"), ("female", "Female")], verbose_name="Gender")
     city = models.CharField(max_length=100, blank=True, null=True, verbose_name="City", db_index=True)
     state = models.CharField(max_length=100, blank=True, null=True, verbose_name="State", db_index=True)
+    canonical_city = models.ForeignKey(
+        City, on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        related_name="profiles", verbose_name="Canonical City"
+    )
+    # Normalized copies of city/state for in_area() (see core/cities.py)
+    city_key = models.CharField(max_length=100, blank=True, editable=False, db_index=True, verbose_name="City Key")
+    state_code = models.CharField(max_length=2, blank=True, editable=False, db_index=True, verbose_name="State Code")
     neighborhood = models.CharField(max_length=100, blank=True, verbose_name="Neighborhood")
     profile_photo = models.ImageField(
         upload_to="profile_photos/", 
         verbose_name="Profile Photo",
-        validators=[validate_profile_image_size, validate_profile_image_format],
+        validators=[validate_profile_photo],
         help_text="Upload your profile photo (max 3MB, JPEG/PNG/WEBP). Required for profile completion.",
         null=True, blank=True  # Allow null for existing profiles, but we'll enforce in forms
     )
+    # Set once the current photo's renditions exist (see core/renditions.py)
+    photo_renditions_ready = models.BooleanField(default=False, editable=False, verbose_name="Photo Renditions Ready")
+    photo_placeholder = models.TextField(blank=True, editable=False, verbose_name="Photo Placeholder")
     is_looking_for_room = models.BooleanField(default=False, verbose_name="Looking for Room")
     only_eats_zabihah = models.BooleanField(default=False, verbose_name="Only Eats Zabihah")
     prayer_friendly = models.BooleanField(default=False, verbose_name="Prefers Prayer-Friendly Environment")
@@ -91,9 +168,17 @@ class Profile(models.Model):
     contact_email = models.EmailField(blank=True, verbose_name="Contact Email")
     slug = models.SlugField(unique=True, blank=True, verbose_name="URL Slug")
     zip_code = models.CharField(max_length=10, blank=True, null=True, verbose_name="ZIP Code", db_index=True)
+    # Derived from zip code / canonical city (see core/geo.py)
+    latitude = models.FloatField(null=True, blank=True, editable=False, verbose_name="Latitude")
+    longitude = models.FloatField(null=True, blank=True, editable=False, verbose_name="Longitude")
+    geo_cell = models.IntegerField(null=True, blank=True, editable=False, db_index=True, verbose_name="Grid Cell")
+    # Profiles scoring MIN_MATCH_SCORE or more for this one (see core/matching.py); None until computed
+    match_count = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name="Match Count")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At", null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At", null=True, blank=True)
 
+    objects = ProfileQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Profile"
         verbose_name_plural = "Profiles"
@@ -101,6 +186,12 @@ class Profile(models.Model):
             models.Index(fields=['city', 'state']),
             models.Index(fields=['is_looking_for_room']),
             models.Index(fields=['gender']),
+            models.Index(fields=['latitude', 'longitude']),
+            # pattern_ops so name_starts_with() can use it whatever the collation (PostgreSQL only)
+            models.Index(
+                fields=['gender', 'name_key'], name='profile_gender_name_key_like',
+                opclasses=['varchar_pattern_ops', 'varchar_pattern_ops'],
+            ),
         ]
 
     def __str__(self):
@@ -109,40 +200,19 @@ class Profile(models.Model):
     def get_absolute_url(self):
         return reverse("profile_detail", kwargs={"profile_id": self.id})
 
-    def is_charleston_area(self):
-        if not self.city or not self.state:
-            return False
-        return (
-            self.city.strip().lower() == "charleston"
-            and self.state.strip().lower() in ["sc", "south carolina"]
-        )
-
     def is_in_area(self, cities=None, state=None, zip_codes=None):
-        if not (self.city or self.state or self.zip_code):
-            return False
-
-        city_match = True
-        state_match = True
-        zip_match = True
-
-        if cities:
-            city_match = self.city and self.city.strip().lower() in [c.lower() for c in cities]
+        """Single-object form of Profile.objects.in_area()."""
+        from . import cities as city_lookup
 
-        if state:
-            state_input = state.upper()
-            state_fullnames = {v.upper(): k for k, v in US_STATES.items()}
-
-            if state_input in US_STATES:
-                state_match = self.state and self.state.strip().upper() == state_input
-            elif state_input in state_fullnames:
-                state_match = self.state and self.state.strip().upper() == state_fullnames[state_input]
-            else:
-                state_match = False
-
-        if zip_codes:
-            zip_match = self.zip_code and self.zip_code.strip() in [str(z).strip() for z in zip_codes]
-
-        return city_match and state_match and zip_match
+        if not (self.city_key or self.state_code or self.zip_code):
+            return False
+        if cities and self.city_key not in city_lookup.equivalent_keys(cities, state):
+            return False
+        if state and self.state_code != city_lookup.normalize_state(state):
+            return False
+        if zip_codes and (self.zip_code or '').strip() not in [str(z).strip() for z in zip_codes]:
+            return False
+        return True
     
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -153,7 +223,18 @@ class Profile(models.Model):
                 slug = f"{base_slug}-{counter}"
                 counter += 1
             self.slug = slug
+        self.name_key = search.name_key(self.name)
+        self.city_key = cities.normalize(self.city)
+        self.state_code = cities.normalize_state(self.state)
+        if self.zip_code:
+            self.zip_code = self.zip_code.strip()
+        self.canonical_city_id = cities.resolve(self.city, self.state)
+        self.latitude, self.longitude = geo.locate(self.zip_code, self.canonical_city_id)
+        self.geo_cell = geo.grid_cell(self.latitude, self.longitude)
+        uploads.ingest(self.profile_photo, uploads.PROFILE_PHOTO_MAX_EDGE)
+        previous_photo = renditions.start_upload(self)
         super().save(*args, **kwargs)
+        renditions.finish_upload(self, previous_photo)
 
 class RoommateProfile(models.Model):
     profile = models.OneToOneField(Profile, on_delete=models.CASCADE, related_name="roommate_profile", verbose_name="Profile")
@@ -184,21 +265,111 @@ class Contact(models.Model):
     def __str__(self):
         return f"Contact from {self.name} to {self.profile.name}"
 
+class Conversation(models.Model):
+    """A message thread between two profiles, optionally about a room (see core/conversations.py)."""
+    # first_profile has the lower id, so each pair and room has one row
+    first_profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="+", verbose_name="First Profile")
+    second_profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="+", verbose_name="Second Profile")
+    room = models.ForeignKey(
+        "Room", on_delete=models.SET_NULL, null=True, blank=True, related_name="conversations", verbose_name="Room"
+    )
+    # Denormalized from Message; kept current by Message.save() and delete
+    last_message = models.ForeignKey(
+        "Message", on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        related_name="+", verbose_name="Last Message"
+    )
+    last_activity = models.DateTimeField(default=timezone.now, editable=False, verbose_name="Last Activity")
+
+    class Meta:
+        verbose_name = "Conversation"
+        verbose_name_plural = "Conversations"
+        ordering = ['-last_activity']
+        constraints = [
+            models.UniqueConstraint(fields=['first_profile', 'second_profile', 'room'], name='unique_conversation'),
+            # NULLs are distinct above, so conversations without a room need their own
+            models.UniqueConstraint(
+                fields=['first_profile', 'second_profile'], condition=models.Q(room__isnull=True),
+                name='unique_conversation_without_room',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Conversation {self.first_profile_id} <-> {self.second_profile_id}"
+
+    def get_absolute_url(self):
+        return reverse("conversation_detail", args=[self.pk])
+
+class ConversationParticipantQuerySet(models.QuerySet):
+    def for_inbox(self):
+        """Inbox rows, with the other profile, the room and the last message joined in."""
+        return self.select_related('other', 'conversation__room', 'conversation__last_message')
+
+class ConversationParticipant(models.Model):
+    """One side of a conversation: the inbox row of ``profile``."""
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="participants", verbose_name="Conversation"
+    )
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="conversations", verbose_name="Profile")
+    other = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="+", verbose_name="Other Profile")
+    # Read cursor: messages received with a higher id are unread
+    last_read_id = models.BigIntegerField(default=0, verbose_name="Last Read Message ID")
+    last_read_at = models.DateTimeField(null=True, blank=True, verbose_name="Last Read At")
+    unread_count = models.PositiveIntegerField(default=0, verbose_name="Unread Messages")
+    # Copy of Conversation.last_activity so the inbox sorts on one indexed table
+    last_activity = models.DateTimeField(default=timezone.now, verbose_name="Last Activity")
+
+    objects = ConversationParticipantQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Conversation Participant"
+        verbose_name_plural = "Conversation Participants"
+        unique_together = ("conversation", "profile")
+        indexes = [
+            models.Index(fields=['profile', '-last_activity', '-id']),
+        ]
+
+    def __str__(self):
+        return f"{self.profile_id} in conversation {self.conversation_id}"
+
+class MessageQuerySet(models.QuerySet):
+    def for_list(self):
+        """Messages for the inbox, with sender and recipient joined in."""
+        return self.select_related('sender', 'recipient')
+
 class Message(models.Model):
     sender = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="sent_messages", verbose_name="Sender")
     recipient = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="received_messages", verbose_name="Recipient")
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, null=True, blank=True, editable=False,
+        related_name="messages", verbose_name="Conversation"
+    )
     content = models.TextField(verbose_name="Message Content")
     timestamp = models.DateTimeField(auto_now_add=True, verbose_name="Sent At")
-    is_read = models.BooleanField(default=False, verbose_name="Is Read")
+
+    objects = MessageQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Message"
         verbose_name_plural = "Messages"
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['conversation', 'id']),
+        ]
 
     def __str__(self):
         return f"Message from {self.sender.name} to {self.recipient.name}"
 
+    def save(self, *args, **kwargs):
+        # A new message lands in its conversation's counters in the same transaction
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            if self.conversation_id is None:
+                self.conversation = conversations.get_or_start(self.sender_id, self.recipient_id)
+            super().save(*args, **kwargs)
+            conversations.record_message(self)
+            realtime.publish_message(self)
+
 # --- Rooms ---
 class RoomType(models.Model):
     name = models.CharField(max_length=100, verbose_name="Room Type")
@@ -226,6 +397,29 @@ class Amenity(models.Model):
     def __str__(self):
         return self.name
 
+class RoomQuerySet(models.QuerySet):
+    def for_cards(self):
+        """
+        Rooms for list pages: owner, room type and primary image joined and
+        amenities prefetched, so a page of cards runs a fixed number of queries.
+        """
+        return self.select_related('user', 'room_type', 'primary_image').prefetch_related('amenities')
+
+    def refresh_image_stats(self):
+        """Recompute primary_image and image_count for these rooms in one UPDATE."""
+        images = RoomImage.objects.filter(room=models.OuterRef('pk'))
+        return self.update(
+            primary_image=models.Subquery(
+                images.order_by('-is_primary', 'created_at', 'pk').values('pk')[:1]
+            ),
+            image_count=Coalesce(
+                models.Subquery(
+                    images.order_by().values('room').annotate(total=models.Count('pk')).values('total')
+                ),
+                0,
+            ),
+        )
+
 class Room(models.Model):
     user = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="rooms", verbose_name="Owner")
     title = models.CharField(max_length=200, verbose_name="Room Title")
@@ -233,6 +427,10 @@ class Room(models.Model):
     room_type = models.ForeignKey(RoomType, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Room Type")
     amenities = models.ManyToManyField(Amenity, blank=True, verbose_name="Amenities")
     city = models.CharField(max_length=100, verbose_name="City", db_index=True)
+    canonical_city = models.ForeignKey(
+        City, on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        related_name="rooms", verbose_name="Canonical City"
+    )
     price = models.DecimalField(max_digits=10, decimal_places=0, verbose_name="Monthly Rent")  # Remove cents
     available_from = models.DateField(null=True, blank=True, verbose_name="Available From")
     phone_number = models.CharField(max_length=15, blank=True, verbose_name="Phone Number (Optional)")
@@ -242,9 +440,21 @@ class Room(models.Model):
     slug = models.SlugField(unique=True, blank=True, verbose_name="URL Slug")
     contact_email = models.EmailField(blank=True, verbose_name="Contact Email")
     is_active = models.BooleanField(default=True, verbose_name="Active Listing")
+    # Denormalized from RoomImage; kept current by RoomImage.save() and delete
+    primary_image = models.ForeignKey(
+        "RoomImage", on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        related_name="+", verbose_name="Primary Image"
+    )
+    image_count = models.PositiveIntegerField(default=0, editable=False, verbose_name="Images")
+    # Derived from canonical city (see core/geo.py)
+    latitude = models.FloatField(null=True, blank=True, editable=False, verbose_name="Latitude")
+    longitude = models.FloatField(null=True, blank=True, editable=False, verbose_name="Longitude")
+    geo_cell = models.IntegerField(null=True, blank=True, editable=False, db_index=True, verbose_name="Grid Cell")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At", null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At", null=True, blank=True)
 
+    objects = RoomQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Room"
         verbose_name_plural = "Rooms"
@@ -254,26 +464,14 @@ class Room(models.Model):
             models.Index(fields=['price']),
             models.Index(fields=['available_from']),
             models.Index(fields=['is_active']),
+            models.Index(fields=['latitude', 'longitude']),
         ]
 
     def __str__(self):
         return f"{self.title} ({self.city})"
 
     def get_absolute_url(self):
-        return reverse("room_detail", kwargs={"room_id": self.id})
-    
-    @property
-    def primary_image(self):
-        """Get the primary image for this room"""
-        try:
-            return self.images.filter(is_primary=True).first() or self.images.first()
-        except:
-            return None
-    
-    @property
-    def image_count(self):
-        """Get the number of images for this room"""
-        return self.images.count()
+        return reverse("room_detail", kwargs={"pk": self.id})
     
     def get_price_display(self):
         """Format price for display without cents"""
@@ -288,33 +486,28 @@ class Room(models.Model):
                 slug = f"{base_slug}-{counter}"
                 counter += 1
             self.slug = slug
+        self.canonical_city_id = cities.resolve(self.city, self.user.state if self.user_id else '')
+        self.latitude, self.longitude = geo.locate(city_id=self.canonical_city_id)
+        self.geo_cell = geo.grid_cell(self.latitude, self.longitude)
         super().save(*args, **kwargs)
 
-def validate_image_size(image):
-    """Validate image file size (max 5MB)"""
-    if image.size > 5 * 1024 * 1024:  # 5MB
-        raise ValidationError("Image file too large ( > 5MB )")
-
-def validate_image_format(image):
-    """Validate image format"""
-    allowed_formats = ['JPEG', 'JPG', 'PNG', 'WEBP']
-    try:
-        with Image.open(image) as img:
-            if img.format not in allowed_formats:
-                raise ValidationError(f"Unsupported image format. Allowed: {', '.join(allowed_formats)}")
-    except Exception as e:
-        raise ValidationError("Invalid image file")
+validate_room_image = uploads.ImageUploadValidator(5 * 1024 * 1024)  # 5MB
+# Names imported by old migrations
+validate_image_size = validate_image_format = validate_room_image
 
 class RoomImage(models.Model):
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name="images", verbose_name="Room")
     image = models.ImageField(
         upload_to="room_images/", 
         verbose_name="Image",
-        validators=[validate_image_size, validate_image_format],
+        validators=[validate_room_image],
         help_text="Upload an image (max 5MB, JPEG/PNG/WEBP)"
     )
     is_primary = models.BooleanField(default=False, verbose_name="Primary Image")
     caption = models.CharField(max_length=200, blank=True, verbose_name="Caption")
+    # Set once the current image's renditions exist (see core/renditions.py)
+    renditions_ready = models.BooleanField(default=False, editable=False, verbose_name="Renditions Ready")
+    placeholder = models.TextField(blank=True, editable=False, verbose_name="Placeholder")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At", null=True, blank=True)
 
     class Meta:
@@ -334,16 +527,15 @@ class RoomImage(models.Model):
         if not self.pk and not RoomImage.objects.filter(room=self.room).exists():
             self.is_primary = True
             
+        uploads.ingest(self.image, uploads.ROOM_IMAGE_MAX_EDGE)
+        previous_image = renditions.start_upload(self)
         super().save(*args, **kwargs)
+        renditions.finish_upload(self, previous_image)
+        Room.objects.filter(pk=self.room_id).refresh_image_stats()
     
     def get_thumbnail_url(self, size=(300, 200)):
-        """Generate a thumbnail URL for the image"""
-        if not self.image:
-            return None
-        
-        # For now, return the original image URL
-        # In production, you might want to generate actual thumbnails
-        return self.image.url
+        """URL of the smallest card rendition at least ``size[0]`` wide (the original until rendered)"""
+        return renditions.pick(self, 'card', size[0])
     
     def get_file_size(self):
         """Get the file size in a human-readable format"""
@@ -360,6 +552,54 @@ class RoomImage(models.Model):
         except:
             return "Unknown size"
 
+class MediaBlob(models.Model):
+    """A content-addressed media file and how many rows refer to it (see core/storage.py)."""
+    name = models.CharField(max_length=255, unique=True, verbose_name="File Name")
+    size = models.PositiveBigIntegerField(verbose_name="Size (bytes)")
+    references = models.PositiveIntegerField(default=1, verbose_name="References")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+
+    class Meta:
+        verbose_name = "Media Blob"
+        verbose_name_plural = "Media Blobs"
+
+    def __str__(self):
+        return f"{self.name} ({self.references})"
+
+class MediaDeletion(models.Model):
+    """A file queued for removal by a worker (see core/storage.py)."""
+    name = models.CharField(max_length=255, verbose_name="File Name")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+
+    class Meta:
+        verbose_name = "Media Deletion"
+        verbose_name_plural = "Media Deletions"
+
+    def __str__(self):
+        return self.name
+
+class ImageRendition(models.Model):
+    """One resized copy of an uploaded photo (see core/renditions.py)."""
+    source = models.CharField(max_length=255, db_index=True, verbose_name="Original File")
+    kind = models.CharField(max_length=20, verbose_name="Kind")
+    width = models.PositiveIntegerField(verbose_name="Width")
+    format = models.CharField(max_length=10, verbose_name="Format")
+    file = models.FileField(max_length=255, verbose_name="File")
+    pixel_width = models.PositiveIntegerField(verbose_name="Pixel Width")
+    pixel_height = models.PositiveIntegerField(verbose_name="Pixel Height")
+    bytes = models.PositiveIntegerField(verbose_name="Size (bytes)")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+
+    class Meta:
+        verbose_name = "Image Rendition"
+        verbose_name_plural = "Image Renditions"
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'kind', 'width', 'format'], name='unique_image_rendition'),
+        ]
+
+    def __str__(self):
+        return f"{self.source} ({self.kind} {self.width}w {self.format})"
+
 class RoomAmenity(models.Model):
     room = models.ForeignKey(Room, on_delete=models.CASCADE, verbose_name="Room")
     amenity = models.ForeignKey(Amenity, on_delete=models.CASCADE, verbose_name="Amenity")
@@ -435,6 +675,88 @@ class RoomReview(models.Model):
     def __str__(self):
         return f"{self.reviewer.name} review of {self.room.title}: {self.rating}/5"
 
+# --- Matching ---
+class ProfileMatch(models.Model):
+    """One of a profile's top compatible profiles or rooms (see core/matching.py)."""
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name="matches", verbose_name="Profile")
+    matched_profile = models.ForeignKey(
+        Profile, on_delete=models.CASCADE, null=True, blank=True, related_name="+", verbose_name="Matched Profile"
+    )
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, null=True, blank=True, related_name="+", verbose_name="Room")
+    score = models.FloatField(verbose_name="Compatibility Score")
+
+    class Meta:
+        verbose_name = "Profile Match"
+        verbose_name_plural = "Profile Matches"
+        ordering = ['-score']
+        constraints = [
+            models.UniqueConstraint(fields=['profile', 'matched_profile'], name='unique_profile_match'),
+            models.UniqueConstraint(fields=['profile', 'room'], name='unique_room_match'),
+        ]
+        indexes = [
+            models.Index(fields=['profile', '-score']),
+        ]
+
+    def __str__(self):
+        return f"{self.profile_id} -> {self.matched_profile_id or self.room_id} ({self.score})"
+
+# --- Filter facets ---
+class LocationFacet(models.Model):
+    """Distinct city/state values with usage counts, maintained by signals (see core/facets.py)."""
+    KIND_CHOICES = [
+        ("profile_city", "Profile City"),
+        ("profile_state", "Profile State"),
+        ("room_city", "Room City"),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Kind")
+    value = models.CharField(max_length=100, verbose_name="Value")
+    count = models.IntegerField(default=0, verbose_name="Count")
+
+    class Meta:
+        verbose_name = "Location Facet"
+        verbose_name_plural = "Location Facets"
+        unique_together = ("kind", "value")
+        ordering = ['kind', 'value']
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.value} ({self.count})"
+
+# --- Background jobs ---
+class Job(models.Model):
+    """A queued call of a background function (see core/jobs.py)."""
+    QUEUED = "queued"
+    RUNNING = "running"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (FAILED, "Failed"),
+    ]
+
+    name = models.CharField(max_length=200, verbose_name="Function")
+    args = models.JSONField(default=list, blank=True, verbose_name="Arguments")
+    kwargs = models.JSONField(default=dict, blank=True, verbose_name="Keyword Arguments")
+    priority = models.SmallIntegerField(default=0, verbose_name="Priority")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, verbose_name="Status")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Attempts")
+    max_attempts = models.PositiveSmallIntegerField(default=5, verbose_name="Max Attempts")
+    # When the job may next be claimed: its start, a retry, or the end of a claim
+    available_at = models.DateTimeField(default=timezone.now, verbose_name="Available At")
+    worker = models.CharField(max_length=100, blank=True, verbose_name="Worker")
+    last_error = models.TextField(blank=True, verbose_name="Last Error")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+
+    class Meta:
+        verbose_name = "Job"
+        verbose_name_plural = "Jobs"
+        indexes = [
+            models.Index(fields=['status', '-priority', 'available_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.get_status_display()}, {self.attempts}/{self.max_attempts})"
+
 # --- Signals ---
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -445,3 +767,152 @@ def create_user_profile(sender, instance, created, **kwargs):
 def save_user_profile(sender, instance, **kwargs):
     if hasattr(instance, "profile"):
         instance.profile.save()
+
+@receiver(post_save, sender=Room)
+@receiver(post_save, sender=Profile)
+def update_search_index(sender, instance, **kwargs):
+    search.index_instance(instance)
+
+@receiver(post_delete, sender=Room)
+@receiver(post_delete, sender=Profile)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_instance(instance)
+
+def _origin_model(origin):
+    """Model whose delete() started a (possibly cascading) deletion."""
+    return origin.model if isinstance(origin, models.QuerySet) else type(origin)
+
+@receiver(post_delete, sender=RoomImage)
+def refresh_room_image_stats(sender, instance, origin=None, **kwargs):
+    # Skip cascades from deleting the room itself
+    if _origin_model(origin) is RoomImage:
+        Room.objects.filter(pk=instance.room_id).refresh_image_stats()
+
+@receiver(pre_save, sender=RoomImage)
+@receiver(pre_save, sender=Profile)
+def remember_replaced_files(sender, instance, **kwargs):
+    # Files the row held that this save lets go of: cleared, changed, or
+    # replaced by a new upload (which may store the same blob again)
+    instance._files_replaced = []
+    if instance.pk:
+        fields = [field for field in sender._meta.fields if isinstance(field, models.FileField)]
+        stored = sender.objects.filter(pk=instance.pk).values(*[field.attname for field in fields]).first()
+        if stored:
+            for field in fields:
+                current = getattr(instance, field.attname)
+                if stored[field.attname] and (uploads.is_new(current) or current.name != stored[field.attname]):
+                    instance._files_replaced.append(stored[field.attname])
+
+@receiver(post_save, sender=RoomImage)
+@receiver(post_save, sender=Profile)
+def delete_replaced_files(sender, instance, **kwargs):
+    storage.delete_later(getattr(instance, '_files_replaced', []))
+
+@receiver(post_delete, sender=RoomImage)
+@receiver(post_delete, sender=Profile)
+@receiver(post_delete, sender=ImageRendition)
+def delete_files_later(sender, instance, **kwargs):
+    storage.delete_later(storage.file_names(instance))
+
+@receiver(post_delete, sender=RoomImage)
+def discard_room_image_renditions(sender, instance, **kwargs):
+    renditions.discard(instance.image.name)
+
+@receiver(post_delete, sender=Profile)
+def discard_profile_photo_renditions(sender, instance, **kwargs):
+    renditions.discard(instance.profile_photo.name)
+
+@receiver(pre_save, sender=Room)
+@receiver(pre_save, sender=Profile)
+def remember_previous_values(sender, instance, **kwargs):
+    instance._facets_before = None
+    instance._city_before = None
+    instance._scored_before = None
+    instance._similar_before = None
+    if instance.pk:
+        model_name = sender._meta.model_name
+        fields = [*facets.FACET_FIELDS[model_name].values(), *matching.SCORED_FIELDS[model_name]]
+        if sender is Profile:
+            fields += similar.DEPENDS_ON
+        stored = sender.objects.only('canonical_city', *fields).filter(pk=instance.pk).first()
+        if stored:
+            instance._facets_before = facets.snapshot(stored)
+            instance._city_before = stored.canonical_city_id
+            instance._scored_before = matching.snapshot(stored)
+            if sender is Profile:
+                instance._similar_before = similar.snapshot(stored)
+
+@receiver(post_save, sender=Room)
+@receiver(post_save, sender=Profile)
+def update_facets(sender, instance, **kwargs):
+    facets.record_change(getattr(instance, '_facets_before', None), facets.snapshot(instance))
+
+@receiver(post_delete, sender=Room)
+@receiver(post_delete, sender=Profile)
+def remove_facets(sender, instance, **kwargs):
+    facets.record_change(facets.snapshot(instance), None)
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def invalidate_city_index(sender, **kwargs):
+    cities.invalidate()
+
+@receiver(post_save, sender=Profile)
+def refresh_profile_matches(sender, instance, **kwargs):
+    # Not for saves that leave every scored field as it was, like the one on each login
+    if getattr(instance, '_scored_before', None) != matching.snapshot(instance):
+        matching.schedule_refresh(matching.affected_by_profile(instance))
+
+@receiver(post_save, sender=RoommateProfile)
+@receiver(post_delete, sender=RoommateProfile)
+def refresh_budget_matches(sender, instance, origin=None, **kwargs):
+    # Deleting the profile itself is handled by its own signal
+    if origin is None or _origin_model(origin) is RoommateProfile:
+        matching.schedule_refresh(matching.affected_by_profile(instance.profile))
+
+@receiver(post_save, sender=Room)
+def announce_new_room(sender, instance, created, **kwargs):
+    if created and instance.is_active and instance.canonical_city_id:
+        realtime.publish_room(instance)
+
+@receiver(post_save, sender=Room)
+def refresh_room_matches(sender, instance, **kwargs):
+    if getattr(instance, '_scored_before', None) != matching.snapshot(instance):
+        matching.schedule_refresh(matching.affected_by_room(instance))
+
+@receiver(pre_delete, sender=Profile)
+def remember_profile_match_holders(sender, instance, **kwargs):
+    instance._match_affected = matching.affected_by_profile(instance) - {instance.pk}
+
+@receiver(pre_delete, sender=Room)
+def remember_room_match_holders(sender, instance, origin=None, **kwargs):
+    # Rooms deleted along with their owner are covered by the owner's signal
+    if _origin_model(origin) is Room:
+        instance._match_affected = matching.affected_by_room(instance)
+
+@receiver(post_delete, sender=Profile)
+@receiver(post_delete, sender=Room)
+def refresh_matches_after_delete(sender, instance, **kwargs):
+    matching.schedule_refresh(getattr(instance, '_match_affected', ()))
+
+@receiver(post_save, sender=Profile)
+def invalidate_similar_profiles(sender, instance, **kwargs):
+    # Not for saves that change nothing the lists rank by or show
+    if getattr(instance, '_similar_before', None) == similar.snapshot(instance):
+        return
+    similar.invalidate_cities(instance.canonical_city_id, getattr(instance, '_city_before', None))
+
+@receiver(post_delete, sender=Profile)
+def invalidate_similar_profiles_on_delete(sender, instance, **kwargs):
+    similar.invalidate_cities(instance.canonical_city_id)
+
+@receiver(pre_delete, sender=Room)
+def merge_room_conversations(sender, instance, **kwargs):
+    # Room is SET_NULL on conversations; a pair may only have one without a room
+    conversations.close_room(instance.pk)
+
+@receiver(post_delete, sender=Message)
+def update_conversation_after_delete(sender, instance, origin=None, **kwargs):
+    # Skip cascades from deleting the conversation or a profile
+    if _origin_model(origin) is Message and instance.conversation_id:
+        conversations.remove_message(instance)
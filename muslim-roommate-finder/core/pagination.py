@@ -0,0 +1,200 @@
+"""
+Keyset (cursor) pagination and cached counts for list views.
+
+Django's Paginator runs COUNT(*) and an OFFSET scan, so deep pages get slower.
+KeysetPaginator instead filters on the sort key of the last row shown, so
+every page costs the same. Cursors are signed tokens that hold the key values,
+a direction and the ordering they were made for; a cursor from another sort
+starts over at the first page. Users cannot read or forge them.
+"""
+import datetime
+import hashlib
+from decimal import Decimal
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.db.models import F, Q
+from django.utils.dateparse import parse_date, parse_datetime
+
+CURSOR_SALT = 'core.pagination.cursor'
+
+# Seconds a cached total stays valid
+COUNT_CACHE_TIMEOUT = 60
+
+
+def cached_count(queryset, timeout=COUNT_CACHE_TIMEOUT):
+    """
+    Return ``queryset.count()``, cached for ``timeout`` seconds.
+
+    The cache key is a hash of the compiled SQL, so every filter combination
+    gets its own entry and page N reuses the total from page 1.
+    """
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    digest = hashlib.md5(f'{sql}|{params!r}'.encode()).hexdigest()
+    return cache.get_or_set(f'count:{digest}', queryset.count, timeout)
+
+
+# --- Cursor encoding ---
+def _encode_value(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return ['dt', value.isoformat()]
+    if isinstance(value, datetime.date):
+        return ['d', value.isoformat()]
+    if isinstance(value, Decimal):
+        return ['dec', str(value)]
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, list):
+        kind, raw = value
+        if kind == 'dt':
+            return parse_datetime(raw)
+        if kind == 'd':
+            return parse_date(raw)
+        if kind == 'dec':
+            return Decimal(raw)
+    return value
+
+
+def encode_cursor(values, direction, ordering):
+    return signing.dumps(
+        {'v': [_encode_value(v) for v in values], 'd': direction, 'o': list(ordering)},
+        salt=CURSOR_SALT,
+    )
+
+
+def decode_cursor(token):
+    """Return (values, direction, ordering), or (None, None, None) for a missing or bad token."""
+    if not token:
+        return None, None, None
+    try:
+        data = signing.loads(token, salt=CURSOR_SALT)
+        return [_decode_value(v) for v in data['v']], data['d'], data['o']
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        return None, None, None
+
+
+class KeysetPage:
+    """One page of results plus the cursors for its neighbours."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """
+    Paginate ``queryset`` by the columns in ``ordering``.
+
+    ``ordering`` uses order_by() syntax, e.g. ('-created_at', '-id'), and must
+    end with a unique column. NULLs sort last, so nullable columns such as
+    ``age`` are allowed.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.sort_key = list(ordering)
+        self.ordering = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.per_page = per_page
+
+    def _order_by(self, reverse=False):
+        expressions = []
+        nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+        for name, descending in self.ordering:
+            if descending != reverse:
+                expressions.append(F(name).desc(**nulls))
+            else:
+                expressions.append(F(name).asc(**nulls))
+        return expressions
+
+    def _nullable(self, name):
+        try:
+            return self.queryset.model._meta.get_field(name).null
+        except FieldDoesNotExist:
+            return True  # annotations
+
+    def _seek(self, values, reverse=False):
+        """Rows strictly after ``values`` in page order (before, if ``reverse``)."""
+        condition = Q(pk__in=[])
+        equal_so_far = Q()
+        for (name, descending), value in zip(self.ordering, values):
+            if value is None:
+                # NULLs are last: nothing follows them, everything non-null precedes them
+                strictly = Q(**{f'{name}__isnull': False}) if reverse else Q(pk__in=[])
+                equal = Q(**{f'{name}__isnull': True})
+            else:
+                lookup = 'lt' if descending != reverse else 'gt'
+                strictly = Q(**{f'{name}__{lookup}': value})
+                if not reverse and self._nullable(name):
+                    strictly |= Q(**{f'{name}__isnull': True})
+                equal = Q(**{name: value})
+            condition |= equal_so_far & strictly
+            equal_so_far &= equal
+        return condition
+
+    def _key(self, obj):
+        return [getattr(obj, name) for name, _ in self.ordering]
+
+    def get_page(self, cursor=None):
+        values, direction, sort_key = decode_cursor(cursor)
+        reverse = direction == 'prev'
+        queryset = self.queryset
+        # A cursor made under another sort would seek on the wrong columns
+        if values is None or sort_key != self.sort_key:
+            values, reverse = None, False
+        elif values:
+            queryset = queryset.filter(self._seek(values, reverse=reverse))
+        # A cursor without values means the last page ('prev') or the first ('next')
+
+        rows = list(queryset.order_by(*self._order_by(reverse=reverse))[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+        if not rows:
+            # A seek past either end (rows deleted since the cursor was made)
+            # still leads back to the rows that are left
+            if not values:
+                return KeysetPage([])
+            if reverse:
+                return KeysetPage([], next_cursor=encode_cursor([], 'next', self.sort_key))
+            return KeysetPage([], previous_cursor=encode_cursor([], 'prev', self.sort_key))
+
+        # Going forward there is a previous page whenever we seeked; going
+        # backward there is a next page unless this is the last page.
+        has_next = has_more if not reverse else bool(values)
+        has_previous = bool(values) if not reverse else has_more
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(self._key(rows[-1]), 'next', self.sort_key) if has_next else None,
+            previous_cursor=encode_cursor(self._key(rows[0]), 'prev', self.sort_key) if has_previous else None,
+        )
@@ -0,0 +1,330 @@
+"""
+Pushing events to connected users.
+
+Code that changes something publishes an event, a JSON-able dict with a
+``type``, to a channel such as user_channel(user_id) or city_channel(city_id).
+Browsers receive the events of user_channels() through the event_stream()
+server-sent events view, over a WebSocket at WEBSOCKET_PATH (routed in
+config/asgi.py), or by long polling poll_events().
+
+The broker is chosen by the REALTIME_BROKER setting. The default,
+InProcessBroker, lives in the memory of one server process. That is enough
+for a single ASGI worker. A broker backed by Redis or Postgres LISTEN/NOTIFY
+can replace it by implementing publish(), subscribe(), history() and
+last_id().
+
+Every event gets an increasing ``id``. Each channel keeps its last
+HISTORY_SIZE events, so a long poll or a reconnecting socket that passes the
+last id it saw does not miss events published in between. Ids keep
+increasing across server restarts (see InProcessBroker), so a browser that
+outlives the process does not drop new events as already seen.
+"""
+import asyncio
+import functools
+import itertools
+import json
+import threading
+import time
+import types
+from collections import OrderedDict, deque
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import urlparse
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+WEBSOCKET_PATH = '/ws/events/'
+
+# Events remembered per channel for clients catching up
+HISTORY_SIZE = 50
+
+# Channels with history kept; the least recently used are dropped past this
+MAX_CHANNELS = 10000
+
+# Events queued for one connection; a client that falls further behind loses the oldest
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# Seconds a long poll waits for an event before returning empty
+LONG_POLL_TIMEOUT = 25
+
+# Seconds between keep-alive comments on a quiet event stream
+HEARTBEAT_INTERVAL = 15
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def city_channel(city_id):
+    return f'city:{city_id}'
+
+
+def user_channels(user_id):
+    """Channels a user listens on: their own, and their profile's city."""
+    from .models import Profile
+
+    channels = [user_channel(user_id)]
+    city_id = Profile.objects.filter(user=user_id).values_list('canonical_city', flat=True).first()
+    if city_id:
+        channels.append(city_channel(city_id))
+    return channels
+
+
+# --- Brokers ---
+class Subscription:
+    """Events published to some channels after subscribe(), read with get()."""
+
+    def __init__(self, broker, channels):
+        self.broker = broker
+        self.channels = list(channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue = deque(maxlen=SUBSCRIBER_QUEUE_SIZE)
+        self.ready = asyncio.Event()
+
+    def deliver(self, event):
+        """Queue an event; called on the subscriber's event loop."""
+        self.queue.append(event)
+        self.ready.set()
+
+    async def get(self, timeout=None):
+        """The next event, or None after ``timeout`` seconds."""
+        while not self.queue:
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.queue.popleft()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """Pub/sub within one process. publish() may be called from any thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Start from the clock in microseconds rather than 1, so ids after a restart
+        # are above any a browser saw before it; they stay exact as JavaScript numbers
+        self.ids = itertools.count(time.time_ns() // 1000)
+        self.subscribers = {}
+        self.histories = OrderedDict()
+
+    def publish(self, channel, event):
+        with self.lock:
+            event = dict(event, id=next(self.ids))
+            history = self.histories.pop(channel, None) or deque(maxlen=HISTORY_SIZE)
+            history.append(event)
+            self.histories[channel] = history
+            while len(self.histories) > MAX_CHANNELS:
+                self.histories.popitem(last=False)
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The subscriber's loop has closed; it unsubscribes on its way out
+                pass
+        return event
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscribers = self.subscribers.get(channel)
+                if subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.subscribers[channel]
+
+    def last_id(self, channels):
+        """Id of the newest remembered event on ``channels``, or 0."""
+        with self.lock:
+            return max((self.histories[c][-1]['id'] for c in channels if self.histories.get(c)), default=0)
+
+    def history(self, channels, since):
+        """Remembered events on ``channels`` with an id above ``since``, oldest first."""
+        with self.lock:
+            events = [
+                event for channel in channels
+                for event in self.histories.get(channel, ()) if event['id'] > since
+            ]
+        return sorted(events, key=lambda event: event['id'])
+
+
+@functools.lru_cache(maxsize=1)
+def get_broker():
+    return import_string(getattr(settings, 'REALTIME_BROKER', 'core.realtime.InProcessBroker'))()
+
+
+# --- Events ---
+def publish_message(message):
+    """Tell both sides of a conversation about a new message, with their unread totals."""
+    from . import conversations
+
+    def send():
+        payload = {
+            'type': 'message',
+            'conversation': message.conversation_id,
+            'message': {
+                'id': message.pk,
+                'sender': message.sender.name,
+                'content': message.content,
+                'timestamp': message.timestamp.isoformat(),
+            },
+        }
+        for profile in (message.recipient, message.sender):
+            get_broker().publish(
+                user_channel(profile.user_id),
+                dict(payload, unread=conversations.unread_total(profile.user_id)),
+            )
+    transaction.on_commit(send)
+
+
+def publish_read(reader, reads):
+    """
+    Tell ``reader``'s other pages which conversations they read, with their
+    new unread total, and the other side of each how far they have read.
+    ``reads`` maps conversation id to (other side's user id, last read message id).
+    """
+    from . import conversations
+
+    def send():
+        broker = get_broker()
+        broker.publish(user_channel(reader.user_id), {
+            'type': 'read',
+            'conversations': list(reads),
+            'unread': conversations.unread_total(reader.user_id),
+        })
+        for conversation_id, (user_id, up_to_id) in reads.items():
+            broker.publish(user_channel(user_id), {
+                'type': 'read', 'conversation': conversation_id, 'reader': reader.name, 'up_to': up_to_id,
+            })
+    if reads:
+        transaction.on_commit(send)
+
+
+def publish_room(room):
+    """Announce a new listing to everyone whose profile is in its city."""
+    event = {
+        'type': 'room',
+        'room': {'id': room.pk, 'title': room.title, 'city': room.city, 'url': room.get_absolute_url()},
+    }
+    transaction.on_commit(lambda: get_broker().publish(city_channel(room.canonical_city_id), event))
+
+
+async def stream(channels, since=None, heartbeat=None):
+    """
+    Events on ``channels`` as they are published, after the remembered ones
+    newer than ``since`` when given. Yields None whenever ``heartbeat``
+    seconds pass without one. A slow reader holds at most
+    SUBSCRIBER_QUEUE_SIZE events; older ones are dropped.
+    """
+    broker = get_broker()
+    subscription = broker.subscribe(channels)
+    try:
+        last_id = 0
+        if since is not None:
+            for event in broker.history(channels, since):
+                last_id = event['id']
+                yield event
+        while True:
+            event = await subscription.get(heartbeat)
+            if event is None:
+                yield None
+            # Skip events already replayed from history
+            elif event['id'] > last_id:
+                last_id = event['id']
+                yield event
+    finally:
+        subscription.close()
+
+
+def format_sse(event):
+    """``event`` as a server-sent event; None becomes a keep-alive comment."""
+    if event is None:
+        return ': heartbeat\n\n'
+    return f'id: {event["id"]}\ndata: {json.dumps(event)}\n\n'
+
+
+async def wait_for_events(channels, since, timeout=LONG_POLL_TIMEOUT):
+    """Events after ``since``: any remembered ones at once, else the first published within ``timeout``."""
+    broker = get_broker()
+    # Subscribe before reading history so nothing published in between is missed
+    subscription = broker.subscribe(channels)
+    try:
+        events = broker.history(channels, since)
+        if not events:
+            event = await subscription.get(timeout)
+            events = [event] if event else []
+    finally:
+        subscription.close()
+    return events
+
+
+# --- WebSocket ---
+def _headers(scope):
+    return {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope.get('headers', [])}
+
+
+def _user_id(headers):
+    """The logged-in user's id from the session cookie, or None."""
+    from django.contrib.auth import get_user
+
+    cookie = SimpleCookie(headers.get('cookie', ''))
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+    session = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value)
+    user = get_user(types.SimpleNamespace(session=session))
+    return user.pk if user.is_authenticated else None
+
+
+def _same_origin(headers):
+    # Browsers send cookies on cross-site WebSocket handshakes; refuse those
+    origin = headers.get('origin')
+    return origin is None or urlparse(origin).netloc == headers.get('host')
+
+
+async def websocket_application(scope, receive, send):
+    """
+    ASGI app for WEBSOCKET_PATH: sends the user's events as JSON text frames.
+
+    ``?since=<id>`` replays remembered events first. Messages from the client
+    are ignored; sending and reading still go through the normal views.
+    """
+    from django.http import QueryDict
+
+    await receive()  # websocket.connect
+    headers = _headers(scope)
+    user_id = await sync_to_async(_user_id)(headers) if _same_origin(headers) else None
+    if scope['path'] != WEBSOCKET_PATH or user_id is None:
+        await send({'type': 'websocket.close', 'code': 4403})
+        return
+    await send({'type': 'websocket.accept'})
+
+    channels = await sync_to_async(user_channels)(user_id)
+    since = QueryDict(scope.get('query_string', b'').decode()).get('since', '')
+
+    async def forward():
+        async for event in stream(channels, int(since) if since.isdigit() else None):
+            await send({'type': 'websocket.send', 'text': json.dumps(event)})
+
+    forwarding = asyncio.ensure_future(forward())
+    try:
+        while (await receive())['type'] != 'websocket.disconnect':
+            pass
+    finally:
+        forwarding.cancel()
+        # Let the stream unsubscribe before returning
+        await asyncio.gather(forwarding, return_exceptions=True)
@@ -0,0 +1,257 @@
+"""
+Resized copies ("renditions") of uploaded photos.
+
+Each upload is rendered once, at each width of the SPECS its model uses, in
+every one of FORMATS: WebP for browsers that take it, JPEG for the rest. The
+files sit next to the original, in a folder of their own (room_images/flat.jpg
+gives room_images/renditions/flat.jpg/card_400.webp and so on), so their URLs
+follow from the original's name without a query and can never clash with
+another upload. An ImageRendition row records each file.
+The source model's flag (see SOURCES) says whether its current upload has
+been rendered; until it is, templates fall back to the original.
+Identical uploads share one stored original (see core/storage.py), so they
+share its renditions too: the second is not rendered again, and the files go
+only once no row uses the original.
+
+Alongside the renditions, each upload gets a placeholder: a PLACEHOLDER_EDGE
+pixel JPEG stored on the source row as a data: URI of a few hundred bytes.
+Cards paint it as the background of a lazy-loaded <img>, so a page of cards
+shows every photo's colours from the HTML alone.
+
+Uploads are rendered by a background job (render_upload, see core/jobs.py),
+not in the request. render() only touches files, so the build_renditions
+command can run it in worker processes; record() writes the rows, the
+placeholder and the flag.
+"""
+import base64
+import posixpath
+from collections import namedtuple
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from . import jobs
+
+Spec = namedtuple('Spec', 'widths aspect sizes')
+Source = namedtuple('Source', 'field flag placeholder kinds')
+
+# Widths rendered for each kind; ``aspect`` (width, height) crops to fill,
+# None keeps the original shape. ``sizes`` is the matching <img sizes>.
+SPECS = {
+    'card': Spec((400, 800), (3, 2), '(min-width: 992px) 33vw, (min-width: 768px) 50vw, 100vw'),
+    'detail': Spec((800, 1600), None, '(min-width: 992px) 66vw, 100vw'),
+    'avatar': Spec((80, 160), (1, 1), '80px'),
+}
+
+# (extension, Pillow format, MIME type), best first
+FORMATS = (
+    ('webp', 'WEBP', 'image/webp'),
+    ('jpg', 'JPEG', 'image/jpeg'),
+)
+
+QUALITY = 80
+
+# Longest edge of a placeholder, and its JPEG quality
+PLACEHOLDER_EDGE = 16
+PLACEHOLDER_QUALITY = 50
+
+# Fields of each model with photos, and the kinds rendered for it
+SOURCES = {
+    'roomimage': Source('image', 'renditions_ready', 'placeholder', ('card', 'detail')),
+    'profile': Source('profile_photo', 'photo_renditions_ready', 'photo_placeholder', ('avatar',)),
+}
+
+
+def source_of(instance):
+    """The image field file of a RoomImage or Profile, and whether it has been rendered."""
+    source = SOURCES[instance._meta.model_name]
+    return getattr(instance, source.field), getattr(instance, source.flag)
+
+
+def placeholder_of(instance):
+    return getattr(instance, SOURCES[instance._meta.model_name].placeholder)
+
+
+def rendition_name(source_name, kind, width, ext):
+    folder, filename = posixpath.split(source_name)
+    return posixpath.join(folder, 'renditions', filename, f'{kind}_{width}.{ext}')
+
+
+def url(source_name, kind, width, ext):
+    return default_storage.url(rendition_name(source_name, kind, width, ext))
+
+
+def srcset(source_name, kind, ext):
+    return ', '.join(
+        f'{url(source_name, kind, width, ext)} {width}w' for width in SPECS[kind].widths
+    )
+
+
+def _resize(image, spec, width):
+    if spec.aspect:
+        height = round(width * spec.aspect[1] / spec.aspect[0])
+        # Never upscale; a small original gives a smaller file under the same name
+        scale = min(1, image.width / width, image.height / height)
+        return ImageOps.fit(image, (max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+    copy = image.copy()
+    copy.thumbnail((width, width * 4), Image.LANCZOS)
+    return copy
+
+
+def make_placeholder(image):
+    """A tiny blurry version of ``image`` as a data: URI."""
+    small = image.copy()
+    small.thumbnail((PLACEHOLDER_EDGE, PLACEHOLDER_EDGE), Image.BILINEAR)
+    buffer = BytesIO()
+    small.save(buffer, 'JPEG', quality=PLACEHOLDER_QUALITY)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def render(source_name, kinds, image=None):
+    """
+    Write every rendition of ``source_name`` for ``kinds``, replacing old
+    ones. Returns the rows and the placeholder for record(). Decodes the
+    original once, or not at all when the caller already has it decoded as
+    ``image``.
+    """
+    if image is None:
+        with default_storage.open(source_name) as original:
+            image = ImageOps.exif_transpose(Image.open(original))
+    image = image.convert('RGB')
+    rows = []
+    for kind in kinds:
+        spec = SPECS[kind]
+        for width in spec.widths:
+            resized = _resize(image, spec, width)
+            for ext, pil_format, _ in FORMATS:
+                buffer = BytesIO()
+                resized.save(buffer, pil_format, quality=QUALITY, optimize=True)
+                name = rendition_name(source_name, kind, width, ext)
+                # Keep the predictable name rather than letting storage pick a new one
+                if default_storage.exists(name):
+                    default_storage.delete(name)
+                default_storage.save(name, ContentFile(buffer.getvalue()))
+                rows.append({
+                    'kind': kind, 'width': width, 'format': ext, 'file': name,
+                    'pixel_width': resized.width, 'pixel_height': resized.height,
+                    'bytes': buffer.tell(),
+                })
+    return rows, make_placeholder(image)
+
+
+def record(model, pk, source_name, rows, placeholder):
+    """Store what render() returned and mark the instance as rendered."""
+    from .models import ImageRendition
+
+    source = SOURCES[model._meta.model_name]
+    with transaction.atomic():
+        ImageRendition.objects.bulk_create(
+            [ImageRendition(source=source_name, **row) for row in rows],
+            update_conflicts=True,
+            unique_fields=['source', 'kind', 'width', 'format'],
+            update_fields=['file', 'pixel_width', 'pixel_height', 'bytes'],
+        )
+        # Only if the upload was not replaced meanwhile
+        model.objects.filter(pk=pk, **{source.field: source_name}).update(
+            **{source.flag: True, source.placeholder: placeholder}
+        )
+
+
+def start_upload(instance):
+    """
+    Call before saving. If a new file was uploaded, clears the rendered flag
+    and returns the name of the file it replaces ('' for none); else None.
+    """
+    fieldfile, _ = source_of(instance)
+    if not fieldfile or fieldfile._committed:
+        return None
+    source = SOURCES[instance._meta.model_name]
+    setattr(instance, source.flag, False)
+    setattr(instance, source.placeholder, '')
+    if not instance.pk:
+        return ''
+    return type(instance).objects.filter(pk=instance.pk).values_list(source.field, flat=True).first() or ''
+
+
+def finish_upload(instance, previous):
+    """
+    Call after saving with what start_upload() returned: queues the new file
+    to be rendered by a worker (see core/jobs.py).
+    """
+    if previous is None:
+        return
+    fieldfile, _ = source_of(instance)
+    if previous != fieldfile.name:
+        discard(previous)
+    jobs.enqueue(render_upload, instance._meta.model_name, instance.pk, fieldfile.name)
+
+
+@jobs.job(priority=jobs.HIGH)
+def render_upload(model_name, pk, source_name):
+    """
+    Job: build the renditions of an upload, unless it has been replaced since.
+    An unreadable file fails the job, which is logged and retried; pages keep
+    serving the original meanwhile.
+    """
+    from django.apps import apps
+
+    source = SOURCES[model_name]
+    instance = apps.get_model('core', model_name).objects.filter(pk=pk, **{source.field: source_name}).first()
+    if instance is not None:
+        build(instance)
+
+
+def build(instance, image=None):
+    """Render and record ``instance``'s current upload."""
+    from .models import ImageRendition
+
+    fieldfile, _ = source_of(instance)
+    source = SOURCES[instance._meta.model_name]
+    model = type(instance)
+    rows, placeholder = [], None
+    # The same photo may have been uploaded and rendered before (see core/storage.py)
+    expected = len(FORMATS) * sum(len(SPECS[kind].widths) for kind in source.kinds)
+    if ImageRendition.objects.filter(source=fieldfile.name).count() == expected:
+        placeholder = (
+            model.objects.filter(**{source.field: fieldfile.name}).exclude(**{source.placeholder: ''})
+            .values_list(source.placeholder, flat=True).first()
+        )
+    if not placeholder:
+        rows, placeholder = render(fieldfile.name, source.kinds, image)
+    record(type(instance), instance.pk, fieldfile.name, rows, placeholder)
+    setattr(instance, source.flag, True)
+    setattr(instance, source.placeholder, placeholder)
+
+
+def in_use(source_name):
+    """Whether any row still has ``source_name`` as its photo."""
+    from django.apps import apps
+
+    return any(
+        apps.get_model('core', model_name).objects.filter(**{source.field: source_name}).exists()
+        for model_name, source in SOURCES.items()
+    )
+
+
+def discard(source_name):
+    """Delete the renditions of an original once no row uses it."""
+    from .models import ImageRendition
+
+    if source_name and not in_use(source_name):
+        # Their files are removed by a worker (see core/storage.py)
+        ImageRendition.objects.filter(source=source_name).delete()
+
+
+def pick(instance, kind, width):
+    """URL of the narrowest JPEG rendition at least ``width`` wide, else the original's."""
+    fieldfile, ready = source_of(instance)
+    if not fieldfile:
+        return None
+    if not ready:
+        return fieldfile.url
+    widths = SPECS[kind].widths
+    chosen = next((w for w in widths if w >= width), widths[-1])
+    return url(fieldfile.name, kind, chosen, 'jpg')
@@ -0,0 +1,176 @@
+"""
+Full-text search for rooms and profiles.
+
+SQLite keeps an FTS5 virtual table per model and ranks matches with bm25();
+Postgres keeps a side table with a GIN-indexed tsvector and ranks with
+ts_rank_cd(). Both tables are keyed by the model's primary key and kept in
+sync by the save/delete signals in core/models.py. Any other database falls
+back to the old icontains filters.
+"""
+import re
+
+from django.db import connection
+from django.db.models import F, FloatField, Func, Q, Value
+from django.db.models.expressions import RawSQL
+
+# At most this many words from the query are used.
+MAX_QUERY_TERMS = 8
+
+# Upper bound on names suggested by a typeahead.
+TYPEAHEAD_LIMIT = 10
+
+# Indexed columns per model. The first column is weighted highest.
+SEARCH_INDEXES = {
+    'room': {
+        'table': 'core_room_search',
+        'fields': ('title', 'description', 'city'),
+        'weights': (10.0, 1.0, 5.0),
+    },
+    'profile': {
+        'table': 'core_profile_search',
+        'fields': ('name', 'city', 'state', 'bio', 'neighborhood'),
+        'weights': (10.0, 5.0, 2.0, 1.0, 2.0),
+    },
+}
+
+
+def search_backend(conn=None):
+    """Return 'fts5', 'postgres' or None for the given connection."""
+    vendor = (conn or connection).vendor
+    if vendor == 'sqlite':
+        return 'fts5'
+    if vendor == 'postgresql':
+        return 'postgres'
+    return None
+
+
+def query_terms(query):
+    """Split free text into at most MAX_QUERY_TERMS lowercase word tokens."""
+    return re.findall(r'\w+', (query or '').lower())[:MAX_QUERY_TERMS]
+
+
+def name_key(name):
+    """Lowercase words of a name joined by single spaces; stored as Profile.name_key."""
+    return ' '.join(re.findall(r'\w+', (name or '').lower()))
+
+
+# --- Index maintenance ---
+def _document_rows(index, instances):
+    return [
+        [instance.pk] + [str(getattr(instance, field) or '') for field in index['fields']]
+        for instance in instances
+    ]
+
+
+def index_instances(model_name, instances):
+    """Insert or replace the search rows for a batch of instances."""
+    backend = search_backend()
+    index = SEARCH_INDEXES[model_name]
+    rows = _document_rows(index, instances)
+    if backend is None or not rows:
+        return
+    table = index['table']
+    with connection.cursor() as cursor:
+        if backend == 'fts5':
+            cursor.executemany(f"DELETE FROM {table} WHERE rowid = %s", [[row[0]] for row in rows])
+            placeholders = ', '.join(['%s'] * len(rows[0]))
+            cursor.executemany(
+                f"INSERT INTO {table} (rowid, {', '.join(index['fields'])}) VALUES ({placeholders})",
+                rows,
+            )
+        else:
+            # Weight the first column 'A' and the rest 'B'.
+            cursor.executemany(
+                f"INSERT INTO {table} (id, document) VALUES ("
+                f"%s, setweight(to_tsvector('english', %s), 'A') || to_tsvector('english', %s)) "
+                f"ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document",
+                [[row[0], row[1], ' '.join(row[2:])] for row in rows],
+            )
+
+
+def index_instance(instance):
+    """Insert or replace the search row for one Room or Profile."""
+    index_instances(instance._meta.model_name, [instance])
+
+
+def remove_instance(instance):
+    """Delete the search row for one Room or Profile."""
+    backend = search_backend()
+    if backend is None:
+        return
+    table = SEARCH_INDEXES[instance._meta.model_name]['table']
+    key = 'rowid' if backend == 'fts5' else 'id'
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {key} = %s", [instance.pk])
+
+
+def clear_index(model_name):
+    """Empty the search table for a model before a rebuild."""
+    if search_backend() is None:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_INDEXES[model_name]['table']}")
+
+
+# --- Querying ---
+class SearchRank(Func):
+    """
+    Rank of the outer row's match, lower is better, as a correlated subquery
+    on the search table. ``sql`` holds ``{pk}`` for the outer primary key and
+    one %s for the match expression. The primary key goes through F('pk') so
+    it follows the outer query's table alias.
+    """
+    output_field = FloatField()
+
+    def __init__(self, sql, match):
+        super().__init__(F('pk'))
+        self.sql, self.match = sql, match
+
+    def as_sql(self, compiler, connection, **extra_context):
+        pk_sql, pk_params = compiler.compile(self.source_expressions[0])
+        return self.sql.format(pk=pk_sql), [self.match, *pk_params]
+
+
+def _match_sql(backend, index, terms):
+    """(match expression, SQL selecting matching ids, rank SQL for SearchRank)."""
+    table = index['table']
+    if backend == 'fts5':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(str(w) for w in index['weights'])
+        ids = f"SELECT rowid FROM {table} WHERE {table} MATCH %s"
+        rank = f"(SELECT bm25({table}, {weights}) FROM {table} WHERE {table} MATCH %s AND rowid = {{pk}})"
+    else:
+        match = ' & '.join(f'{term}:*' for term in terms)
+        ids = f"SELECT id FROM {table} WHERE document @@ to_tsquery('english', %s)"
+        # Negated so that, as with bm25(), lower is better
+        rank = f"(SELECT -ts_rank_cd(document, to_tsquery('english', %s)) FROM {table} WHERE id = {{pk}})"
+    return match, ids, rank
+
+
+def apply_search(queryset, query):
+    """
+    Restrict a Room or Profile queryset to full-text matches for ``query``.
+
+    Matches are annotated with ``search_rank`` (lower is better) and ordered
+    by it, with the primary key breaking ties. The ranking happens in the
+    database over every match, so views page through it with the keyset
+    ordering ('search_rank', 'id') and nothing is cut off.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return queryset
+
+    index = SEARCH_INDEXES[queryset.model._meta.model_name]
+    backend = search_backend()
+    if backend is None:
+        condition = Q()
+        for field in index['fields']:
+            condition |= Q(**{f'{field}__icontains': query})
+        return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    match, ids, rank = _match_sql(backend, index, terms)
+    return (
+        queryset.filter(pk__in=RawSQL(ids, [match]))
+        .annotate(search_rank=SearchRank(rank, match))
+        .order_by('search_rank', 'pk')
+    )
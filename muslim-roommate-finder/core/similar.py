@@ -0,0 +1,119 @@
+"""
+"Similar profiles" for the profile detail page.
+
+Candidates are the other profiles in the same metro area (City.metro), ranked
+by how many preferences they share with the profile, then by age proximity
+and same city. Each profile's list is cached along with the version of its
+metro at the time. A profile save bumps its metro's version only when one of
+DEPENDS_ON changed, so the save on every login leaves the lists alone.
+The detail page fetches the list and the current version in one get_many()
+and recomputes only when they disagree.
+"""
+import hashlib
+import uuid
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+
+# Profiles shown on the detail page
+SIMILAR_LIMIT = 3
+
+# Seconds a cached list may live even if nothing changes
+CACHE_TIMEOUT = 60 * 60 * 24
+
+# Preferences compared between profiles; each shared one is worth one point
+SHARED_FIELDS = ('only_eats_zabihah', 'prayer_friendly', 'guests_allowed', 'is_looking_for_room')
+
+# Profile fields the lists depend on: those compute() ranks by, and those the
+# detail page shows of each similar profile
+DEPENDS_ON = ('canonical_city', 'age', 'name', 'gender', 'bio', *SHARED_FIELDS)
+
+# Age gap at which the age bonus (worth under one preference) reaches zero
+AGE_RANGE = 20.0
+
+
+def _list_key(profile_id):
+    return f'similar:{profile_id}'
+
+
+def _version_key(metro):
+    # Metro names have spaces and commas, which some cache backends refuse in keys
+    return f'similar:metro:{hashlib.md5(metro.encode()).hexdigest()}'
+
+
+def snapshot(profile):
+    """The DEPENDS_ON values of a Profile, to compare before and after a save."""
+    opts = profile._meta
+    return tuple(getattr(profile, opts.get_field(name).attname) for name in DEPENDS_ON)
+
+
+def metro_of(profile):
+    city = profile.canonical_city
+    return city.metro if city else None
+
+
+def invalidate(*metros):
+    """Mark every cached list in these metros stale once the transaction commits."""
+    def bump():
+        cache.set_many({_version_key(metro): uuid.uuid4().hex for metro in metros if metro}, None)
+    transaction.on_commit(bump)
+
+
+def invalidate_cities(*city_ids):
+    """invalidate() the metros of these City ids."""
+    from .models import City
+
+    city_ids = {pk for pk in city_ids if pk}
+    if city_ids:
+        invalidate(*City.objects.filter(pk__in=city_ids).values_list('metro', flat=True).distinct())
+
+
+def compute(profile, limit=SIMILAR_LIMIT):
+    """The ``limit`` most similar profiles in ``profile``'s metro, best first."""
+    from .models import Profile
+
+    metro = metro_of(profile)
+    if not metro:
+        return []
+    candidates = Profile.objects.filter(canonical_city__metro=metro).exclude(pk=profile.pk)
+    rows = list(candidates.values_list('pk', 'age', 'canonical_city', *SHARED_FIELDS))
+    if not rows:
+        return []
+
+    columns = np.array(rows, dtype=np.float64)
+    shared = sum(
+        (columns[:, 3 + i] == bool(getattr(profile, field))).astype(float)
+        for i, field in enumerate(SHARED_FIELDS)
+    )
+    if profile.age is None:
+        age_bonus = np.zeros(len(rows))
+    else:
+        age_bonus = np.nan_to_num(np.clip(1 - np.abs(columns[:, 1] - profile.age) / AGE_RANGE, 0, 1)) * 0.9
+    same_city = (columns[:, 2] == (profile.canonical_city_id or 0)) * 0.05
+    scores = shared + age_bonus + same_city
+
+    order = np.lexsort((columns[:, 0], -scores))[:limit]
+    ids = [int(columns[i, 0]) for i in order]
+    found = Profile.objects.for_cards().in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
+
+
+def similar_profiles(profile):
+    """Cached compute(): one cache round trip when the list is current."""
+    metro = metro_of(profile)
+    if not metro:
+        return []
+    list_key, version_key = _list_key(profile.pk), _version_key(metro)
+    cached = cache.get_many([list_key, version_key])
+    version = cached.get(version_key)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.add(version_key, version, None)
+        version = cache.get(version_key, version)
+    elif list_key in cached and cached[list_key][0] == version:
+        return cached[list_key][1]
+
+    profiles = compute(profile)
+    cache.set(list_key, (version, profiles), CACHE_TIMEOUT)
+    return profiles
@@ -0,0 +1,162 @@
+"""
+Content-addressed media storage.
+
+Files uploaded straight into one of ``addressed_dirs`` (room_images/,
+profile_photos/) are named after the SHA-256 of their bytes:
+room_images/3f/3f9c...e1.jpg. Uploading the same photo twice therefore
+stores it once. A file's bytes can never change under its name, so its URL
+may be cached forever, and so may the URLs of its renditions, which are
+named after it (see is_cacheable_forever()).
+
+Shared files are reference counted in MediaBlob. Every save() of a blob
+adds a reference and every delete() drops one; the file goes only with the
+last reference.
+
+Other names, such as renditions (room_images/3f/renditions/...) and
+files stored before this backend, are kept as given and deleted as usual.
+
+Rows do not delete their files themselves. When a photo or rendition row is
+deleted, or its file replaced, delete_later() records the name in a
+MediaDeletion row inside the same transaction, so deleting a room or profile
+commits at once however many photos it had. A worker then removes the files
+in batches (purge_deleted). Each file is removed in the same transaction that
+drops its row, so after a crash the worker resumes where it stopped, and a
+blob's reference is never dropped twice.
+
+This replaces django-cleanup, so the worker (its own service on Render,
+see render.yaml) must use the web server's database and reach its
+MEDIA_ROOT.
+"""
+import hashlib
+import posixpath
+import re
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+from . import jobs
+
+# Rows read per pass of purge_deleted(), and seconds deletes gather before it runs
+PURGE_BATCH = 500
+PURGE_DELAY = 30
+
+_ADDRESSED_NAME = re.compile(r'(^|/)([0-9a-f]{2})/\2[0-9a-f]{62}\.[a-z0-9]+$')
+# A rendition of a blob (see core/renditions.py), made from the blob's bytes alone
+_ADDRESSED_RENDITION = re.compile(r'(^|/)([0-9a-f]{2})/renditions/\2[0-9a-f]{62}\.[a-z0-9]+/[^/]+$')
+
+
+def is_immutable(name):
+    """Whether ``name`` is a content-addressed blob, whose bytes never change."""
+    return bool(_ADDRESSED_NAME.search(name))
+
+
+def is_cacheable_forever(name):
+    """Whether ``name``'s URL may be cached forever: a blob or one of its renditions."""
+    return is_immutable(name) or bool(_ADDRESSED_RENDITION.search(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def __init__(self, addressed_dirs=(), **kwargs):
+        super().__init__(**kwargs)
+        self.addressed_dirs = tuple(d.strip('/') for d in addressed_dirs)
+
+    def _digest(self, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        return digest.hexdigest()
+
+    def _addressed(self, name):
+        return posixpath.dirname(name) in self.addressed_dirs
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not self._addressed(name):
+            return super().save(name, content, max_length)
+        from .models import MediaBlob
+
+        digest = self._digest(content)
+        folder, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        name = posixpath.join(folder, digest[:2], digest + extension)
+        with transaction.atomic():
+            if MediaBlob.objects.filter(name=name).update(references=F('references') + 1):
+                return name
+            # First copy: write it, unless a crashed save left the file behind
+            if not self.exists(name):
+                name = self._save(name, content)
+            try:
+                with transaction.atomic():
+                    MediaBlob.objects.create(name=name, size=content.size, references=1)
+            except IntegrityError:
+                # Someone stored the same bytes at the same moment
+                MediaBlob.objects.filter(name=name).update(references=F('references') + 1)
+        return name
+
+    def delete(self, name):
+        from .models import MediaBlob
+
+        if not is_immutable(name):
+            return super().delete(name)
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.references > 1:
+                MediaBlob.objects.filter(pk=blob.pk).update(references=F('references') - 1)
+                return
+            if blob is not None:
+                blob.delete()
+        super().delete(name)
+
+
+def file_names(instance):
+    """Names of the files held by ``instance``'s file fields."""
+    return [
+        getattr(instance, field.attname).name
+        for field in instance._meta.fields
+        if isinstance(field, models.FileField) and getattr(instance, field.attname)
+    ]
+
+
+def delete_later(names):
+    """Queue files for removal by a worker, once the current transaction commits."""
+    from .models import MediaDeletion
+
+    names = [name for name in names if name]
+    if not names:
+        return
+    MediaDeletion.objects.bulk_create([MediaDeletion(name=name) for name in names])
+    jobs.enqueue_once(purge_deleted, delay=PURGE_DELAY)
+
+
+def _referenced(name):
+    """Whether a row holds ``name`` again, e.g. a rendition rebuilt since it was queued."""
+    from .models import ImageRendition
+    from . import renditions
+
+    return renditions.in_use(name) or ImageRendition.objects.filter(file=name).exists()
+
+
+@jobs.job(priority=jobs.LOW)
+def purge_deleted():
+    """Job: remove the files queued by delete_later(), PURGE_BATCH rows at a time."""
+    from .models import MediaDeletion
+
+    while True:
+        batch = list(MediaDeletion.objects.order_by('pk')[:PURGE_BATCH])
+        if not batch:
+            return
+        for deletion in batch:
+            with transaction.atomic():
+                if not MediaDeletion.objects.filter(pk=deletion.pk).delete()[0]:
+                    # Another worker got it first
+                    continue
+                # Blobs keep count of their own references
+                if is_immutable(deletion.name) or not _referenced(deletion.name):
+                    default_storage.delete(deletion.name)
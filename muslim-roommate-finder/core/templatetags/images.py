@@ -0,0 +1,49 @@
+"""
+Template helpers for photo renditions (see core/renditions.py).
+
+    {% load images %}
+    {% picture room.primary_image 'card' alt='Room image' css_class='card-img-top' %}
+    <img src="..." srcset="{{ room.primary_image|srcset:'card' }}">
+"""
+from django import template
+
+from core import renditions
+
+register = template.Library()
+
+
+@register.inclusion_tag('partials/picture.html')
+def picture(instance, kind, alt='', css_class='', style='', loading='lazy'):
+    """
+    A <picture> with WebP and JPEG srcsets for ``kind``, or a plain <img> of
+    the original until rendered. The stored placeholder is painted behind
+    the image until it loads; pass loading='eager' for images above the fold.
+    """
+    fieldfile, ready = renditions.source_of(instance)
+    spec = renditions.SPECS[kind]
+    context = {
+        'alt': alt, 'css_class': css_class, 'style': style, 'loading': loading,
+        'src': fieldfile.url if fieldfile else '',
+        'placeholder': renditions.placeholder_of(instance),
+    }
+    if spec.aspect:
+        # Reserves the box before the image arrives; CSS still sets the display size
+        context['width'], context['height'] = spec.widths[0], round(spec.widths[0] * spec.aspect[1] / spec.aspect[0])
+    if fieldfile and ready:
+        *best, (fallback_ext, _, _) = renditions.FORMATS
+        context.update({
+            'sources': [(mime, renditions.srcset(fieldfile.name, kind, ext)) for ext, _, mime in best],
+            'srcset': renditions.srcset(fieldfile.name, kind, fallback_ext),
+            'sizes': spec.sizes,
+            'src': renditions.url(fieldfile.name, kind, spec.widths[0], fallback_ext),
+        })
+    return context
+
+
+@register.filter
+def srcset(instance, kind):
+    """JPEG srcset of ``instance``'s renditions for ``kind``; empty until rendered."""
+    fieldfile, ready = renditions.source_of(instance)
+    if not (fieldfile and ready):
+        return ''
+    return renditions.srcset(fieldfile.name, kind, renditions.FORMATS[-1][0])
@@ -1,3 +1,1739 @@
-from django.test import TestCase
+import base64
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from config.asgi import application as asgi_application
+
+from . import (
+    cities, conversations, facets, geo, jobs, matching, realtime, renditions, search, similar, storage, uploads, views,
+)
+from .models import (
+    Amenity, City, Conversation, ConversationParticipant, ImageRendition, Job, LocationFacet, MediaBlob, MediaDeletion,
+    Message, Profile, ProfileMatch, Room, RoomImage, RoommateProfile, RoomType, validate_room_image,
+)
+from .pagination import KeysetPaginator, decode_cursor
+
+
+def make_profile(username, **fields):
+    """The Profile made for a new User, with ``fields`` set and saved."""
+    profile = User.objects.create(username=username).profile
+    fields.setdefault('name', username)
+    fields.setdefault('gender', 'male')
+    fields.setdefault('is_looking_for_room', True)
+    for name, value in fields.items():
+        setattr(profile, name, value)
+    profile.save()
+    return profile
+
+
+def jpeg(color='red', name='photo.jpg'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (640, 480), color).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+def run_jobs():
+    """Run every queued job now, delayed ones included; returns (succeeded, failed)."""
+    Job.objects.update(available_at=timezone.now())
+    return jobs.work(burst=True)
+
+
+class TemporaryMediaMixin:
+    """Store uploads under a MEDIA_ROOT of their own, removed after the test."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.media_root = media_root
+
+    def stored(self, name):
+        return os.path.exists(os.path.join(self.media_root, name))
+
+
+def make_room(profile, title, **fields):
+    fields.setdefault('description', 'A quiet room close to the masjid. ' * 3)
+    fields.setdefault('city', profile.city)
+    fields.setdefault('price', 900)
+    return Room.objects.create(user=profile, title=title, **fields)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.ahmed = make_profile('ahmed', name='Ahmed Hassan', city='New York', bio='Graduate student who prays')
+        self.omar = make_profile('omar', name='Omar', city='Chicago', bio='Engineer looking for rooms')
+        self.brooklyn = make_room(self.ahmed, 'Cozy room in Brooklyn', city='New York')
+        self.chicago = make_room(self.omar, 'Modern Chicago room', description='Near Brooklyn Ave. ' * 5)
+
+    def test_title_matches_rank_first(self):
+        rooms = search.apply_search(Room.objects.all(), 'brooklyn')
+        self.assertEqual(list(rooms), [self.brooklyn, self.chicago])
+
+    def test_stems_and_prefixes(self):
+        self.assertEqual(search.apply_search(Room.objects.all(), 'rooms').count(), 2)
+        self.assertEqual(list(search.apply_search(Profile.objects.all(), 'stud')), [self.ahmed])
+
+    def test_keeps_queryset_filters(self):
+        profiles = Profile.objects.filter(city='Chicago')
+        self.assertFalse(search.apply_search(profiles, 'stud').exists())
+        self.assertFalse(search.apply_search(Room.objects.none(), 'brooklyn').exists())
+
+    def test_index_follows_saves_and_deletes(self):
+        self.brooklyn.title = 'Sunny room in Queens'
+        self.brooklyn.save()
+        self.assertEqual(list(search.apply_search(Room.objects.all(), 'queens')), [self.brooklyn])
+        self.omar.user.delete()
+        self.assertFalse(search.apply_search(Room.objects.all(), 'chicago').exists())
+
+    def test_rebuild_command(self):
+        call_command('rebuild_search_index', batch_size=1)
+        self.assertEqual(list(search.apply_search(Room.objects.all(), 'cozy')), [self.brooklyn])
+
+    def test_pages_through_every_match_in_rank_order(self):
+        rooms = [make_room(self.omar, f'Room {i}', description='Brooklyn ' * (i % 4 + 1) + 'filler ' * 20) for i in range(25)]
+        ranked = list(search.apply_search(Room.objects.all(), 'brooklyn'))
+        self.assertEqual(len(ranked), 27)
+        self.assertEqual(ranked[0], self.brooklyn)
+        ranks = [room.search_rank for room in ranked]
+        self.assertEqual(ranks, sorted(ranks))
+
+        paginator = KeysetPaginator(search.apply_search(Room.objects.all(), 'brooklyn'), ('search_rank', 'id'), per_page=4)
+        page, seen = paginator.get_page(None), []
+        while True:
+            seen += list(page)
+            if not page.has_next:
+                break
+            page = paginator.get_page(page.next_cursor)
+        self.assertEqual(seen, ranked)
+        self.assertEqual(set(seen) - {self.brooklyn, self.chicago}, set(rooms))
+
+    def test_searched_queryset_works_as_a_subquery(self):
+        matches = search.apply_search(Room.objects.all(), 'brooklyn')
+        self.assertEqual(Room.objects.filter(pk__in=matches.values('pk')).count(), 2)
+
+    def test_views(self):
+        response = self.client.get('/advanced-search/?search=chicago')
+        self.assertContains(response, 'Modern Chicago room')
+        self.assertNotContains(response, 'Cozy room')
+        for url in ['/?search=brooklyn', '/profiles/?search=omar', '/profiles/?search=omar&sort=name']:
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+
+class KeysetPaginationTests(TestCase):
+    ORDERINGS = [('-created_at', '-id'), ('created_at', 'id'), ('name', 'id'), ('age', 'id'), ('-age', '-id')]
+
+    def setUp(self):
+        # Repeated names and ages, and some NULLs, so pages split ties
+        for i in range(23):
+            make_profile(f'user{i}', name='ABC'[i % 3], age=[None, 20, 30, 40][i % 4])
+        Profile.objects.filter(pk__in=Profile.objects.order_by('pk')[:4].values('pk')).update(created_at=None)
+
+    def expected(self, ordering):
+        return list(Profile.objects.order_by(*[
+            F(name[1:]).desc(nulls_last=True) if name.startswith('-') else F(name).asc(nulls_last=True)
+            for name in ordering
+        ]).values_list('pk', flat=True))
+
+    def test_walks_forward_then_back(self):
+        for ordering in self.ORDERINGS:
+            paginator = KeysetPaginator(Profile.objects.all(), ordering, 5)
+            page = paginator.get_page(None)
+            pages = [[p.pk for p in page]]
+            while page.has_next:
+                page = paginator.get_page(page.next_cursor)
+                pages.append([p.pk for p in page])
+            self.assertEqual(sum(pages, []), self.expected(ordering), ordering)
+
+            back = []
+            while page.has_previous:
+                page = paginator.get_page(page.previous_cursor)
+                back.append([p.pk for p in page])
+            self.assertEqual(back, pages[-2::-1], ordering)
+
+    def test_cursor_of_another_sort_starts_over(self):
+        first = KeysetPaginator(Profile.objects.all(), ('name', 'id'), 5).get_page(None)
+        self.assertEqual(decode_cursor(first.next_cursor)[2], ['name', 'id'])
+        other = KeysetPaginator(Profile.objects.all(), ('-age', '-id'), 5)
+        self.assertEqual(list(other.get_page(first.next_cursor)), list(other.get_page(None)))
+
+    def test_seek_past_the_end_leads_back(self):
+        ordering = ('name', 'id')
+        paginator = KeysetPaginator(Profile.objects.all(), ordering, 5)
+        page = paginator.get_page(None)
+        while page.has_next:
+            last_full, page = page, paginator.get_page(page.next_cursor)
+        # The last page's rows go away after its cursor was handed out
+        Profile.objects.filter(pk__in=[p.pk for p in page]).delete()
+        page = paginator.get_page(last_full.next_cursor)
+        self.assertEqual((list(page), page.has_next), ([], False))
+        back = paginator.get_page(page.previous_cursor)
+        self.assertEqual([p.pk for p in back], self.expected(ordering)[-5:])
+        self.assertFalse(back.has_next)
+        self.assertTrue(back.has_previous)
+
+    def test_seek_before_the_start_leads_forward(self):
+        paginator = KeysetPaginator(Profile.objects.all(), ('-age', '-id'), 5)
+        second = paginator.get_page(paginator.get_page(None).next_cursor)
+        Profile.objects.filter(pk__in=self.expected(('-age', '-id'))[:5]).delete()
+        page = paginator.get_page(second.previous_cursor)
+        self.assertEqual((list(page), page.has_previous), ([], False))
+        self.assertEqual(list(paginator.get_page(page.next_cursor)), list(paginator.get_page(None)))
+
+    def test_views(self):
+        response = self.client.get('/profiles/?sort=age_oldest')
+        self.assertEqual(response.context['total_profiles'], 23)
+        cursor = response.context['page_obj'].next_cursor
+        response = self.client.get('/profiles/', {'sort': 'age_oldest', 'cursor': cursor})
+        self.assertTrue(response.context['page_obj'].has_previous)
+        response = self.client.get('/profiles/', {'sort': 'name', 'cursor': cursor})
+        self.assertFalse(response.context['page_obj'].has_previous)
+        self.assertEqual(self.client.get('/profiles/?cursor=garbage').status_code, 200)
+
+
+class HomeFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = make_profile('owner', name='Khadija', city='Chicago')
+        self.rooms = [make_room(self.owner, f'Room {i}') for i in range(views.HOME_PAGE_SIZE * 2 + 3)]
+        for i in range(5):
+            make_profile(f'seeker{i}', name=f'Seeker {i}', city='Chicago')
+
+    def test_first_page_is_bounded(self):
+        response = self.client.get('/')
+        page = response.context['available_rooms']
+        self.assertEqual(len(page), views.HOME_PAGE_SIZE)
+        self.assertEqual(response.context['rooms_count'], len(self.rooms))
+        self.assertEqual(list(page), self.rooms[::-1][:views.HOME_PAGE_SIZE])
+        self.assertContains(response, page.next_cursor)
+
+    def test_load_more_walks_the_rest_once(self):
+        page = self.client.get('/').context['available_rooms']
+        shown, cursor = [room.pk for room in page], page.next_cursor
+        while cursor:
+            data = self.client.get('/', {'fragment': 'rooms', 'cursor': cursor}).json()
+            # Each card links to its room once from the title
+            shown += [int(pk) for pk in dict.fromkeys(re.findall(r'href="/rooms/(\d+)/"', data['html']))]
+            cursor = data['next_cursor']
+        self.assertEqual(shown, [room.pk for room in reversed(self.rooms)])
+
+    def test_profile_fragment_keeps_the_filters(self):
+        data = self.client.get('/', {'fragment': 'profiles', 'search': 'seeker 3'}).json()
+        self.assertIn('Seeker 3', data['html'])
+        self.assertNotIn('Seeker 1', data['html'])
+        self.assertIsNone(data['next_cursor'])
+
+
+class CardQueryTests(TestCase):
+    URLS = ['/', '/profiles/', '/advanced-search/', '/my-listings/']
+
+    def setUp(self):
+        self.viewer = make_profile('viewer', city='Detroit')
+        self.shared = make_room(self.viewer, 'Shared flat')
+        self.client.force_login(self.viewer.user)
+        self.room_type = RoomType.objects.create(name='Private room')
+        self.amenities = [Amenity.objects.create(name=name) for name in ('Wifi', 'Parking', 'Laundry')]
+        self.add_listings(2)
+
+    def add_listings(self, count):
+        start = Room.objects.count()
+        for i in range(start, start + count):
+            owner = make_profile(f'owner{i}', city='Detroit', bio='Works nights')
+            room = make_room(owner, f'Listing {i}', room_type=self.room_type)
+            room.amenities.set(self.amenities[:i % 3 + 1])
+            RoomImage.objects.create(room=room, image=f'room_images/listing{i}.jpg')
+            RoomImage.objects.create(room=room, image=f'room_images/listing{i}b.jpg', is_primary=True)
+            make_room(self.viewer, f'Mine {i}', room_type=self.room_type).amenities.set(self.amenities)
+
+    def queries(self, url):
+        # The first visit also stores the viewer's matches; measure a later one
+        self.client.get(url)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+        return len(queries)
+
+    def test_list_pages_do_not_query_per_card(self):
+        before = {url: self.queries(url) for url in self.URLS}
+        self.add_listings(6)
+        self.assertEqual({url: self.queries(url) for url in self.URLS}, before)
+
+    def test_inbox_does_not_query_per_conversation(self):
+        others = Profile.objects.exclude(pk=self.viewer.pk)
+        Message.objects.create(sender=others[0], recipient=self.viewer, content='Salaam')
+        before = self.queries('/inbox/')
+        for other in others[1:]:
+            Message.objects.create(sender=self.viewer, recipient=other, content='Is it still free?')
+        self.assertEqual(self.queries('/inbox/'), before)
+
+    def test_cards_show_the_joined_rows(self):
+        response = self.client.get('/my-listings/')
+        self.assertContains(response, 'Mine 1')
+        rooms = list(Room.objects.for_cards().filter(title='Listing 1'))
+        with self.assertNumQueries(0):
+            room = rooms[0]
+            self.assertEqual(room.primary_image.image.name, 'room_images/listing1b.jpg')
+            self.assertEqual((room.user.name, room.room_type.name), ('owner1', 'Private room'))
+            self.assertEqual(len(room.amenities.all()), 2)
+
+
+class RoomImageStatsTests(TestCase):
+    def setUp(self):
+        self.owner = make_profile('landlord', city='Houston')
+        self.room = make_room(self.owner, 'Two bedroom near the mosque')
+
+    def stats(self, room=None):
+        return Room.objects.filter(pk=(room or self.room).pk).values_list('primary_image', 'image_count').get()
+
+    def add(self, name, room=None, **fields):
+        return RoomImage.objects.create(room=room or self.room, image=f'room_images/{name}.jpg', **fields)
+
+    def test_first_image_is_primary(self):
+        self.assertEqual(self.stats(), (None, 0))
+        front = self.add('front')
+        self.add('kitchen')
+        self.assertEqual(self.stats(), (front.pk, 2))
+
+    def test_choosing_another_primary(self):
+        self.add('front')
+        garden = self.add('garden', is_primary=True)
+        self.assertEqual(self.stats(), (garden.pk, 2))
+        self.assertEqual(RoomImage.objects.filter(is_primary=True).count(), 1)
+
+    def test_deleting_the_primary_falls_back_to_the_oldest(self):
+        front, kitchen = self.add('front'), self.add('kitchen')
+        garden = self.add('garden', is_primary=True)
+        garden.delete()
+        self.assertEqual(self.stats(), (front.pk, 2))
+        RoomImage.objects.filter(pk__in=[front.pk, kitchen.pk]).delete()
+        self.assertEqual(self.stats(), (None, 0))
+
+    def test_deleting_the_room_takes_its_images(self):
+        self.add('front')
+        self.room.delete()
+        self.assertFalse(RoomImage.objects.exists())
+
+    def test_backfill_repairs_drifted_rows(self):
+        other = make_room(self.owner, 'Basement studio')
+        front = self.add('front')
+        studio = [self.add(f'studio{i}', room=other) for i in range(3)]
+        Room.objects.update(primary_image=None, image_count=7)
+        call_command('backfill_room_images', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(self.stats(), (front.pk, 1))
+        self.assertEqual(self.stats(other), (studio[0].pk, 3))
+
+
+class FacetRegistryTests(TestCase):
+    def setUp(self):
+        # The registry's version lives in the cache, which outlives each test
+        cache.clear()
+
+    def profile(self, username, city, state):
+        with self.captureOnCommitCallbacks(execute=True):
+            return make_profile(username, city=city, state=state)
+
+    def test_counts_follow_saves_and_deletes(self):
+        first = self.profile('first', 'Chicago', 'IL')
+        second = self.profile('second', ' Chicago ', 'IL')
+        self.assertEqual(facets.get_facet('profile_city'), [('Chicago', 2)])
+        with self.captureOnCommitCallbacks(execute=True):
+            second.city, second.state = 'Austin', 'TX'
+            second.save()
+            make_room(first, 'Loft')
+        self.assertEqual(facets.get_facet('profile_city'), [('Austin', 1), ('Chicago', 1)])
+        self.assertEqual(facets.get_facet('profile_state'), [('IL', 1), ('TX', 1)])
+        self.assertEqual(facets.values('room_city'), ['Chicago'])
+        with self.captureOnCommitCallbacks(execute=True):
+            first.user.delete()
+        self.assertEqual(facets.values('profile_city'), ['Austin'])
+        self.assertEqual(facets.values('room_city'), [])
+
+    def test_readers_query_only_after_a_change(self):
+        self.profile('first', 'Dearborn', 'MI')
+        facets.values('profile_city')
+        with self.assertNumQueries(0):
+            self.assertEqual(facets.values('profile_city'), ['Dearborn'])
+        # Another process changing a facet bumps the shared version
+        cache.set(facets.VERSION_KEY, 'elsewhere', None)
+        with self.assertNumQueries(1):
+            facets.values('profile_city')
+
+    def test_rebuild_matches_the_running_counts(self):
+        for i, city in enumerate(['Dearborn', 'Dearborn', 'Hamtramck', '']):
+            self.profile(f'p{i}', city, 'MI')
+        running = list(LocationFacet.objects.order_by('kind', 'value').values_list('kind', 'value', 'count'))
+        LocationFacet.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_facets', stdout=io.StringIO())
+        rebuilt = list(LocationFacet.objects.order_by('kind', 'value').values_list('kind', 'value', 'count'))
+        self.assertEqual(rebuilt, running)
+        self.assertIn(('profile_city', 'Dearborn', 2), rebuilt)
+
+    def test_dropdowns_read_the_registry(self):
+        self.profile('first', 'Hamtramck', 'MI')
+        response = self.client.get('/profiles/')
+        self.assertEqual(list(response.context['cities']), ['Hamtramck'])
+
+
+class CanonicalCityTests(TestCase):
+    def test_spellings_and_aliases_share_a_city(self):
+        nyc = make_profile('nyc', city='NYC')
+        new_york = make_profile('new_york', city='new york')
+        self.assertEqual(nyc.canonical_city_id, new_york.canonical_city_id)
+        self.assertEqual(nyc.canonical_city.name, 'New York')
+        self.assertEqual(make_profile('louis', city='st louis', state='MO').canonical_city.name, 'St. Louis')
+
+    def test_state_picks_between_same_names(self):
+        self.assertEqual(len(cities.lookup('Columbus')), 2)
+        self.assertEqual(make_profile('georgia', city='Columbus', state='Georgia').canonical_city.state, 'GA')
+        # The first seeded one when nothing says which
+        self.assertEqual(make_profile('ohio', city='Columbus').canonical_city.state, 'OH')
+
+    def test_unknown_names_stay_as_typed(self):
+        before = City.objects.count()
+        profile = make_profile('small', city='Smallvile', state='KS')
+        self.assertIsNone(profile.canonical_city)
+        self.assertEqual(City.objects.count(), before)
+        self.assertEqual(list(cities.unresolved(Profile)), [{'city': 'Smallvile', 'rows': 1}])
+
+    def test_partial_text_falls_back_to_prefix_then_substring(self):
+        self.assertEqual(cities.lookup('colum'), cities.lookup('Columbus'))
+        self.assertIn(City.objects.get(key='new york').pk, cities.lookup('york'))
+        self.assertEqual(cities.lookup('colum', partial=False), [])
+        self.assertEqual(cities.lookup('  '), [])
+
+    def test_city_filter(self):
+        owner = make_profile('owner', city='Manhattan')
+        typo = make_profile('typo', city='Smallvile')
+        manhattan = make_room(owner, 'Manhattan room')
+        smallvile = make_room(typo, 'Smallvile room')
+        self.assertEqual(list(Room.objects.filter(cities.city_filter('nyc'))), [manhattan])
+        self.assertEqual(list(Room.objects.filter(cities.city_filter('smallvile'))), [smallvile])
+        response = self.client.get('/advanced-search/?city=New York')
+        self.assertEqual(list(response.context['rooms']), [manhattan])
+
+    def test_backfill_attaches_rows_once_a_city_exists(self):
+        profile = make_profile('small', city='Smallvile', state='KS')
+        City.objects.create(name='Smallville', key='smallville', state='KS', aliases='Smallvile')
+        cities.backfill(Profile, City, 'state', only_missing=True)
+        self.assertEqual(Profile.objects.get(pk=profile.pk).canonical_city.name, 'Smallville')
+
+
+class RadiusSearchTests(TestCase):
+    def setUp(self):
+        self.dallas = make_profile('dallas', city='Dallas', state='TX')
+        self.fort_worth = make_profile('fort_worth', city='Fort Worth', state='TX')
+        # Not a known city, so placed by its ZIP code (Plano)
+        self.plano = make_profile('plano', city='Somewhere', state='TX', zip_code='75024')
+        self.houston = make_profile('houston', city='Houston', state='TX')
+        for profile in (self.dallas, self.fort_worth, self.houston):
+            make_room(profile, profile.name)
+
+    def test_haversine(self):
+        [miles] = geo.haversine_miles(40.7128, -74.0060, [34.0522], [-118.2437])
+        self.assertAlmostEqual(miles, 2445, delta=10)
+
+    def test_located_by_city_or_zip(self):
+        self.assertIsNotNone(self.dallas.latitude)
+        self.assertAlmostEqual(self.plano.latitude, 33.0198)
+
+    def test_apply_radius_orders_by_distance(self):
+        rooms = geo.apply_radius(Room.objects.all(), 29.76, -95.37, 400)
+        self.assertEqual([room.title for room in rooms], ['houston', 'dallas', 'fort_worth'])
+        rooms = geo.apply_radius(Room.objects.all(), 29.76, -95.37, 50)
+        self.assertEqual([room.title for room in rooms], ['houston'])
+
+    def test_pages_by_distance(self):
+        rooms = geo.apply_radius(Room.objects.all(), 29.76, -95.37, 400)
+        paginator = KeysetPaginator(rooms, ('distance_miles', 'id'), 1)
+        page, seen = paginator.get_page(None), []
+        while True:
+            seen += [room.title for room in page]
+            if not page.has_next:
+                break
+            page = paginator.get_page(page.next_cursor)
+        self.assertEqual(seen, ['houston', 'dallas', 'fort_worth'])
+
+    def test_sql_distance_matches_haversine(self):
+        rooms = geo.apply_radius(Room.objects.all(), 29.76, -95.37, 400)
+        expected = geo.haversine_miles(29.76, -95.37, [room.latitude for room in rooms], [room.longitude for room in rooms])
+        for room, miles in zip(rooms, expected):
+            self.assertAlmostEqual(room.distance_miles, miles, places=6)
+
+    def test_keeps_every_row_in_range(self):
+        for i in range(30):
+            make_room(self.houston, f'extra {i}')
+        rooms = geo.apply_radius(Room.objects.all(), self.houston.latitude, self.houston.longitude, 5)
+        self.assertEqual(rooms.count(), 31)
+        self.assertEqual(geo.apply_radius(Room.objects.filter(title='dallas'), 29.76, -95.37, 5).count(), 0)
+
+    def test_views(self):
+        self.client.force_login(self.dallas.user)
+        response = self.client.get('/?radius=50')
+        self.assertEqual([p.name for p in response.context['profiles']], ['plano', 'fort_worth'])
+        response = self.client.get('/advanced-search/?radius=300&near=77002')
+        self.assertEqual([room.title for room in response.context['rooms']], ['houston', 'dallas', 'fort_worth'])
+        for radius in ('nan', 'inf', '-inf'):
+            response = self.client.get(f'/advanced-search/?radius={radius}&near=77002')
+            self.assertEqual(response.status_code, 200, radius)
+
+
+class CompatibilityScoringTests(TestCase):
+    def setUp(self):
+        prefs = {'age': 28, 'only_eats_zabihah': True, 'prayer_friendly': True, 'guests_allowed': False}
+        self.me = make_profile('me', city='Dallas', state='TX', **prefs)
+        self.twin = make_profile('twin', city='Dallas', state='TX', **prefs)
+        self.neighbour = make_profile('neighbour', city='Fort Worth', state='TX', **prefs)
+        self.older = make_profile('older', city='Dallas', state='TX', **dict(prefs, age=48))
+        self.unknown_age = make_profile('unknown_age', city='Dallas', state='TX', **dict(prefs, age=None))
+        self.sister = make_profile('sister', gender='female', city='Dallas', state='TX', **prefs)
+
+    def scores(self, budget=None):
+        columns = matching.load_columns(Profile.objects.all())
+        scores = matching.score_columns(self.me, columns, budget)
+        return {Profile.objects.get(pk=pk).name: score for pk, score in zip(columns['pk'].tolist(), scores.tolist())}
+
+    def test_components(self):
+        scores = self.scores()
+        # Neither side gave a budget, so that component scores UNKNOWN_SCORE
+        self.assertEqual(scores['twin'], 100 - matching.WEIGHTS['budget'] * (1 - matching.UNKNOWN_SCORE))
+        self.assertEqual(scores['older'], scores['twin'] - matching.WEIGHTS['age'])
+        self.assertEqual(scores['unknown_age'], scores['twin'] - matching.WEIGHTS['age'] * matching.UNKNOWN_SCORE)
+        # About 30 miles apart: part of the location weight
+        self.assertLess(scores['twin'] - matching.WEIGHTS['location'], scores['neighbour'])
+        self.assertLess(scores['neighbour'], scores['twin'])
+
+    def test_other_gender_and_self_score_zero(self):
+        scores = self.scores()
+        self.assertEqual((scores['sister'], scores['me']), (0, 0))
+
+    def test_budgets_compare(self):
+        RoommateProfile.objects.create(profile=self.twin, budget=1000)
+        RoommateProfile.objects.create(profile=self.neighbour, budget=2500)
+        scores = self.scores(budget=1000)
+        self.assertEqual(scores['twin'], 100)
+        self.assertEqual(scores['older'], 100 - matching.WEIGHTS['age'] - matching.WEIGHTS['budget'] * matching.UNKNOWN_SCORE)
+
+    def test_rooms_score_against_the_budget(self):
+        cheap = make_room(self.twin, 'Cheap', price=800, only_eats_zabihah=True, prayer_friendly=True, guests_allowed=False)
+        dear = make_room(self.twin, 'Dear', price=1500, only_eats_zabihah=True, prayer_friendly=True, guests_allowed=False)
+        mine = make_room(self.me, 'Mine', price=800, only_eats_zabihah=True, prayer_friendly=True, guests_allowed=False)
+        columns = matching.load_room_columns(Room.objects.order_by('pk'))
+        scores = dict(zip(columns['pk'].tolist(), matching.score_room_columns(self.me, columns, 1000).tolist()))
+        # 50% over budget leaves nothing of the budget weight
+        self.assertEqual((scores[cheap.pk], scores[dear.pk]), (100, 100 - matching.ROOM_WEIGHTS['budget']))
+        self.assertEqual(scores[mine.pk], 0)
+
+    def test_top_keeps_the_best_positive_scores(self):
+        pks = np.arange(1, 7)
+        scores = np.array([10.0, 0.0, 70.0, 55.55, 90.0, 0.0])
+        self.assertEqual(sorted(matching._top(pks, scores, k=2)), [(3, 70.0), (5, 90.0)])
+        self.assertEqual(sorted(matching._top(pks, scores, k=10)), [(1, 10.0), (3, 70.0), (4, 55.5), (5, 90.0)])
+
+
+class StoredMatchTests(TestCase):
+    def setUp(self):
+        with self.refreshed():
+            austin = {'city': 'Austin', 'state': 'TX'}
+            self.me = make_profile('me', age=30, prayer_friendly=True, guests_allowed=True, **austin)
+            self.close = make_profile('close', age=31, prayer_friendly=True, guests_allowed=True, **austin)
+            # Same city but too far apart otherwise to count as a match
+            self.fair = make_profile('fair', age=44, guests_allowed=False, **austin)
+            self.away = make_profile('away', city='Boston', state='MA', age=30, prayer_friendly=True, guests_allowed=True)
+
+    @contextlib.contextmanager
+    def refreshed(self):
+        """Run the refresh jobs queued by the saves inside the block."""
+        with self.captureOnCommitCallbacks(execute=True):
+            yield
+        run_jobs()
+
+    def stored(self, profile):
+        rows = ProfileMatch.objects.filter(profile=profile, room=None).order_by('-score', 'pk')
+        return [row.matched_profile.name for row in rows]
+
+    def test_saves_store_each_profiles_best_matches(self):
+        self.assertEqual(self.stored(self.me), ['close', 'away', 'fair'])
+        self.assertEqual(Profile.objects.get(pk=self.me.pk).match_count, 2)
+        self.assertFalse(ProfileMatch.objects.filter(profile=self.me, matched_profile=self.me).exists())
+
+    def test_scored_change_reorders_the_neighbourhood(self):
+        with self.refreshed():
+            self.fair.age, self.fair.prayer_friendly, self.fair.guests_allowed = 30, True, True
+            self.fair.save()
+        self.assertEqual(ProfileMatch.objects.get(profile=self.me, matched_profile=self.fair).score,
+                         ProfileMatch.objects.get(profile=self.me, matched_profile=self.close).score)
+
+    def test_unscored_saves_queue_nothing(self):
+        Job.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.me.bio = 'Software engineer, early riser'
+            self.me.save()
+            self.me.user.save()
+        self.assertFalse(Job.objects.exists())
+
+    def test_rooms_are_stored_for_others_only(self):
+        with self.refreshed():
+            room = make_room(self.close, 'Room off Riverside', prayer_friendly=True)
+        self.assertTrue(ProfileMatch.objects.filter(profile=self.me, room=room).exists())
+        self.assertFalse(ProfileMatch.objects.filter(profile=self.close, room=room).exists())
+        with self.refreshed():
+            room.delete()
+        self.assertFalse(ProfileMatch.objects.filter(room__isnull=False).exists())
+
+    def test_deleted_profiles_leave_the_lists(self):
+        with self.refreshed():
+            self.away.user.delete()
+        self.assertEqual(self.stored(self.me), ['close', 'fair'])
+
+    def test_computed_on_first_view_when_missing(self):
+        ProfileMatch.objects.all().delete()
+        Profile.objects.update(match_count=None)
+        self.client.force_login(self.me.user)
+        response = self.client.get('/profiles/?sort=match')
+        self.assertEqual(response.context['total_matches'], 2)
+        self.assertEqual([profile.name for profile in response.context['profiles']][:3], ['close', 'away', 'fair'])
+
+    def test_count_reaches_past_the_stored_top(self):
+        for i in range(matching.TOP_K + 2):
+            make_profile(f'twin{i}', city='Austin', state='TX', age=30, prayer_friendly=True, guests_allowed=True)
+        matching.refresh_matches([self.me.pk])
+        self.assertEqual(ProfileMatch.objects.filter(profile=self.me, room=None).count(), matching.TOP_K)
+        self.assertEqual(Profile.objects.get(pk=self.me.pk).match_count, matching.TOP_K + 4)
+
+    def test_rebuild_command(self):
+        expected = self.stored(self.me)
+        ProfileMatch.objects.all().delete()
+        call_command('rebuild_matches', workers=1, chunk_size=2, stdout=io.StringIO())
+        self.assertEqual(self.stored(self.me), expected)
+
+
+class SimilarProfilesTests(TestCase):
+    def setUp(self):
+        # Lists and metro versions live in the cache, keyed by reused ids
+        cache.clear()
+        prefs = {'state': 'TX', 'only_eats_zabihah': True, 'prayer_friendly': True, 'guests_allowed': False}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.me = make_profile('me', city='Dallas', age=26, **prefs)
+            self.plano = make_profile('plano', city='Plano', age=27, **prefs)
+            self.irving = make_profile('irving', city='Irving', age=45, **prefs)
+            self.frisco = make_profile('frisco', city='Frisco', age=26, **dict(prefs, prayer_friendly=False))
+            self.garland = make_profile('garland', city='Garland', age=26, guests_allowed=True, state='TX')
+            self.houston = make_profile('houston', city='Houston', age=26, **prefs)
+
+    def names(self, profile=None):
+        return [p.name for p in similar.similar_profiles(profile or self.me)]
+
+    def test_ranks_the_metro_by_shared_preferences_then_age(self):
+        self.assertEqual(City.objects.get(key='plano').metro, City.objects.get(key='dallas').metro)
+        self.assertEqual(self.names(), ['plano', 'irving', 'frisco'])
+        self.assertNotIn('houston', self.names(self.plano))
+
+    def test_current_lists_come_from_the_cache(self):
+        self.names()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(), ['plano', 'irving', 'frisco'])
+
+    def test_ranked_changes_refresh_the_metro(self):
+        self.names()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.garland.only_eats_zabihah = self.garland.prayer_friendly = True
+            self.garland.guests_allowed = False
+            self.garland.save()
+        self.assertEqual(self.names(), ['garland', 'plano', 'irving'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plano.city = 'Houston'
+            self.plano.save()
+        self.assertEqual(self.names(), ['garland', 'irving', 'frisco'])
+
+    def test_other_saves_keep_the_lists(self):
+        self.names()
+        key = similar._version_key(City.objects.get(key='dallas').metro)
+        version = cache.get(key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plano.user.save()
+            Profile.objects.get(pk=self.plano.pk).save()
+        self.assertEqual(cache.get(key), version)
+
+    def test_profiles_without_a_known_city(self):
+        stray = make_profile('stray', city='Nowhere Springs', state='TX')
+        self.assertEqual(self.names(stray), [])
+        response = self.client.get(f'/profile/{stray.pk}/')
+        self.assertEqual(response.context['similar_profiles'], [])
+        response = self.client.get(f'/profile/{self.me.pk}/')
+        self.assertEqual([p.name for p in response.context['similar_profiles']], ['plano', 'irving', 'frisco'])
+
+
+class AreaFilterTests(TestCase):
+    def setUp(self):
+        self.portland_or = make_profile('portland_or', city='Portland', state='Oregon', zip_code='97201')
+        self.portland_me = make_profile('portland_me', city=' portland', state='ME')
+        self.saint_paul = make_profile('saint_paul', city='St. Paul', state='mn', zip_code=' 55101 ')
+        self.nowhere = make_profile('nowhere', city='', state='')
+
+    def names(self, **criteria):
+        return sorted(profile.name for profile in Profile.objects.in_area(**criteria))
+
+    def test_city_and_state_spellings(self):
+        self.assertEqual(self.names(cities=['portland']), ['portland_me', 'portland_or'])
+        self.assertEqual(self.names(cities=['Portland'], state='OR'), ['portland_or'])
+        self.assertEqual(self.names(cities=['Saint Paul']), ['saint_paul'])
+        self.assertEqual(self.names(state='minnesota'), ['saint_paul'])
+        self.assertEqual(self.names(state='Atlantis'), [])
+
+    def test_zip_codes_and_no_criteria(self):
+        self.assertEqual(self.names(zip_codes=[97201, '55101']), ['portland_or', 'saint_paul'])
+        # Profiles without any location are never in an area
+        self.assertEqual(self.names(), ['portland_me', 'portland_or', 'saint_paul'])
+
+    def test_runs_as_one_indexed_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.names(cities=['Portland'], state='ME'), ['portland_me'])
+        sql = str(Profile.objects.in_area(cities=['Portland'], state='ME').query)
+        self.assertIn('"city_key" IN', sql)
+        self.assertIn('"state_code" =', sql)
+
+    def test_single_object_form_agrees(self):
+        criteria = [{'cities': ['Portland'], 'state': 'ME'}, {'state': 'OR'}, {'zip_codes': ['55101']}, {}]
+        for profile in Profile.objects.all():
+            for kwargs in criteria:
+                expected = Profile.objects.in_area(**kwargs).filter(pk=profile.pk).exists()
+                self.assertEqual(profile.is_in_area(**kwargs), expected, (profile.name, kwargs))
+
+    def test_state_filter_view(self):
+        response = self.client.get('/profiles/', {'state': 'Maine'})
+        self.assertEqual([profile.name for profile in response.context['profiles']], ['portland_me'])
+
+
+class ConversationThreadTests(TestCase):
+    def setUp(self):
+        self.tenant = make_profile('tenant', name='Bilal')
+        self.landlord = make_profile('landlord', name='Hamza', city='Minneapolis')
+        self.room = make_room(self.landlord, 'Room by the park')
+
+    def test_both_directions_share_one_thread(self):
+        first = Message.objects.create(sender=self.tenant, recipient=self.landlord, content='Salaam')
+        reply = Message.objects.create(sender=self.landlord, recipient=self.tenant, content='Wa alaikum salaam')
+        self.assertEqual(first.conversation_id, reply.conversation_id)
+        conversation = reply.conversation
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.last_message_id, conversation.last_activity), (reply.pk, reply.timestamp))
+        participants = ConversationParticipant.objects.filter(conversation=conversation)
+        self.assertEqual(set(participants.values_list('last_activity', flat=True)), {reply.timestamp})
+
+    def test_room_threads_are_separate_until_the_room_goes(self):
+        general = Message.objects.create(sender=self.tenant, recipient=self.landlord, content='Hello')
+        about_room = conversations.get_or_start(self.tenant.pk, self.landlord.pk, self.room.pk)
+        Message.objects.create(
+            sender=self.tenant, recipient=self.landlord, content='Is it free?', conversation=about_room
+        )
+        self.assertNotEqual(general.conversation_id, about_room.pk)
+        self.room.delete()
+        conversation = Conversation.objects.get()
+        self.assertEqual((conversation.pk, conversation.messages.count()), (general.conversation_id, 2))
+        self.assertEqual(conversation.last_message.content, 'Is it free?')
+        self.assertEqual(ConversationParticipant.objects.get(profile=self.landlord).unread_count, 2)
+
+    def test_one_thread_without_a_room_per_pair(self):
+        conversations.get_or_start(self.tenant.pk, self.landlord.pk)
+        first, second = sorted([self.tenant, self.landlord], key=lambda profile: profile.pk)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Conversation.objects.create(first_profile=first, second_profile=second)
+
+    def test_deleting_messages_moves_the_last_message(self):
+        first = Message.objects.create(sender=self.tenant, recipient=self.landlord, content='One')
+        second = Message.objects.create(sender=self.tenant, recipient=self.landlord, content='Two')
+        second.delete()
+        self.assertEqual(Conversation.objects.get().last_message_id, first.pk)
+        first.delete()
+        self.assertFalse(Conversation.objects.exists())
+
+    def test_inbox_pages_by_latest_activity(self):
+        others = [make_profile(f'friend{i}') for i in range(conversations.INBOX_PAGE_SIZE + 2)]
+        for other in others:
+            Message.objects.create(sender=other, recipient=self.tenant, content=f'From {other.name}')
+        self.client.force_login(self.tenant.user)
+        page = self.client.get('/inbox/').context['conversations']
+        self.assertEqual([row.other_id for row in page], [other.pk for other in reversed(others)][:len(page)])
+        data = self.client.get('/inbox/', {'fragment': 'conversations', 'cursor': page.next_cursor}).json()
+        self.assertIn(f'From {others[0].name}', data['html'])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_thread_loads_older_messages_in_pages(self):
+        for i in range(conversations.THREAD_PAGE_SIZE + 5):
+            Message.objects.create(sender=self.landlord, recipient=self.tenant, content=f'Note {i:02}')
+        conversation = Conversation.objects.get()
+        self.client.force_login(self.tenant.user)
+        response = self.client.get(f'/inbox/{conversation.pk}/')
+        thread = response.context['thread']
+        self.assertEqual((len(thread), thread[-1].content), (conversations.THREAD_PAGE_SIZE, 'Note 34'))
+        data = self.client.get(
+            f'/inbox/{conversation.pk}/', {'fragment': 'messages', 'cursor': response.context['older_cursor']}
+        ).json()
+        self.assertIn('Note 00', data['html'])
+        self.assertNotIn('Note 05', data['html'])
+        self.assertIsNone(data['next_cursor'])
+
+
+class RecipientRulesTests(TestCase):
+    def setUp(self):
+        self.sender = make_profile('sender', name='Yusuf Karim')
+        self.ahmed = make_profile('ahmed', name='Ahmed Hassan')
+        self.ahmad = make_profile('ahmad', name="ahmad  O'Neil")
+        self.aisha = make_profile('aisha', name='Aisha Khan', gender='female')
+        self.client.force_login(self.sender.user)
+
+    def suggest(self, q):
+        return [result['name'] for result in self.client.get('/api/recipients/', {'q': q}).json()['results']]
+
+    def test_name_starts_with_ignores_case_and_punctuation(self):
+        self.assertEqual(list(Profile.objects.name_starts_with('AHM').order_by('name_key')), [self.ahmad, self.ahmed])
+        self.assertEqual(list(Profile.objects.name_starts_with("ahmad o'n")), [self.ahmad])
+        self.assertEqual(list(Profile.objects.name_starts_with('hassan')), [])
+        self.assertFalse(Profile.objects.name_starts_with(' - ').exists())
+
+    def test_typeahead_suggests_only_the_senders_gender(self):
+        self.assertEqual(self.suggest('a'), ["ahmad  O'Neil", 'Ahmed Hassan'])
+        self.assertEqual(self.suggest('ai'), [])
+        self.assertEqual(self.suggest('yus'), [])
+
+    def test_typeahead_is_capped(self):
+        for i in range(search.TYPEAHEAD_LIMIT + 3):
+            make_profile(f'abdul{i}', name=f'Abdul {i:02}')
+        self.assertEqual(len(self.suggest('abdul')), search.TYPEAHEAD_LIMIT)
+
+    def test_post_to_a_suggested_recipient_sends(self):
+        response = self.client.post('/compose/', {'recipient_id': self.ahmed.pk, 'content': 'Salaam'})
+        self.assertRedirects(response, '/inbox/', fetch_redirect_response=False)
+        self.assertTrue(Message.objects.filter(sender=self.sender, recipient=self.ahmed).exists())
+
+    def test_crafted_post_cannot_reach_another_gender_or_oneself(self):
+        for recipient_id in [self.aisha.pk, self.sender.pk, 'x', '']:
+            response = self.client.post('/compose/', {'recipient_id': recipient_id, 'content': 'Salaam'})
+            self.assertEqual(response.status_code, 200, recipient_id)
+        self.assertFalse(Message.objects.exists())
+
+    def test_compose_link_to_another_gender_is_refused(self):
+        response = self.client.get(f'/compose/{self.aisha.pk}/')
+        self.assertRedirects(response, '/inbox/', fetch_redirect_response=False)
+        self.client.post(f'/compose/{self.aisha.pk}/', {'recipient_id': self.aisha.pk, 'content': 'Salaam'})
+        self.assertFalse(Message.objects.exists())
+
+
+class ReadCursorTests(TestCase):
+    def setUp(self):
+        self.a = make_profile('a')
+        self.b = make_profile('b')
+        self.first = Message.objects.create(sender=self.a, recipient=self.b, content='Salaam')
+        self.second = Message.objects.create(sender=self.a, recipient=self.b, content='Is the room free?')
+        self.conversation = self.first.conversation
+
+    def participant(self, profile):
+        return ConversationParticipant.objects.get(conversation=self.conversation, profile=profile)
+
+    def test_counts_received_messages_past_the_cursor(self):
+        a, b = self.participant(self.a), self.participant(self.b)
+        self.assertEqual((a.unread_count, b.unread_count), (0, 2))
+        # Sending moves the sender's own cursor
+        self.assertEqual(a.last_read_id, self.second.pk)
+        self.assertEqual(conversations.unread_total(self.b.user_id), 2)
+
+    def test_replying_reads_the_thread(self):
+        reply = Message.objects.create(sender=self.b, recipient=self.a, content='It is')
+        a, b = self.participant(self.a), self.participant(self.b)
+        self.assertEqual((a.unread_count, b.unread_count, b.last_read_id), (1, 0, reply.pk))
+
+    def test_mark_read_never_moves_back(self):
+        conversations.mark_read(self.conversation.pk, self.b, self.second.pk)
+        self.assertEqual(conversations.mark_read(self.conversation.pk, self.b, self.first.pk), 0)
+        b = self.participant(self.b)
+        self.assertEqual((b.unread_count, b.last_read_id), (0, self.second.pk))
+        self.assertIsNotNone(b.last_read_at)
+
+    def test_mark_read_keeps_later_messages_unread(self):
+        conversations.mark_read(self.conversation.pk, self.b, self.first.pk)
+        self.assertEqual(self.participant(self.b).unread_count, 1)
+
+    def test_deleting_only_unread_messages_changes_the_count(self):
+        self.second.delete()
+        self.assertEqual(self.participant(self.b).unread_count, 1)
+        conversations.mark_read(self.conversation.pk, self.b, self.first.pk)
+        Message.objects.create(sender=self.a, recipient=self.b, content='Still there?')
+        self.first.delete()
+        self.assertEqual(self.participant(self.b).unread_count, 1)
+
+    def test_mark_all_read(self):
+        Message.objects.create(sender=make_profile('c'), recipient=self.b, content='Hello')
+        conversations.mark_all_read(self.b)
+        self.assertFalse(ConversationParticipant.objects.filter(profile=self.b, unread_count__gt=0).exists())
+
+    def test_viewing_a_thread_changes_nothing(self):
+        self.client.force_login(self.b.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/inbox/{self.conversation.pk}/?fragment=thread')
+        self.assertIn(f'data-read-up-to="{self.second.pk}"', response.json()['html'])
+        writes = [query['sql'] for query in queries if not query['sql'].startswith('SELECT')]
+        self.assertEqual(writes, [])
+        self.assertEqual(self.participant(self.b).unread_count, 2)
+
+    def test_posting_read_is_one_write(self):
+        self.client.force_login(self.b.user)
+        url = f'/inbox/{self.conversation.pk}/read/'
+        self.assertEqual(self.client.get(url).status_code, 405)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'up_to': self.second.pk})
+        self.assertEqual(response.json(), {'read': 2})
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1, updates)
+        self.assertEqual(self.participant(self.b).unread_count, 0)
+        response = self.client.get(f'/inbox/{self.conversation.pk}/?fragment=thread')
+        self.assertNotIn('data-read-up-to', response.json()['html'])
+
+    def test_read_stops_at_messages_of_the_conversation(self):
+        other = Message.objects.create(sender=make_profile('c'), recipient=self.b, content='Hello')
+        self.client.force_login(self.b.user)
+        url = f'/inbox/{self.conversation.pk}/read/'
+        self.assertEqual(self.client.post(url, {'up_to': other.pk}).json(), {'read': 2})
+        self.assertEqual(self.participant(self.b).last_read_id, self.second.pk)
+        self.assertEqual(self.client.post(url, {'up_to': 'x'}).json(), {'read': 0})
+        self.client.force_login(make_profile('d').user)
+        self.assertEqual(self.client.post(url, {'up_to': self.second.pk}).status_code, 404)
+
+
+class UnreadBadgeTests(TestCase):
+    def setUp(self):
+        # Badge totals are keyed by user id, which the test database reuses
+        cache.clear()
+        self.sender = make_profile('sender')
+        self.reader = make_profile('reader')
+        self.client.force_login(self.reader.user)
+
+    def send(self, content='Salaam'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(sender=self.sender, recipient=self.reader, content=content)
+
+    def test_page_views_serve_the_badge_from_the_cache(self):
+        self.send()
+        self.send()
+        self.client.get('/profiles/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/profiles/')
+        self.assertContains(response, '>2</span>')
+        self.assertFalse([query['sql'] for query in queries if 'conversationparticipant' in query['sql']])
+        with self.assertNumQueries(0):
+            self.assertEqual(conversations.unread_total(self.reader.user_id), 2)
+
+    def test_new_messages_adjust_the_cached_total(self):
+        self.assertEqual(conversations.unread_total(self.reader.user_id), 0)
+        message = self.send()
+        with self.assertNumQueries(0):
+            self.assertEqual(conversations.unread_total(self.reader.user_id), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            message.delete()
+        self.assertEqual(conversations.unread_total(self.reader.user_id), 0)
+
+    def test_reading_resets_the_total(self):
+        message = self.send()
+        self.assertEqual(conversations.unread_total(self.reader.user_id), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            conversations.mark_read(message.conversation_id, self.reader, message.pk)
+        self.assertEqual(conversations.unread_total(self.reader.user_id), 0)
+        self.assertEqual(self.client.get('/api/unread-count/').json(), {'unread': 0})
+
+    def test_anonymous_pages_skip_the_badge(self):
+        self.client.logout()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/profiles/')
+        self.assertFalse([query['sql'] for query in queries if 'conversationparticipant' in query['sql']])
+
+
+class RealtimeDeliveryTests(TestCase):
+    def setUp(self):
+        # A fresh broker and unread totals, so nothing carries over between tests
+        realtime.get_broker.cache_clear()
+        cache.clear()
+        self.sender = make_profile('sender')
+        self.reader = make_profile('reader')
+
+    def send(self, content='Salaam'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(sender=self.sender, recipient=self.reader, content=content)
+
+    def test_history_is_per_channel_and_bounded(self):
+        broker = realtime.get_broker()
+        self.assertEqual(broker.last_id(['a']), 0)
+        first = broker.publish('a', {'type': 'test'})
+        second = broker.publish('b', {'type': 'test'})
+        third = broker.publish('a', {'type': 'test'})
+        self.assertEqual([event['id'] for event in broker.history(['a', 'b'], first['id'])],
+                         [second['id'], third['id']])
+        self.assertEqual(broker.last_id(['a']), third['id'])
+        for _ in range(realtime.HISTORY_SIZE + 5):
+            broker.publish('a', {'type': 'test'})
+        self.assertEqual(len(broker.history(['a'], 0)), realtime.HISTORY_SIZE)
+
+    def test_ids_keep_rising_across_restarts(self):
+        before = realtime.InProcessBroker().publish('a', {'type': 'test'})
+        after = realtime.InProcessBroker().publish('a', {'type': 'test'})
+        self.assertGreater(after['id'], before['id'])
+        # Still exact as a JavaScript number
+        self.assertLess(after['id'], 2 ** 53)
+
+    def test_new_messages_reach_both_sides_with_their_unread_totals(self):
+        message = self.send('Is the room free?')
+        broker = realtime.get_broker()
+        [event] = broker.history([realtime.user_channel(self.reader.user_id)], 0)
+        self.assertEqual(
+            (event['type'], event['conversation'], event['message']['content'], event['unread']),
+            ('message', message.conversation_id, 'Is the room free?', 1),
+        )
+        [event] = broker.history([realtime.user_channel(self.sender.user_id)], 0)
+        self.assertEqual(event['unread'], 0)
+
+    def test_long_poll_returns_events_after_since(self):
+        self.client.force_login(self.reader.user)
+        self.assertEqual(self.client.get('/api/events/poll/').json(), {'events': [], 'last_id': 0})
+        self.send()
+        events = self.client.get('/api/events/poll/?since=0').json()['events']
+        self.assertEqual([event['type'] for event in events], ['message'])
+        self.assertEqual(self.client.get('/api/events/poll/').json()['last_id'], events[0]['id'])
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/events/poll/').status_code, 302)
+
+    def test_waiting_returns_the_next_event_or_nothing(self):
+        broker = realtime.get_broker()
+
+        async def wait():
+            publisher = threading.Timer(0.05, broker.publish, ['a', {'type': 'late'}])
+            publisher.start()
+            events = await realtime.wait_for_events(['a'], 0, timeout=2)
+            quiet = await realtime.wait_for_events(['b'], 0, timeout=0.05)
+            return events, quiet
+
+        events, quiet = async_to_sync(wait)()
+        self.assertEqual([event['type'] for event in events], ['late'])
+        self.assertEqual(quiet, [])
+        self.assertEqual(broker.subscribers, {})
+
+    def test_websocket_replays_then_forwards_events(self):
+        self.client.force_login(self.reader.user)
+        session = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        headers = [
+            (b'cookie', f'{settings.SESSION_COOKIE_NAME}={session}'.encode()),
+            (b'host', b'testserver'),
+            (b'origin', b'http://testserver'),
+        ]
+        scope = {'type': 'websocket', 'path': realtime.WEBSOCKET_PATH, 'query_string': b'since=0', 'headers': headers}
+        broker = realtime.get_broker()
+        channel = realtime.user_channel(self.reader.user_id)
+        broker.publish(channel, {'type': 'missed'})
+
+        async def connect(scope):
+            socket = ApplicationCommunicator(realtime.websocket_application, scope)
+            await socket.send_input({'type': 'websocket.connect'})
+            return socket, await socket.receive_output(2)
+
+        async def session_frames():
+            socket, reply = await connect(scope)
+            frames = [reply['type'], json.loads((await socket.receive_output(2))['text'])['type']]
+            broker.publish(channel, {'type': 'live'})
+            frames.append(json.loads((await socket.receive_output(2))['text'])['type'])
+            await socket.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await socket.wait(2)
+            return frames
+
+        self.assertEqual(async_to_sync(session_frames)(), ['websocket.accept', 'missed', 'live'])
+        self.assertEqual(broker.subscribers, {})
+        # Cross-site handshakes and anonymous sockets are refused
+        for refused in (headers[:2] + [(b'origin', b'http://elsewhere.example')], []):
+            _, reply = async_to_sync(connect)(dict(scope, headers=refused))
+            self.assertEqual(reply, {'type': 'websocket.close', 'code': 4403})
+
+
+class EventStreamTests(TransactionTestCase):
+    # The stream looks up the session on a connection of its own, so the
+    # test data has to be committed; keep the seeded cities across the flush
+    serialized_rollback = True
+
+    def setUp(self):
+        realtime.get_broker.cache_clear()
+        cache.clear()
+        self.sender = make_profile('sender', city='Dallas', state='TX')
+        self.reader = make_profile('reader', city='Dallas', state='TX')
+
+    def stream_scope(self, *headers):
+        """An ASGI scope for GET /api/events/ as the logged-in reader."""
+        self.client.force_login(self.reader.user)
+        session = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        return {
+            'type': 'http', 'method': 'GET', 'path': '/api/events/', 'query_string': b'', 'http_version': '1.1',
+            'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 5000),
+            'headers': [(b'cookie', f'{settings.SESSION_COOKIE_NAME}={session}'.encode()), (b'host', b'testserver'),
+                        *headers],
+        }
+
+    @staticmethod
+    async def chunk(response):
+        return (await response.receive_output(5))['body'].decode()
+
+    @staticmethod
+    async def close(response):
+        await response.send_input({'type': 'http.disconnect'})
+        await response.wait(5)
+
+    def test_stream_sends_messages_and_rooms_in_the_readers_city(self):
+        response = ApplicationCommunicator(asgi_application, self.stream_scope())
+
+        async def session():
+            await response.send_input({'type': 'http.request', 'body': b''})
+            start = await response.receive_output(5)
+            await sync_to_async(Message.objects.create)(sender=self.sender, recipient=self.reader, content='Salaam')
+            message = await self.chunk(response)
+            room = await sync_to_async(make_room)(self.sender, 'Room near the masjid')
+            listing = await self.chunk(response)
+            await self.close(response)
+            return start, message, room, listing
+
+        start, message, room, listing = async_to_sync(session)()
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'Content-Type', b'text/event-stream'), start['headers'])
+        self.assertIn((b'X-Accel-Buffering', b'no'), start['headers'])
+        self.assertTrue(message.startswith('id: '), message)
+        self.assertEqual(json.loads(message.split('data: ', 1)[1])['type'], 'message')
+        event = json.loads(listing.split('data: ', 1)[1])
+        self.assertEqual((event['type'], event['room']['id']), ('room', room.pk))
+        self.assertEqual(realtime.get_broker().subscribers, {})
+
+    def test_reconnecting_resumes_after_last_event_id(self):
+        broker = realtime.get_broker()
+        channel = realtime.user_channel(self.reader.user_id)
+        seen = broker.publish(channel, {'type': 'seen'})
+        missed = broker.publish(channel, {'type': 'missed'})
+        response = ApplicationCommunicator(
+            asgi_application, self.stream_scope((b'last-event-id', str(seen['id']).encode())),
+        )
+
+        async def resume():
+            await response.send_input({'type': 'http.request', 'body': b''})
+            await response.receive_output(5)
+            replayed = await self.chunk(response)
+            await self.close(response)
+            return replayed
+
+        self.assertEqual(async_to_sync(resume)(), realtime.format_sse(missed))
+        self.assertEqual(broker.subscribers, {})
+
+    def test_quiet_streams_get_heartbeats(self):
+        async def first_two():
+            events = realtime.stream(['quiet'], 0, heartbeat=0.05)
+            heartbeat = await events.__anext__()
+            realtime.get_broker().publish('quiet', {'type': 'late'})
+            event = await events.__anext__()
+            await events.aclose()
+            return heartbeat, event
+
+        heartbeat, event = async_to_sync(first_two)()
+        self.assertEqual(realtime.format_sse(heartbeat), ': heartbeat\n\n')
+        self.assertEqual(realtime.format_sse(event), f'id: {event["id"]}\ndata: {json.dumps(event)}\n\n')
+        self.assertEqual(realtime.get_broker().subscribers, {})
+
+    def test_reading_sends_receipts_to_both_sides(self):
+        message = Message.objects.create(sender=self.sender, recipient=self.reader, content='Salaam')
+        self.client.force_login(self.reader.user)
+        self.client.post(f'/inbox/{message.conversation_id}/read/', {'up_to': message.pk})
+        broker = realtime.get_broker()
+        receipt = broker.history([realtime.user_channel(self.sender.user_id)], 0)[-1]
+        self.assertEqual((receipt['type'], receipt['conversation'], receipt['reader'], receipt['up_to']),
+                         ('read', message.conversation_id, 'reader', message.pk))
+        own = broker.history([realtime.user_channel(self.reader.user_id)], 0)[-1]
+        self.assertEqual((own['type'], own['conversations'], own['unread']), ('read', [message.conversation_id], 0))
+
+
+class RenditionTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = make_profile('owner', city='Charleston', state='SC')
+        self.room = make_room(self.owner, 'Room')
+
+    def upload(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return RoomImage.objects.create(room=self.room, image=jpeg(**fields))
+
+    def test_originals_are_served_until_the_job_renders_them(self):
+        image = self.upload()
+        self.assertFalse(image.renditions_ready)
+        self.assertEqual(image.get_thumbnail_url(), image.image.url)
+        run_jobs()
+        image.refresh_from_db()
+        self.assertTrue(image.renditions_ready)
+        self.assertEqual(image.get_thumbnail_url((300, 200)),
+                         default_storage.url(f'{os.path.dirname(image.image.name)}/renditions/'
+                                             f'{os.path.basename(image.image.name)}/card_400.jpg'))
+        self.assertTrue(image.get_thumbnail_url((500, 200)).endswith('/card_800.jpg'))
+        # Wider than any rendition gets the widest
+        self.assertTrue(image.get_thumbnail_url((2000, 200)).endswith('/card_800.jpg'))
+
+    def test_each_width_and_format_is_rendered_without_upscaling(self):
+        image = self.upload()
+        run_jobs()
+        rows = {
+            (row.kind, row.width, row.format): row
+            for row in ImageRendition.objects.filter(source=image.image.name)
+        }
+        self.assertEqual(set(rows), {
+            (kind, width, ext) for kind in ('card', 'detail') for width in renditions.SPECS[kind].widths
+            for ext in ('webp', 'jpg')
+        })
+        self.assertTrue(all(self.stored(row.file.name) for row in rows.values()))
+        card = rows['card', 400, 'webp']
+        self.assertEqual((card.pixel_width, card.pixel_height), (400, 267))
+        # The 640x480 original is cropped to 3:2, never stretched to 800 wide
+        wide = rows['card', 800, 'jpg']
+        self.assertEqual((wide.pixel_width, wide.pixel_height), (640, 426))
+        detail = rows['detail', 1600, 'jpg']
+        self.assertEqual((detail.pixel_width, detail.pixel_height), (640, 480))
+        with default_storage.open(card.file.name) as stored:
+            self.assertEqual(Image.open(stored).format, 'WEBP')
+
+    def test_replacing_an_upload_renders_the_new_one(self):
+        image = self.upload()
+        run_jobs()
+        old = image.image.name
+        image.image = jpeg('blue', 'new.jpg')
+        with self.captureOnCommitCallbacks(execute=True):
+            image.save()
+        self.assertFalse(RoomImage.objects.get().renditions_ready)
+        self.assertFalse(ImageRendition.objects.filter(source=old).exists())
+        run_jobs()
+        self.assertEqual(ImageRendition.objects.filter(source=image.image.name).count(), 8)
+
+    def test_picture_tag_offers_webp_then_jpeg(self):
+        image = self.upload()
+        context = {'image': image}
+        template = Template("{% load images %}{% picture image 'card' alt='Room' css_class='card-img-top' %}")
+        self.assertNotIn('<picture>', template.render(Context(context)))
+        run_jobs()
+        image.refresh_from_db()
+        html = template.render(Context(context))
+        self.assertIn('<source type="image/webp" srcset="', html)
+        self.assertIn('/card_400.webp 400w', html)
+        self.assertIn('/card_800.jpg 800w', html)
+        self.assertIn('class="card-img-top"', html)
+
+    def test_profile_photos_get_avatars(self):
+        self.owner.profile_photo = jpeg(name='me.jpg')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.owner.save()
+        run_jobs()
+        self.owner.refresh_from_db()
+        self.assertTrue(self.owner.photo_renditions_ready)
+        self.assertEqual(
+            sorted(ImageRendition.objects.values_list('kind', 'width', 'pixel_width', 'pixel_height').distinct()),
+            [('avatar', 80, 80, 80), ('avatar', 160, 160, 160)],
+        )
+
+    def test_unreadable_uploads_fail_the_job(self):
+        image = self.upload()
+        with open(os.path.join(self.media_root, image.image.name), 'wb') as stored:
+            stored.write(b'not an image')
+        with self.assertLogs('core.jobs', 'ERROR'):
+            _, failed = run_jobs()
+        self.assertEqual(failed, 1)
+        self.assertFalse(RoomImage.objects.get().renditions_ready)
+        self.assertFalse(ImageRendition.objects.exists())
+
+    def test_command_renders_what_the_jobs_missed(self):
+        self.upload()
+        Job.objects.all().delete()
+        call_command('build_renditions', workers=1, stdout=io.StringIO())
+        self.assertTrue(RoomImage.objects.get().renditions_ready)
+        self.assertEqual(ImageRendition.objects.count(), 8)
+
+
+def photo(width, height, image_format='JPEG', name='photo.jpg', mode='RGB', orientation=None):
+    """An upload of a plain ``width`` x ``height`` image, optionally with an EXIF orientation."""
+    buffer = io.BytesIO()
+    options = {}
+    if orientation:
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        exif[0x010F] = 'Phone camera'
+        options['exif'] = exif.tobytes()
+    Image.new(mode, (width, height), 'red').save(buffer, image_format, **options)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class UploadIngestionTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = make_profile('owner', city='Charleston', state='SC')
+        self.room = make_room(self.owner, 'Room')
+
+    def test_validation_reads_only_the_header(self):
+        fits, too_big = photo(100, 80), photo(100, 80)
+        with mock.patch.object(Image.Image, 'load', side_effect=AssertionError('decoded pixels')):
+            validate_room_image(fits)
+            with mock.patch.object(uploads, 'MAX_PIXELS', 100 * 80 - 1), \
+                    self.assertRaisesMessage(ValidationError, 'megapixels'):
+                validate_room_image(too_big)
+
+    def test_validation_refuses_bad_uploads(self):
+        with self.assertRaisesMessage(ValidationError, 'Invalid image file'):
+            validate_room_image(SimpleUploadedFile('photo.jpg', b'not an image'))
+        with self.assertRaisesMessage(ValidationError, 'Unsupported image format'):
+            validate_room_image(photo(10, 10, 'GIF', 'photo.gif'))
+        with self.assertRaisesMessage(ValidationError, 'too large'):
+            validate_room_image(SimpleUploadedFile('photo.jpg', b'0' * (5 * 1024 * 1024 + 1)))
+
+    def test_an_image_the_form_opened_is_not_opened_again(self):
+        upload = photo(100, 80)
+        upload.image = Image.open(io.BytesIO(upload.read()))
+        upload.seek(0)
+        with mock.patch.object(uploads.Image, 'open', side_effect=AssertionError('opened again')):
+            self.assertEqual(uploads.sniff(upload), ('JPEG', 100, 80))
+
+    def test_large_photos_are_rotated_shrunk_and_stripped(self):
+        upload = photo(4000, 3000, orientation=6)
+        original_size = upload.size
+        image = RoomImage.objects.create(room=self.room, image=upload)
+        with Image.open(image.image.path) as stored:
+            # Turned upright by the EXIF orientation, then capped at ROOM_IMAGE_MAX_EDGE
+            self.assertEqual(stored.size, (1536, uploads.ROOM_IMAGE_MAX_EDGE))
+            self.assertEqual(stored.format, 'JPEG')
+            self.assertNotIn('exif', stored.info)
+        self.assertLess(image.image.size, original_size)
+
+    def test_formats_kept_or_converted(self):
+        flat = RoomImage.objects.create(room=self.room, image=photo(50, 40, 'PNG', 'flat.png'))
+        self.assertTrue(flat.image.name.endswith('.jpg'))
+        transparent = RoomImage.objects.create(room=self.room, image=photo(50, 40, 'PNG', 'logo.png', 'RGBA'))
+        self.assertTrue(transparent.image.name.endswith('.png'))
+        self.owner.profile_photo = photo(3000, 3000, 'WEBP', 'me.webp')
+        self.owner.save()
+        with Image.open(self.owner.profile_photo.path) as stored:
+            self.assertEqual((stored.format, stored.size), ('WEBP', (1024, 1024)))
+
+    def test_saving_again_does_not_reencode(self):
+        self.owner.profile_photo = photo(300, 300)
+        self.owner.save()
+        name = self.owner.profile_photo.name
+        with mock.patch.object(uploads.Image, 'open', side_effect=AssertionError('decoded again')):
+            self.owner.save()
+        self.assertEqual(Profile.objects.get(pk=self.owner.pk).profile_photo.name, name)
+
+
+class ImagePlaceholderTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = make_profile('owner', city='Charleston', state='SC')
+        self.room = make_room(self.owner, 'Room')
+
+    def upload(self, room=None, color='red'):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = RoomImage.objects.create(room=room or self.room, image=jpeg(color))
+        run_jobs()
+        image.refresh_from_db()
+        return image
+
+    def test_placeholder_is_a_tiny_inline_jpeg(self):
+        image = self.upload()
+        prefix = 'data:image/jpeg;base64,'
+        self.assertTrue(image.placeholder.startswith(prefix))
+        self.assertLess(len(image.placeholder), 1000)
+        with Image.open(io.BytesIO(base64.b64decode(image.placeholder[len(prefix):]))) as thumbnail:
+            self.assertEqual(thumbnail.size, (renditions.PLACEHOLDER_EDGE, 12))
+
+    def test_new_upload_clears_the_old_placeholder(self):
+        image = self.upload()
+        image.image = jpeg('blue', 'new.jpg')
+        image.save()
+        self.assertEqual(RoomImage.objects.get(pk=image.pk).placeholder, '')
+
+    def test_same_photo_reuses_the_placeholder(self):
+        first = self.upload()
+        with mock.patch.object(renditions, 'render', side_effect=AssertionError('rendered again')):
+            second = self.upload(make_room(self.owner, 'Other room'))
+        self.assertEqual(second.placeholder, first.placeholder)
+
+    def test_cards_lazy_load_over_the_placeholder(self):
+        image = self.upload()
+        response = self.client.get('/')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, f'background: url({image.placeholder}) center / cover no-repeat;')
+        # The box is reserved before the photo arrives
+        self.assertContains(response, 'width="400" height="267"')
+
+    def test_detail_photo_loads_eagerly(self):
+        self.upload()
+        self.client.force_login(self.owner.user)
+        self.assertContains(self.client.get(f'/rooms/{self.room.pk}/'), 'loading="eager"')
+
+    def test_command_fills_missing_placeholders(self):
+        self.upload()
+        RoomImage.objects.update(placeholder='')
+        call_command('build_renditions', workers=1, stdout=io.StringIO())
+        self.assertTrue(RoomImage.objects.get().placeholder)
+
+
+class ContentAddressedStorageTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        owner = make_profile('owner', city='Charleston', state='SC')
+        self.room = make_room(owner, 'Room')
+        self.other_room = make_room(owner, 'Other room')
+
+    def test_same_bytes_stored_once(self):
+        first = default_storage.save('room_images/one.jpg', ContentFile(b'same bytes'))
+        second = default_storage.save('room_images/two.JPG', ContentFile(b'same bytes'))
+        self.assertEqual(first, second)
+        self.assertRegex(first, r'^room_images/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertTrue(storage.is_immutable(first))
+        self.assertEqual(MediaBlob.objects.get(name=first).references, 2)
+
+    def test_file_goes_with_the_last_reference(self):
+        name = default_storage.save('room_images/one.jpg', ContentFile(b'same bytes'))
+        default_storage.save('room_images/two.jpg', ContentFile(b'same bytes'))
+        default_storage.delete(name)
+        self.assertTrue(self.stored(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).references, 1)
+        default_storage.delete(name)
+        self.assertFalse(self.stored(name))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_other_names_kept_as_given(self):
+        name = default_storage.save('misc/notes.txt', ContentFile(b'hi'))
+        self.assertEqual(name, 'misc/notes.txt')
+        self.assertFalse(storage.is_immutable(name))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_rows_share_the_file_and_its_renditions(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = RoomImage.objects.create(room=self.room, image=jpeg(name='one.jpg'))
+            second = RoomImage.objects.create(room=self.other_room, image=jpeg(name='two.jpg'))
+        run_jobs()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(MediaBlob.objects.get().references, 2)
+        self.assertTrue(second.renditions_ready)
+        self.assertEqual(ImageRendition.objects.filter(source=first.image.name).count(), 8)
+
+        name = first.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        run_jobs()
+        self.assertTrue(self.stored(name))
+        self.assertEqual(MediaBlob.objects.get().references, 1)
+        self.assertEqual(ImageRendition.objects.count(), 8)
+
+        rendered = list(ImageRendition.objects.values_list('file', flat=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        run_jobs()
+        self.assertFalse(self.stored(name))
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(ImageRendition.objects.exists())
+        self.assertFalse(any(self.stored(rendition) for rendition in rendered))
+
+    def test_reupload_of_same_bytes_keeps_one_reference(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = RoomImage.objects.create(room=self.room, image=jpeg())
+        run_jobs()
+        name = image.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            image.image = jpeg(name='again.jpg')
+            image.save()
+        run_jobs()
+        self.assertEqual(image.image.name, name)
+        self.assertEqual(MediaBlob.objects.get().references, 1)
+        self.assertTrue(self.stored(name))
+
+
+@override_settings(MEDIA_SENDFILE='')
+class MediaServingTests(TemporaryMediaMixin, TestCase):
+    DATA = bytes(range(256)) * 40
+    URL = '/media/room_images/flat.jpg'
+
+    def setUp(self):
+        super().setUp()
+        self.blob = 'room_images/ab/ab' + 'c' * 62 + '.jpg'
+        for name in ('room_images/flat.jpg', self.blob):
+            path = os.path.join(self.media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(self.DATA)
+
+    def body(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_full_response(self):
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.DATA)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], str(len(self.DATA)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertNotIn('Cache-Control', response)
+
+    def test_hashed_names_are_immutable(self):
+        response = self.client.get(f'/media/{self.blob}')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    def test_renditions_of_hashed_names_are_immutable(self):
+        names = {
+            renditions.rendition_name(self.blob, 'card', 400, 'webp'): True,
+            renditions.rendition_name('room_images/flat.jpg', 'card', 400, 'webp'): False,
+        }
+        for name, immutable in names.items():
+            path = os.path.join(self.media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(self.DATA)
+            response = self.client.get(f'/media/{name}')
+            self.assertEqual(response.get('Cache-Control') == 'public, max-age=31536000, immutable', immutable, name)
+            # Still blobs only when it comes to reference counting
+            self.assertFalse(storage.is_immutable(name))
+
+    def test_conditional_requests(self):
+        response = self.client.get(self.URL)
+        etag = response['ETag']
+        response = self.client.get(self.URL, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get(self.URL, headers={'If-Modified-Since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_ranges(self):
+        size = len(self.DATA)
+        response = self.client.get(self.URL, headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), self.DATA[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{size}')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.body(self.client.get(self.URL, headers={'Range': 'bytes=-5'})), self.DATA[-5:])
+        self.assertEqual(self.body(self.client.get(self.URL, headers={'Range': 'bytes=10000-'})), self.DATA[10000:])
+
+        response = self.client.get(self.URL, headers={'Range': f'bytes={size}-'})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+        # Several ranges are answered with the whole file
+        self.assertEqual(self.client.get(self.URL, headers={'Range': 'bytes=0-1,5-6'}).status_code, 200)
+
+    def test_if_range(self):
+        etag = self.client.get(self.URL)['ETag']
+        response = self.client.get(self.URL, headers={'Range': 'bytes=0-1', 'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.URL, headers={'Range': 'bytes=0-1', 'If-Range': etag})
+        self.assertEqual(response.status_code, 206)
+
+    def test_missing_files(self):
+        self.assertEqual(self.client.get('/media/room_images/missing.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/media/room_images/').status_code, 404)
+        self.assertIn(self.client.get('/media/../settings.py').status_code, (400, 404))
+
+    def test_sendfile(self):
+        with self.settings(MEDIA_SENDFILE='x-accel-redirect'):
+            response = self.client.get(self.URL)
+            self.assertEqual(response['X-Accel-Redirect'], '/protected-media/room_images/flat.jpg')
+            self.assertEqual(response.content, b'')
+        with self.settings(MEDIA_SENDFILE='x-sendfile'):
+            response = self.client.get(self.URL)
+            self.assertEqual(response['X-Sendfile'], os.path.join(self.media_root, 'room_images', 'flat.jpg'))
+
+    async def test_streams_under_asgi(self):
+        response = await self.async_client.get(self.URL, headers={'Range': 'bytes=10-19'})
+        self.assertTrue(response.is_async)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), self.DATA[10:20])
+
+
+CALLS = []
+
+
+@jobs.job
+def record_call(value, extra=0):
+    CALLS.append((value, extra))
+
+
+@jobs.job(max_attempts=2)
+def always_fails():
+    raise RuntimeError('broken')
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_runs_by_priority_then_age(self):
+        jobs.enqueue(record_call, 1)
+        jobs.enqueue(record_call, 2, extra=5, priority=jobs.HIGH)
+        jobs.enqueue(record_call, 3, delay=60)
+        self.assertEqual(jobs.work(burst=True), (2, 0))
+        self.assertEqual(CALLS, [(2, 5), (1, 0)])
+        # The delayed one waits
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_only_registered_functions(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue(make_profile, 'nobody')
+
+    def test_rolled_back_enqueue_is_dropped(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            jobs.enqueue(record_call, 1)
+            raise ValueError
+        self.assertFalse(Job.objects.exists())
+
+    def test_failure_is_retried_with_backoff_then_kept(self):
+        jobs.enqueue(always_fails)
+        with self.assertLogs('core.jobs', 'ERROR'):
+            self.assertEqual(jobs.work(burst=True), (0, 1))
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn('RuntimeError', job.last_error)
+        self.assertGreater(job.available_at, timezone.now())
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            run_jobs()
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertEqual(run_jobs(), (0, 0))
+
+    def test_claim_is_exclusive_until_it_times_out(self):
+        jobs.enqueue(record_call, 7)
+        lost = jobs.claim('lost-worker')
+        self.assertIsNotNone(lost)
+        self.assertIsNone(jobs.claim('other-worker'))
+
+        Job.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+        reclaimed = jobs.claim('other-worker')
+        self.assertEqual(reclaimed.attempts, 2)
+        # The first worker finishing late leaves the new claim alone
+        self.assertTrue(jobs.run(lost))
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertTrue(jobs.run(reclaimed))
+        self.assertFalse(Job.objects.exists())
+
+    def test_lost_claims_use_up_attempts(self):
+        jobs.enqueue(always_fails)
+        for worker in ('a', 'b'):
+            jobs.claim(worker)
+            Job.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+        self.assertFalse(jobs.run(jobs.claim('c')))
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+
+    def test_runworker_command(self):
+        jobs.enqueue(record_call, 9)
+        out = io.StringIO()
+        call_command('runworker', burst=True, stdout=out)
+        self.assertIn('Ran 1 jobs (0 failed)', out.getvalue())
+        self.assertEqual(CALLS, [(9, 0)])
+
+
+class DeferredMediaDeletionTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = make_profile('owner', city='Charleston', state='SC')
+        self.room = make_room(self.owner, 'Room')
+
+    def upload(self, color='red'):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = RoomImage.objects.create(room=self.room, image=jpeg(color))
+        run_jobs()
+        return image
+
+    def files(self):
+        """Every stored file of the room images, renditions included."""
+        names = list(RoomImage.objects.values_list('image', flat=True))
+        return names + list(ImageRendition.objects.values_list('file', flat=True))
+
+    def test_deleting_a_room_queues_its_files_for_one_purge(self):
+        self.upload('red')
+        self.upload('blue')
+        names = self.files()
+        self.assertEqual(len(names), 18)
+        self.room.delete()
+        # Nothing is removed in the request itself
+        self.assertTrue(all(self.stored(name) for name in names))
+        self.assertEqual(set(MediaDeletion.objects.values_list('name', flat=True)), set(names))
+        self.assertEqual(Job.objects.filter(name='core.storage.purge_deleted').count(), 1)
+        run_jobs()
+        self.assertFalse(any(self.stored(name) for name in names))
+        self.assertFalse(MediaDeletion.objects.exists())
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_deleting_a_profile_queues_its_photo_and_rooms(self):
+        self.owner.profile_photo = jpeg('green', 'me.jpg')
+        self.owner.save()
+        photo_name = self.owner.profile_photo.name
+        self.upload()
+        names = self.files()
+        self.owner.user.delete()
+        self.assertTrue(self.stored(photo_name))
+        run_jobs()
+        self.assertFalse(any(self.stored(name) for name in [photo_name, *names]))
+
+    def test_a_rolled_back_delete_queues_nothing(self):
+        self.upload()
+        with contextlib.suppress(RuntimeError), transaction.atomic():
+            self.room.delete()
+            raise RuntimeError
+        self.assertFalse(MediaDeletion.objects.exists())
+        self.assertTrue(all(self.stored(name) for name in self.files()))
+
+    def test_replaced_files_are_queued(self):
+        image = self.upload()
+        old = image.image.name
+        image.image = jpeg('blue', 'new.jpg')
+        image.save()
+        self.assertIn(old, MediaDeletion.objects.values_list('name', flat=True))
+        run_jobs()
+        self.assertFalse(self.stored(old))
+        self.assertTrue(self.stored(image.image.name))
+
+    def test_files_in_use_again_are_kept(self):
+        name = default_storage.save('room_images/renditions/kept.jpg', ContentFile(b'rendition'))
+        storage.delete_later([name])
+        ImageRendition.objects.create(
+            source='room_images/kept.jpg', kind='card', width=400, format='jpg', file=name,
+            pixel_width=400, pixel_height=267, bytes=9,
+        )
+        storage.purge_deleted()
+        self.assertTrue(self.stored(name))
+        self.assertFalse(MediaDeletion.objects.exists())
+
+    def test_purge_works_through_every_batch(self):
+        names = [default_storage.save(f'misc/{number}.txt', ContentFile(b'old')) for number in range(5)]
+        storage.delete_later(names)
+        with mock.patch.object(storage, 'PURGE_BATCH', 2):
+            storage.purge_deleted()
+        self.assertFalse(any(self.stored(name) for name in names))
+        self.assertFalse(MediaDeletion.objects.exists())
@@ -0,0 +1,125 @@
+"""
+Checking and normalizing uploaded photos.
+
+ImageUploadValidator checks an upload from its header alone: Pillow's
+Image.open() reads the format and dimensions without decoding any pixels, and
+when a form's ImageField has already opened the file its result is reused.
+Anything over MAX_PIXELS is refused before it can be decoded (a
+"decompression bomb").
+
+ingest() then decodes the upload once when the model is saved. It applies and
+drops the EXIF orientation, strips the remaining metadata (camera, GPS),
+shrinks the photo to the field's maximum edge, and re-encodes it. JPEG and
+WebP keep their format. PNGs become JPEG unless they use transparency. The
+renditions are made later by a background job, from this already shrunk copy
+(see core/renditions.py).
+"""
+import posixpath
+from io import BytesIO
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.utils.deconstruct import deconstructible
+from PIL import Image, ImageOps
+
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'WEBP')
+
+# Largest width x height accepted, well under what a phone camera produces
+MAX_PIXELS = 40_000_000
+
+# Longest edge kept for each kind of upload
+ROOM_IMAGE_MAX_EDGE = 2048
+PROFILE_PHOTO_MAX_EDGE = 1024
+
+QUALITY = 85
+
+_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+
+def sniff(upload):
+    """(format, width, height) from the file's header, without decoding the pixels."""
+    # forms.ImageField has already opened and verified the file
+    image = getattr(upload, 'image', None)
+    if image is not None:
+        return image.format, image.width, image.height
+    position = upload.tell()
+    try:
+        with Image.open(upload) as image:
+            return image.format, image.width, image.height
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        raise ValidationError("Invalid image file")
+    finally:
+        upload.seek(position)
+
+
+@deconstructible
+class ImageUploadValidator:
+    """Size, format and resolution limits for a photo upload."""
+
+    def __init__(self, max_bytes, label='Image'):
+        self.max_bytes = max_bytes
+        self.label = label
+
+    def __call__(self, upload):
+        if upload.size > self.max_bytes:
+            raise ValidationError(f"{self.label} file too large ( > {self.max_bytes // (1024 * 1024)}MB )")
+        image_format, width, height = sniff(upload)
+        if image_format not in ALLOWED_FORMATS:
+            raise ValidationError(f"Unsupported image format. Allowed: {', '.join(ALLOWED_FORMATS)}")
+        if width * height > MAX_PIXELS:
+            raise ValidationError(f"Image resolution too large ( > {MAX_PIXELS // 1_000_000} megapixels )")
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, ImageUploadValidator)
+            and (self.max_bytes, self.label) == (other.max_bytes, other.label)
+        )
+
+
+def is_new(fieldfile):
+    """Whether ``fieldfile`` holds an upload that has not been stored yet."""
+    return bool(fieldfile) and not fieldfile._committed
+
+
+def ingest(fieldfile, max_edge):
+    """
+    Re-encode a new upload in place before it is stored, and return the
+    decoded image (or None if there was no new upload).
+    """
+    if not is_new(fieldfile):
+        return None
+    fieldfile.file.seek(0)
+    image = Image.open(fieldfile.file)
+    if image.width * image.height > MAX_PIXELS:
+        raise ValidationError(f"Image resolution too large ( > {MAX_PIXELS // 1_000_000} megapixels )")
+    source_format = image.format
+    # JPEG can decode straight at a fraction of full size, which is much cheaper
+    image.draft('RGB', (max_edge, max_edge))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if source_format == 'PNG' and has_alpha:
+        target = 'PNG'
+    elif source_format == 'WEBP':
+        target = 'WEBP'
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    else:
+        target = 'JPEG'
+        image = image.convert('RGB')
+
+    buffer = BytesIO()
+    # Only the colour profile survives; EXIF and other metadata are dropped
+    options = {'icc_profile': image.info.get('icc_profile')}
+    if target == 'PNG':
+        options['optimize'] = True
+    else:
+        options.update(quality=QUALITY, optimize=True)
+        if target == 'JPEG':
+            options['progressive'] = True
+    image.save(buffer, target, **{k: v for k, v in options.items() if v is not None})
+
+    root, _ = posixpath.splitext(posixpath.basename(fieldfile.name))
+    fieldfile.file = ContentFile(buffer.getvalue(), name=root + _EXTENSIONS[target])
+    fieldfile.name = fieldfile.file.name
+    return image
@@ -1,14 +1,78 @@
+import math
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.db.models import Q
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, logout
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.models import User
-from django.http import JsonResponse
-from django.core.paginator import Paginator
-from .models import Profile, Room, Message, RoomType, Amenity
+from django.http import JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.views.decorators.http import require_POST
+from .models import Profile, Room, Message, ConversationParticipant, RoomType, Amenity
 from .forms import ProfileForm, RoomForm, UserRegistrationForm, MessageForm
+from . import cities, conversations, facets, geo, matching, media, realtime, search, similar
+from .pagination import KeysetPaginator, cached_count
+
+
+# Keyset orderings for list views; each ends with a unique column
+PROFILE_SORTS = {
+    'relevance': ('search_rank', 'id'),
+    'newest': ('-created_at', '-id'),
+    'oldest': ('created_at', 'id'),
+    'name': ('name', 'id'),
+    'age_youngest': ('age', 'id'),
+    'age_oldest': ('-age', '-id'),
+    'distance': ('distance_miles', 'id'),
+    'match': ('-match_score', 'id'),
+}
+
+ROOM_SORTS = {
+    'relevance': ('search_rank', 'id'),
+    'newest': ('-created_at', '-id'),
+    'price_low': ('price', 'id'),
+    'price_high': ('-price', '-id'),
+    'distance': ('distance_miles', 'id'),
+}
+
+INBOX_SORT = ('-last_activity', '-id')
+
+
+def _query_without(request, *keys):
+    """Current query string minus ``keys``, for building pagination links."""
+    params = request.GET.copy()
+    for key in keys:
+        params.pop(key, None)
+    return params.urlencode()
+
+
+def _radius_filter(request):
+    """
+    (lat, lon, miles) for a "within N miles" filter, or None if none was asked for.
+
+    The origin is the ``near`` ZIP code or city, else the user's own location.
+    """
+    try:
+        miles = float(request.GET.get('radius') or 0)
+    except ValueError:
+        return None
+    # 'nan' and 'inf' parse as floats too
+    if not math.isfinite(miles) or miles <= 0:
+        return None
+    miles = min(miles, 500)
+    near = request.GET.get('near', '')
+    if near:
+        latitude, longitude = geo.locate_text(near)
+    elif request.user.is_authenticated and hasattr(request.user, 'profile'):
+        latitude, longitude = request.user.profile.latitude, request.user.profile.longitude
+    else:
+        latitude = longitude = None
+    return latitude, longitude, miles
+
+
+# Cards per page (and per "load more") on the home feed
+HOME_PAGE_SIZE = 12
 
 
 def home(request):
@@ -36,7 +100,7 @@ def home(request):
     guests_allowed_filter = request.GET.get('guests_allowed', '')
 
     # Filter Profiles - only show people looking for rooms by default
-    profiles = Profile.objects.filter(is_looking_for_room=True)
+    profiles = Profile.objects.for_cards().filter(is_looking_for_room=True)
     
     # Exclude current user's profile if logged in
     if request.user.is_authenticated and hasattr(request.user, 'profile'):
@@ -46,15 +110,8 @@ def home(request):
         user_gender = request.user.profile.gender
         profiles = profiles.filter(gender=user_gender)
 
-    if search_query:
-        profiles = profiles.filter(
-            Q(name__icontains=search_query) |
-            Q(city__icontains=search_query) |
-            Q(bio__icontains=search_query)
-        )
-
     if city_filter:
-        profiles = profiles.filter(city__icontains=city_filter)
+        profiles = profiles.filter(cities.city_filter(city_filter))
     if gender_filter:
         profiles = profiles.filter(gender=gender_filter)
     if preference_filter:
@@ -72,44 +129,78 @@ def home(request):
                 profiles = profiles.filter(is_looking_for_room=True)
             elif preference_filter == 'offering_room':
                 # Show people offering rooms (not looking for rooms)
-                profiles = Profile.objects.filter(is_looking_for_room=False)
+                profiles = Profile.objects.for_cards().filter(is_looking_for_room=False)
             else:
                 profiles = profiles.filter(**{field: True})
 
+    radius = _radius_filter(request)
+    if radius:
+        profiles = geo.apply_radius(profiles, *radius)
+
+    # Full-text search runs last so it ranks only the filtered profiles
+    profiles = search.apply_search(profiles, search_query)
+
     # Filter Rooms
-    available_rooms = Room.objects.filter(is_active=True)
+    available_rooms = Room.objects.for_cards().filter(is_active=True)
     
-    # Automatically filter by user's city if logged in and no explicit city filter
+    # Automatically filter by user's city if logged in and no explicit city or distance filter
     if request.user.is_authenticated and hasattr(request.user, 'profile'):
-        user_city = request.user.profile.city
+        user_city = request.user.profile.canonical_city_id
         # If user has a city and hasn't explicitly filtered by another city, show their city
-        if user_city and not city_filter:
-            available_rooms = available_rooms.filter(city__icontains=user_city)
+        if user_city and not city_filter and not radius:
+            available_rooms = available_rooms.filter(canonical_city=user_city)
     
-    if search_query:
-        available_rooms = available_rooms.filter(
-            Q(title__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(city__icontains=search_query)
-        )
     if city_filter:
-        available_rooms = available_rooms.filter(city__icontains=city_filter)
+        available_rooms = available_rooms.filter(cities.city_filter(city_filter))
     if preference_filter in ['only_eats_zabihah', 'prayer_friendly', 'guests_allowed']:
         available_rooms = available_rooms.filter(**{preference_filter: True})
+    if radius:
+        available_rooms = geo.apply_radius(available_rooms, *radius)
+    available_rooms = search.apply_search(available_rooms, search_query)
+
+    # Stored matches lead the feed unless the user searched or asked for nearest first
+    sort_by = 'relevance' if search_query else 'distance' if radius else 'newest'
+    profile_sort = sort_by
+    total_matches = None
+    if request.user.is_authenticated and hasattr(request.user, 'profile'):
+        total_matches = matching.ensure_matches(request.user.profile)
+        profiles = matching.annotate_stored(profiles, request.user.profile)
+        if sort_by == 'newest':
+            profile_sort = 'match'
+
+    # Bounded feeds; "load more" asks for the next page of one feed as a fragment
+    room_pages = KeysetPaginator(available_rooms, ROOM_SORTS[sort_by], per_page=HOME_PAGE_SIZE)
+    profile_pages = KeysetPaginator(profiles, PROFILE_SORTS[profile_sort], per_page=HOME_PAGE_SIZE)
+
+    fragment = request.GET.get('fragment')
+    if fragment in ('rooms', 'profiles'):
+        pages, template, name = {
+            'rooms': (room_pages, 'partials/room_cards.html', 'available_rooms'),
+            'profiles': (profile_pages, 'partials/profile_cards.html', 'profiles'),
+        }[fragment]
+        page = pages.get_page(request.GET.get('cursor'))
+        return JsonResponse({
+            'html': render_to_string(template, {name: page}, request=request),
+            'next_cursor': page.next_cursor,
+        })
 
     # Unique cities for filter dropdowns
-    cities = Profile.objects.values_list('city', flat=True).distinct().order_by('city')
+    city_options = facets.values('profile_city')
 
     context = {
-        'profiles': profiles,
-        'available_rooms': available_rooms,
-        'cities': cities,
+        'profiles': profile_pages.get_page(),
+        'available_rooms': room_pages.get_page(),
+        'cities': city_options,
         'search_query': search_query,
         'city_filter': city_filter,
         'gender_filter': gender_filter,
         'preference_filter': preference_filter,
-        'profile_count': profiles.count(),
-        'rooms_count': available_rooms.count(),
+        'radius_filter': request.GET.get('radius', ''),
+        'near_filter': request.GET.get('near', ''),
+        'radius_choices': geo.RADIUS_CHOICES,
+        'profile_count': cached_count(profiles),
+        'rooms_count': cached_count(available_rooms),
+        'base_query': _query_without(request, 'cursor', 'fragment'),
     }
 
     # Add enhanced filter context
@@ -119,7 +210,7 @@ def home(request):
         'only_eats_zabihah_filter': only_eats_zabihah_filter,
         'prayer_friendly_filter': prayer_friendly_filter,
         'guests_allowed_filter': guests_allowed_filter,
-        'total_matches': 42,  # Placeholder
+        'total_matches': total_matches,
     })
 
     return render(request, 'home_enhanced.html', context)
@@ -140,30 +231,22 @@ def browse_profiles(request):
     only_eats_zabihah = request.GET.get('only_eats_zabihah', '')
     prayer_friendly = request.GET.get('prayer_friendly', '')
     guests_allowed = request.GET.get('guests_allowed', '')
-    sort_by = request.GET.get('sort', 'newest')
+    # Searches default to best match first
+    sort_by = request.GET.get('sort') or ('relevance' if search_query else 'newest')
     
     # Start with all profiles
-    profiles = Profile.objects.all()
+    profiles = Profile.objects.for_cards()
     
     # Exclude current user's profile if logged in
     if request.user.is_authenticated and hasattr(request.user, 'profile'):
         profiles = profiles.exclude(id=request.user.profile.id)
     
     # Apply filters
-    if search_query:
-        profiles = profiles.filter(
-            Q(name__icontains=search_query) |
-            Q(city__icontains=search_query) |
-            Q(state__icontains=search_query) |
-            Q(bio__icontains=search_query) |
-            Q(neighborhood__icontains=search_query)
-        )
-    
     if city_filter:
-        profiles = profiles.filter(city__icontains=city_filter)
+        profiles = profiles.filter(cities.city_filter(city_filter))
     
     if state_filter:
-        profiles = profiles.filter(state__icontains=state_filter)
+        profiles = profiles.in_area(state=state_filter)
     
     if gender_filter:
         profiles = profiles.filter(gender=gender_filter)
@@ -196,33 +279,31 @@ def browse_profiles(request):
     if guests_allowed:
         profiles = profiles.filter(guests_allowed=True)
     
-    # Apply sorting
-    if sort_by == 'newest':
-        profiles = profiles.order_by('-created_at')
-    elif sort_by == 'oldest':
-        profiles = profiles.order_by('created_at')
-    elif sort_by == 'name':
-        profiles = profiles.order_by('name')
-    elif sort_by == 'age_youngest':
-        profiles = profiles.order_by('age')
-    elif sort_by == 'age_oldest':
-        profiles = profiles.order_by('-age')
-    else:
-        profiles = profiles.order_by('-created_at')
+    profiles = search.apply_search(profiles, search_query)
+    total_profiles = cached_count(profiles)
+    
+    # Apply sorting; relevance is only available for searches, match only for signed-in users
+    has_profile = request.user.is_authenticated and hasattr(request.user, 'profile')
+    total_matches = None
+    if sort_by == 'match' and has_profile:
+        total_matches = matching.ensure_matches(request.user.profile)
+        profiles = matching.annotate_stored(profiles, request.user.profile)
+    elif (sort_by == 'relevance' and not search_query) or sort_by in ('distance', 'match'):
+        sort_by = 'newest'
+    ordering = PROFILE_SORTS.get(sort_by, PROFILE_SORTS['newest'])
     
-    # Pagination
-    paginator = Paginator(profiles, 12)  # Show 12 profiles per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Cursor pagination: every page costs the same as the first
+    paginator = KeysetPaginator(profiles, ordering, per_page=12)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     
     # Get unique values for filter dropdowns
-    cities = Profile.objects.values_list('city', flat=True).distinct().order_by('city')
-    states = Profile.objects.values_list('state', flat=True).distinct().order_by('state')
+    city_options = facets.values('profile_city')
+    states = facets.values('profile_state')
     
     context = {
         'page_obj': page_obj,
         'profiles': page_obj,
-        'cities': cities,
+        'cities': city_options,
         'states': states,
         'search_query': search_query,
         'city_filter': city_filter,
@@ -235,7 +316,10 @@ def browse_profiles(request):
         'prayer_friendly': prayer_friendly,
         'guests_allowed': guests_allowed,
         'sort_by': sort_by,
-        'total_profiles': paginator.count,
+        'total_profiles': total_profiles,
+        'total_matches': total_matches,
+        'can_match': has_profile,
+        'base_query': _query_without(request, 'cursor'),
     }
     
     return render(request, 'browse_profiles.html', context)
@@ -245,28 +329,11 @@ def profile_detail(request, profile_id):
     """
     Display a single profile with similar profile suggestions.
     """
-    profile = get_object_or_404(Profile, id=profile_id)
-
-    # Similar profiles: same city -> Charleston metro
-    similar_profiles_list = []
-    similar_profiles = Profile.objects.exclude(id=profile.id)
-
-    if len(similar_profiles_list) < 3:
-        city_matches = similar_profiles.filter(city=profile.city).exclude(
-            id__in=[p.id for p in similar_profiles_list]
-        )[:3-len(similar_profiles_list)]
-        similar_profiles_list.extend(city_matches)
-
-    if len(similar_profiles_list) < 3 and profile.is_charleston_area():
-        charleston_cities = ['charleston', 'mount pleasant', 'west ashley']
-        metro_matches = similar_profiles.filter(
-            city__iregex=r'(' + '|'.join(charleston_cities) + ')'
-        ).exclude(id__in=[p.id for p in similar_profiles_list])[:3-len(similar_profiles_list)]
-        similar_profiles_list.extend(metro_matches)
+    profile = get_object_or_404(Profile.objects.select_related('canonical_city'), id=profile_id)
 
     context = {
         'profile': profile,
-        'similar_profiles': similar_profiles_list,
+        'similar_profiles': similar.similar_profiles(profile),
     }
 
     return render(request, 'profile_detail.html', context)
@@ -278,7 +345,7 @@ def room_detail(request, pk):
     """
     Display a single room listing.
     """
-    room = get_object_or_404(Room, pk=pk)
+    room = get_object_or_404(Room.objects.select_related('primary_image'), pk=pk)
     return render(request, "room_detail.html", {"room": room})  # ✅ fixed
 
 
@@ -498,14 +565,17 @@ def my_listings(request):
     except Profile.DoesNotExist:
         return redirect('create_profile')
 
-    user_rooms = Room.objects.filter(user=profile)
+    user_rooms = Room.objects.for_cards().filter(user=profile)
     return render(request, 'my_listings.html', {'rooms': user_rooms})
 
 
 def advanced_search(request):
     """
-    Advanced room search by rent, availability date, and room type.
+    Advanced room search by keyword, rent, availability date, and room type.
     """
+    search_query = request.GET.get('search', '')
+    radius = _radius_filter(request)
+    sort_by = request.GET.get('sort') or ('relevance' if search_query else 'distance' if radius else 'newest')
     min_rent = request.GET.get('min_rent', '')
     max_rent = request.GET.get('max_rent', '')
     available_date = request.GET.get('available', '')
@@ -517,14 +587,14 @@ def advanced_search(request):
 
     # Automatically filter by user's city if logged in and no explicit city filter
     if request.user.is_authenticated and hasattr(request.user, 'profile'):
-        user_city = request.user.profile.city
-        # If user has a city and hasn't explicitly filtered by another city, show their city
-        if user_city and not city_filter:
-            rooms = rooms.filter(city__icontains=user_city)
+        user_city = request.user.profile.canonical_city_id
+        # If user has a city and hasn't explicitly filtered by another city or distance, show their city
+        if user_city and not city_filter and not radius:
+            rooms = rooms.filter(canonical_city=user_city)
     
     # Apply explicit city filter if provided
     if city_filter:
-        rooms = rooms.filter(city__icontains=city_filter)
+        rooms = rooms.filter(cities.city_filter(city_filter))
 
     if min_rent:
         rooms = rooms.filter(price__gte=min_rent)
@@ -536,8 +606,16 @@ def advanced_search(request):
         rooms = rooms.filter(room_type=room_type)
     if amenities:
         rooms = rooms.filter(amenities__id__in=amenities).distinct()
+    if radius:
+        rooms = geo.apply_radius(rooms, *radius)
+    rooms = search.apply_search(rooms, search_query)
 
-    cities = Room.objects.values_list('city', flat=True).distinct().order_by('city')
+    if (sort_by == 'relevance' and not search_query) or (sort_by == 'distance' and not radius):
+        sort_by = 'newest'
+    paginator = KeysetPaginator(rooms, ROOM_SORTS.get(sort_by, ROOM_SORTS['newest']), per_page=20)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+
+    city_options = facets.values('room_city')
     rent_ranges = [
         ('0-500', 'Under $500'),
         ('500-1000', '$500 - $1000'),
@@ -547,13 +625,18 @@ def advanced_search(request):
     all_amenities = Amenity.objects.all().order_by('name')
 
     return render(request, 'advanced_search.html', {
-        'rooms': rooms,
-        'cities': cities,
+        'rooms': page_obj,
+        'page_obj': page_obj,
+        'total_rooms': cached_count(rooms),
+        'sort_by': sort_by,
+        'base_query': _query_without(request, 'cursor'),
+        'cities': city_options,
         'rent_ranges': rent_ranges,
         'filters': request.GET,
         'amenities': all_amenities,
         'room_types': RoomType.objects.all(),
         'selected_amenities': amenities,
+        'radius_choices': geo.RADIUS_CHOICES,
     })
 
 @login_required
@@ -638,8 +721,8 @@ def send_message(request, room_id=None):
 @login_required
 def inbox(request):
     """
-    Inbox showing received and sent messages with better organization.
-    Handle marking messages as read via POST request.
+    Conversations of the current profile, most recent first.
+    Threads are loaded when opened. POST {"action": "mark_read"} marks everything read.
     """
     try:
         user_profile = request.user.profile
@@ -650,27 +733,156 @@ def inbox(request):
     # Handle POST request to mark messages as read
     if request.method == 'POST':
         import json
-        from django.http import JsonResponse
         try:
             data = json.loads(request.body)
             if data.get('action') == 'mark_read':
-                # Mark all unread received messages as read
-                Message.objects.filter(
-                    recipient=user_profile, 
-                    is_read=False
-                ).update(is_read=True)
+                conversations.mark_all_read(user_profile)
                 return JsonResponse({'status': 'success'})
         except:
             pass
         return JsonResponse({'status': 'error'})
-    
-    received_messages = Message.objects.filter(recipient=user_profile).order_by('-timestamp')
-    sent_messages = Message.objects.filter(sender=user_profile).order_by('-timestamp')
 
-    return render(request, 'inbox.html', {
-        'received_messages': received_messages,
-        'sent_messages': sent_messages
-    })
+    threads = ConversationParticipant.objects.for_inbox().filter(profile=user_profile)
+    page = KeysetPaginator(threads, INBOX_SORT, per_page=conversations.INBOX_PAGE_SIZE).get_page(
+        request.GET.get('cursor')
+    )
+
+    if request.GET.get('fragment') == 'conversations':
+        return JsonResponse({
+            'html': render_to_string('partials/conversation_list.html', {'conversations': page}, request=request),
+            'next_cursor': page.next_cursor,
+        })
+
+    return render(request, 'inbox.html', {'conversations': page})
+
+
+@login_required
+def conversation_detail(request, conversation_id):
+    """
+    One conversation, newest messages last. Viewing it never changes state;
+    the page POSTs to conversation_read once the thread is on screen.
+    ?fragment=thread returns the thread for the inbox pane, ?fragment=messages
+    an older page of messages.
+    """
+    try:
+        user_profile = request.user.profile
+    except Profile.DoesNotExist:
+        messages.error(request, 'You need to create a profile first.')
+        return redirect('create_profile')
+
+    participant = get_object_or_404(
+        ConversationParticipant.objects.select_related('other', 'conversation__room'),
+        conversation=conversation_id, profile=user_profile,
+    )
+    conversation = participant.conversation
+
+    if request.method == 'POST':
+        form = MessageForm(request.POST)
+        if form.is_valid():
+            message = form.save(commit=False)
+            message.sender = user_profile
+            message.recipient = participant.other
+            message.conversation = conversation
+            message.save()
+            return redirect(conversation)
+        messages.error(request, 'Please correct the errors below.')
+    else:
+        form = MessageForm()
+
+    page = KeysetPaginator(
+        conversation.messages.all(), ('-id',), per_page=conversations.THREAD_PAGE_SIZE
+    ).get_page(request.GET.get('cursor'))
+    context = {
+        'conversation': conversation,
+        'participant': participant,
+        # Pages run newest first; show each oldest first
+        'thread': list(reversed(page.object_list)),
+        'older_cursor': page.next_cursor,
+        # Newest message shown, when it is past the read cursor
+        'read_up_to': page.object_list[0].pk if page and page.object_list[0].pk > participant.last_read_id else None,
+        # The other side's read cursor, for "Seen" marks
+        'seen_up_to': ConversationParticipant.objects.filter(
+            conversation=conversation, profile=participant.other_id
+        ).values_list('last_read_id', flat=True).first() or 0,
+        'form': form,
+    }
+
+    fragment = request.GET.get('fragment')
+    if fragment == 'messages':
+        return JsonResponse({
+            'html': render_to_string('partials/thread_messages.html', context, request=request),
+            'next_cursor': page.next_cursor,
+        })
+    if fragment == 'thread':
+        return JsonResponse({'html': render_to_string('partials/thread.html', context, request=request)})
+    return render(request, 'conversation.html', context)
+
+
+@login_required
+@require_POST
+def conversation_read(request, conversation_id):
+    """
+    Move the read cursor of a conversation up to POST ``up_to``, the newest
+    message the page displayed. Returns how many messages became read.
+    """
+    user_profile = get_object_or_404(Profile, user=request.user)
+    get_object_or_404(ConversationParticipant, conversation=conversation_id, profile=user_profile)
+    up_to = request.POST.get('up_to', '')
+    # Only ever a message of this conversation, so a bad id cannot skip unseen ones
+    message_id = (
+        Message.objects.filter(conversation=conversation_id, pk__lte=up_to).order_by('-pk')
+        .values_list('pk', flat=True).first()
+        if up_to.isdigit() else None
+    )
+    read = conversations.mark_read(conversation_id, user_profile, message_id) if message_id else 0
+    return JsonResponse({'read': read})
+
+
+@login_required
+def unread_count(request):
+    """
+    The current user's unread message count, for refreshing the navbar badge.
+    """
+    return JsonResponse({'unread': conversations.unread_total(request.user.pk)})
+
+
+@login_required
+async def event_stream(request):
+    """
+    Server-sent events for the user: new messages, read receipts and rooms
+    listed in their city. Quiet streams get a comment every
+    realtime.HEARTBEAT_INTERVAL seconds so proxies keep them open, and a
+    reconnecting browser resumes after its Last-Event-ID.
+    """
+    user = await request.auser()
+    channels = await sync_to_async(realtime.user_channels)(user.pk)
+    since = request.headers.get('Last-Event-ID', '')
+
+    async def events():
+        async for event in realtime.stream(channels, int(since) if since.isdigit() else None,
+                                           realtime.HEARTBEAT_INTERVAL):
+            yield realtime.format_sse(event)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+async def poll_events(request):
+    """
+    Long-poll fallback for event_stream(): the user's events after
+    ?since=<id>, waiting up to realtime.LONG_POLL_TIMEOUT seconds for one.
+    Without ?since= it returns at once with the id to start from.
+    """
+    user = await request.auser()
+    channels = await sync_to_async(realtime.user_channels)(user.pk)
+    since = request.GET.get('since', '')
+    if not since.isdigit():
+        return JsonResponse({'events': [], 'last_id': realtime.get_broker().last_id(channels)})
+    return JsonResponse({'events': await realtime.wait_for_events(channels, int(since))})
 
 
 @login_required
@@ -692,34 +904,55 @@ def compose_message(request, profile_id=None):
         if recipient_profile == sender_profile:
             messages.error(request, 'You cannot send a message to yourself.')
             return redirect('inbox')
+        if not Profile.objects.messageable_by(sender_profile).filter(pk=recipient_profile.pk).exists():
+            messages.error(request, 'You can only message profiles of your own gender.')
+            return redirect('inbox')
     
     if request.method == 'POST':
         form = MessageForm(request.POST)
-        recipient_id = request.POST.get('recipient_id')
+        recipient_id = request.POST.get('recipient_id', '')
+        # The same rule as recipient_search, which only suggests; the POST can name anyone
+        recipient = (
+            Profile.objects.messageable_by(sender_profile).filter(pk=recipient_id).first()
+            if recipient_id.isdigit() else None
+        )
         
-        if form.is_valid() and recipient_id:
-            recipient = get_object_or_404(Profile, id=recipient_id)
+        if form.is_valid() and recipient is not None:
             message = form.save(commit=False)
             message.sender = sender_profile
             message.recipient = recipient
             message.save()
             messages.success(request, f'Your message has been sent to {recipient.name}!')
             return redirect('inbox')
+        elif recipient is None:
+            messages.error(request, 'Please choose a recipient from the suggestions.')
         else:
             messages.error(request, 'Please correct the errors below.')
     else:
         form = MessageForm()
     
-    # Get all profiles except the current user's profile for recipient selection
-    available_profiles = Profile.objects.exclude(user=request.user).order_by('name')
-    
     return render(request, 'compose_message.html', {
         'form': form,
         'recipient_profile': recipient_profile,
-        'available_profiles': available_profiles
     })
 
 
+@login_required
+def recipient_search(request):
+    """
+    Typeahead for compose_message: profiles of the sender's gender whose name
+    starts with ?q=, at most search.TYPEAHEAD_LIMIT of them.
+    """
+    try:
+        sender_profile = request.user.profile
+    except Profile.DoesNotExist:
+        return JsonResponse({'results': []})
+
+    matches = Profile.objects.messageable_by(sender_profile).name_starts_with(request.GET.get('q', ''))
+    results = matches.order_by('name_key', 'id').values('id', 'name', 'city', 'is_looking_for_room')
+    return JsonResponse({'results': list(results[:search.TYPEAHEAD_LIMIT])})
+
+
 # -----------------------------
 # New: Room Message CRUD Views
 # -----------------------------
@@ -727,17 +960,35 @@ def compose_message(request, profile_id=None):
 @login_required
 def message_list_create(request, room_id):
     """
-    List all messages in a room + create new ones.
+    The current profile's conversation with a room's owner about the room,
+    and a form to add to it. The owner sees every conversation about the room.
     """
     room = get_object_or_404(Room, pk=room_id)
-    messages_qs = Message.objects.filter(room=room)
+    try:
+        user_profile = request.user.profile
+    except Profile.DoesNotExist:
+        messages.error(request, 'You need to create a profile before sending messages.')
+        return redirect('create_profile')
+
+    if room.user_id == user_profile.pk:
+        threads = ConversationParticipant.objects.for_inbox().filter(
+            profile=user_profile, conversation__room=room
+        ).order_by(*INBOX_SORT)
+        return render(request, 'messages/message_list.html', {
+            'room': room,
+            'conversations': threads,
+        })
+
+    conversation = conversations.find(user_profile.pk, room.user_id, room.pk)
+    messages_qs = conversation.messages.order_by('id') if conversation else Message.objects.none()
 
     if request.method == 'POST':
         form = MessageForm(request.POST)
         if form.is_valid():
             msg = form.save(commit=False)
-            msg.room = room
-            msg.sender = request.user
+            msg.sender = user_profile
+            msg.recipient_id = room.user_id
+            msg.conversation = conversation or conversations.get_or_start(user_profile.pk, room.user_id, room.pk)
             msg.save()
             return redirect('message_list_create', room_id=room.id)
     else:
@@ -753,10 +1004,10 @@ def message_list_create(request, room_id):
 @login_required
 def message_edit_delete(request, room_id, pk):
     """
-    Edit or delete a specific message in a room.
+    Edit or delete one of your own messages about a room.
     """
     room = get_object_or_404(Room, pk=room_id)
-    message_obj = get_object_or_404(Message, pk=pk, room=room)
+    message_obj = get_object_or_404(Message, pk=pk, conversation__room=room, sender__user=request.user)
 
     if request.method == 'POST':
         if 'update' in request.POST:
@@ -1098,4 +1349,12 @@ def create_test_account(request):
         return JsonResponse({
             'success': False,
             'error': str(e)
-        })
\ No newline at end of file
+        })
+
+
+def serve_media(request, path):
+    """
+    Serve an uploaded file, with conditional requests and byte ranges, or
+    hand it to the front proxy when one is configured (see core/media.py).
+    """
+    return media.serve(request, path)
@@ -0,0 +1,85 @@
+// Live events for the logged-in user (see core/realtime.py).
+// Listens to the server-sent event stream, falling back to a WebSocket and then to long polling.
+// Each event updates the navbar badge and is re-dispatched as a "realtime:event" DOM event.
+(function() {
+  const badge = document.getElementById('unreadBadge');
+  if (!badge) return;
+  let lastId = null;
+
+  function setBadge(count) {
+    badge.textContent = count;
+    badge.classList.toggle('d-none', !count);
+  }
+
+  // Re-read the badge after reading messages on the page
+  window.refreshUnreadBadge = function() {
+    fetch(badge.dataset.url)
+      .then(response => response.json())
+      .then(data => setBadge(data.unread));
+  };
+
+  function handle(event) {
+    if (lastId !== null && event.id <= lastId) return;
+    lastId = event.id;
+    if (event.unread !== undefined) setBadge(event.unread);
+    document.dispatchEvent(new CustomEvent('realtime:event', {detail: event}));
+  }
+
+  function since() {
+    return lastId === null ? '' : '?since=' + lastId;
+  }
+
+  function poll() {
+    fetch(badge.dataset.pollUrl + since())
+      .then(response => response.json())
+      .then(data => {
+        if (lastId === null && data.last_id !== undefined) lastId = data.last_id;
+        data.events.forEach(handle);
+        poll();
+      })
+      .catch(() => { setTimeout(poll, 5000); });
+  }
+
+  function connect() {
+    const scheme = window.location.protocol === 'https:' ? 'wss://' : 'ws://';
+    const socket = new WebSocket(scheme + window.location.host + badge.dataset.socketPath + since());
+    let opened = false;
+    socket.onopen = () => { opened = true; };
+    socket.onmessage = message => handle(JSON.parse(message.data));
+    socket.onclose = () => {
+      if (opened) {
+        setTimeout(connect, 2000);
+      } else {
+        poll();
+      }
+    };
+  }
+
+  function listen() {
+    const source = new EventSource(badge.dataset.streamUrl);
+    let opened = false;
+    source.onopen = () => { opened = true; };
+    source.onmessage = message => handle(JSON.parse(message.data));
+    source.onerror = () => {
+      // After a drop the browser reconnects by itself, sending Last-Event-ID
+      if (!opened) {
+        source.close();
+        fallback();
+      }
+    };
+  }
+
+  function fallback() {
+    if ('WebSocket' in window) {
+      connect();
+    } else {
+      poll();
+    }
+  }
+
+  if ('EventSource' in window) {
+    listen();
+  } else {
+    fallback();
+  }
+})();